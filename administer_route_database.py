@@ -3,10 +3,21 @@ Functions to read and write to Routes database for mountain fear finder applicat
 """
 
 import datetime as dt
+import hashlib
+import struct
+import zlib
 from pathlib import Path
+import numpy as np
 import pandas as pd
 import sqlalchemy as db
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy.exc import IntegrityError, OperationalError
+import database_engines
+import route_map_cache
+from config import Config
+
+ROUTE_DATA_HEADER = struct.Struct('<4sI')
+ROUTE_DATA_MAGIC = b'MFF1'
+LEGACY_SCORING_VERSION = 'legacy'
 
 
 def create_db_table(connection):
@@ -29,6 +40,264 @@ def create_db_table(connection):
     return waypoints
 
 
+def create_routes_table(connection):
+    """
+    Creates the routes catalog table, with one row per route holding its summary and its
+    waypoints encoded as a single blob, if the table doesn't already exist. Routes already in
+    the waypoints table are copied into a newly created catalog. Route ids are never reused, so
+    maps cached under a replaced route's id (see route_map_cache) are never served for another
+    :param connection: sqlite database connection
+    :return: sqlalchemy database table object
+    """
+    metadata = db.MetaData(connection)
+    routes = db.Table('routes', metadata,
+                      db.Column('route_id', db.Integer(), primary_key=True, autoincrement=True),
+                      db.Column('name', db.String(), nullable=False, unique=True),
+                      db.Column('content_hash', db.String(), nullable=False),
+                      db.Column('scoring_version', db.String(), nullable=False),
+                      db.Column('point_count', db.Integer(), nullable=False),
+                      db.Column('max_lat', db.Float(), nullable=False),
+                      db.Column('max_long', db.Float(), nullable=False),
+                      db.Column('min_lat', db.Float(), nullable=False),
+                      db.Column('min_long', db.Float(), nullable=False),
+                      db.Column('max_scariness', db.Integer(), nullable=False),
+                      db.Column('mean_scariness', db.Float(), nullable=False),
+                      db.Column('created_dt', db.DateTime(), nullable=False, index=True),
+                      db.Column('route_data', db.LargeBinary(), nullable=False),
+                      db.Index('ix_routes_content_hash_scoring_version', 'content_hash',
+                               'scoring_version'),
+                      sqlite_autoincrement=True)
+    new_catalog = not db.inspect(connection).has_table('routes')
+    metadata.create_all()
+    if new_catalog and db.inspect(connection).has_table('waypoints'):
+        migrate_waypoints_to_routes_table(connection)
+    return routes
+
+
+def get_route_array_bytes(route_df):
+    """
+    Gets the latitude, longitude, elevation and scariness of each waypoint in a route as
+    uncompressed columnar arrays: little endian float64 latitudes, longitudes and elevations,
+    then uint8 scariness
+    :param route_df: pandas Dataframe with columns lat, long, elevation, scariness
+    :return: bytes
+    """
+    arrays = [route_df['lat'].to_numpy(dtype='<f8'), route_df['long'].to_numpy(dtype='<f8'),
+              route_df['elevation'].to_numpy(dtype='<f8'),
+              route_df['scariness'].to_numpy(dtype='u1')]
+    return b''.join(x.tobytes() for x in arrays)
+
+
+def get_route_array_lists(route_df):
+    """
+    Gets the waypoints of a route as compact columnar lists, rounded to the precision of a gpx
+    file, for json
+    :param route_df: pandas Dataframe with columns lat, long, elevation, scariness
+    :return: dict of lists
+    """
+    return {'lat': route_df['lat'].round(6).tolist(),
+            'long': route_df['long'].round(6).tolist(),
+            'elevation': route_df['elevation'].round(1).tolist(),
+            'scariness': route_df['scariness'].astype(int).tolist()}
+
+
+def encode_route_arrays(route_df):
+    """
+    Encodes the latitude, longitude, elevation and scariness of each waypoint in a route as one
+    compressed blob of columnar arrays
+    :param route_df: pandas Dataframe with columns lat, long, elevation, scariness
+    :return: bytes
+    """
+    return ROUTE_DATA_HEADER.pack(ROUTE_DATA_MAGIC, len(route_df)) + zlib.compress(
+        get_route_array_bytes(route_df))
+
+
+def decode_route_arrays(route_data):
+    """
+    Decodes a blob made by encode_route_arrays back to a Dataframe of waypoints
+    :param route_data: bytes
+    :return: pandas Dataframe with columns waypoint, lat, long, elevation, scariness
+    """
+    magic, point_count = ROUTE_DATA_HEADER.unpack_from(route_data)
+    if magic != ROUTE_DATA_MAGIC:
+        raise ValueError('Route data is not in a recognised format')
+    arrays = zlib.decompress(route_data[ROUTE_DATA_HEADER.size:])
+    columns = {}
+    offset = 0
+    for column, dtype in [('lat', '<f8'), ('long', '<f8'), ('elevation', '<f8'),
+                          ('scariness', 'u1')]:
+        columns[column] = np.frombuffer(arrays, dtype=dtype, count=point_count, offset=offset)
+        offset += point_count * np.dtype(dtype).itemsize
+    route_df = pd.DataFrame(columns)
+    route_df['scariness'] = route_df['scariness'].astype('int64')
+    route_df.insert(0, 'waypoint', [f'WP{x+1:04}' for x in range(point_count)])
+    return route_df
+
+
+def get_route_content_hash(route_df):
+    """
+    Gets a hash of the points in a route, rounded so that small floating point differences
+    don't give a different hash. Uploaded routes are hashed as read from the gpx file, before
+    padding, so the same route is recognised whatever the file is called
+    :param route_df: pandas Dataframe with columns lat, long, elevation
+    :return: string
+    """
+    points = np.column_stack([route_df['lat'].round(6), route_df['long'].round(6),
+                              route_df['elevation'].round(1)]).astype('<f8')
+    return hashlib.sha256(points.tobytes()).hexdigest()
+
+
+def insert_route_into_routes_table(route_df, connection, content_hash, scoring_version):
+    """
+    Inserts a route prepared by prepare_route_for_insertion into the routes catalog, replacing
+    any route already stored under the same name
+    :param route_df: pd.Dataframe
+    :param connection: SQLalchemy connection
+    :param content_hash: string, from get_route_content_hash
+    :param scoring_version: string, version of the scoring algorithm used
+    """
+    routes = create_routes_table(connection)
+    row = {'name': route_df['route'].iloc[0],
+           'content_hash': content_hash,
+           'scoring_version': scoring_version,
+           'point_count': len(route_df),
+           'max_lat': float(route_df['lat'].max()), 'max_long': float(route_df['long'].max()),
+           'min_lat': float(route_df['lat'].min()), 'min_long': float(route_df['long'].min()),
+           'max_scariness': int(route_df['scariness'].max()),
+           'mean_scariness': float(route_df['scariness'].mean()),
+           'created_dt': pd.Timestamp(route_df['created_dt'].iloc[0]).to_pydatetime(),
+           'route_data': encode_route_arrays(route_df)}
+    with connection.begin():
+        old_route_id = connection.execute(
+            db.select([routes.c.route_id]).where(routes.c.name == row['name'])).scalar()
+        connection.execute(routes.delete().where(routes.c.name == row['name']))
+        connection.execute(routes.insert(), row)
+    if old_route_id is not None:
+        route_map_cache.invalidate_route(old_route_id)
+
+
+def store_route(route_df, connection, content_hash, scoring_version,
+                store_waypoints=Config.STORE_WAYPOINT_ROWS):
+    """
+    Stores a route prepared by prepare_route_for_insertion in the routes catalog and, if asked,
+    as one row per waypoint in the waypoints table
+    :param route_df: pd.Dataframe
+    :param connection: SQLalchemy connection
+    :param content_hash: string, from get_route_content_hash
+    :param scoring_version: string, version of the scoring algorithm used
+    :param store_waypoints: boolean
+    """
+    insert_route_into_routes_table(route_df, connection, content_hash, scoring_version)
+    if store_waypoints:
+        create_db_table(connection)
+        insert_route_into_db_table(route_df, connection, 'waypoints')
+
+
+def migrate_waypoints_to_routes_table(connection):
+    """
+    Copies every route in the waypoints table into the routes catalog. The original gpx points
+    aren't stored, so these are hashed on their stored waypoints and will only be matched by
+    name
+    :param connection: SQLalchemy connection
+    """
+    query = "select distinct route from waypoints"
+    for route in pd.read_sql(query, connection)['route']:
+        route_df = pd.read_sql(db.text('select * from waypoints where route = :route '
+                                       'order by length(waypoint), waypoint'),
+                               connection, params={'route': route})
+        insert_route_into_routes_table(route_df, connection, get_route_content_hash(route_df),
+                                       LEGACY_SCORING_VERSION)
+
+
+def get_route_catalog_entry(connection, route):
+    """
+    Gets the routes catalog entry for a route, without its waypoints
+    :param connection: SQLalchemy connection
+    :param route: string
+    :return: dict, or None if the route is not in the catalog
+    """
+    query = db.text('select route_id, name, content_hash, scoring_version, point_count, '
+                    'max_lat, max_long, min_lat, min_long, max_scariness, mean_scariness, '
+                    'created_dt from routes where name = :route')
+    try:
+        entry = connection.execute(query, route=route).fetchone()
+    except OperationalError:
+        return None
+    return dict(entry) if entry is not None else None
+
+
+def get_route_catalog(connection):
+    """
+    Gets the routes catalog entries of all the routes, without their waypoints
+    :param connection: SQLalchemy connection
+    :return: list of dicts
+    """
+    query = db.text('select route_id, name, content_hash, scoring_version, point_count, '
+                    'max_lat, max_long, min_lat, min_long, max_scariness, mean_scariness, '
+                    'created_dt from routes order by route_id')
+    try:
+        return [dict(x) for x in connection.execute(query).fetchall()]
+    except OperationalError:
+        return []
+
+
+def get_stored_route_name(connection, content_hash, scoring_version):
+    """
+    Gets the name of a route already in the routes catalog with the same points, scored with
+    the same version of the scoring algorithm
+    :param connection: SQLalchemy connection
+    :param content_hash: string, from get_route_content_hash
+    :param scoring_version: string
+    :return: string, or None if there is no such route
+    """
+    query = db.text('select name from routes '
+                    'where content_hash = :content_hash and scoring_version = :scoring_version')
+    try:
+        return connection.execute(query, content_hash=content_hash,
+                                  scoring_version=scoring_version).scalar()
+    except OperationalError:
+        return None
+
+
+def get_stored_content_hashes(connection, scoring_version):
+    """
+    Gets the content hashes of all the routes in the routes catalog scored with a version of the
+    scoring algorithm, with the names they are stored under
+    :param connection: SQLalchemy connection
+    :param scoring_version: string
+    :return: dict, content hash: route name
+    """
+    query = db.text('select content_hash, name from routes '
+                    'where scoring_version = :scoring_version')
+    try:
+        return dict(connection.execute(query, scoring_version=scoring_version).fetchall())
+    except OperationalError:
+        return {}
+
+
+def get_unique_route_name(connection, route_name, content_hash):
+    """
+    Gets a name to store a route under that isn't already used by a different route, so a new
+    route uploaded with the same file name as another doesn't replace it
+    :param connection: SQLalchemy connection
+    :param route_name: string
+    :param content_hash: string, from get_route_content_hash
+    :return: string
+    """
+    query = db.text('select content_hash from routes where name = :name')
+    name = route_name
+    suffix = 1
+    while True:
+        try:
+            stored_hash = connection.execute(query, name=name).scalar()
+        except OperationalError:
+            stored_hash = None
+        if stored_hash is None or stored_hash == content_hash:
+            return name
+        suffix += 1
+        name = f'{route_name}-{suffix}'
+
+
 def insert_route_into_db_table(route_df, connection, table):
     """
     Inserts a route into a database table
@@ -44,7 +313,8 @@ def insert_route_into_db_table(route_df, connection, table):
 
 def prepare_route_for_insertion(route_df, filename):
     """
-    Renames route waypoints, adds route name and created_dt to dataframe
+    Renames route waypoints, adds route name and created_dt to dataframe, and drops any OS grid
+    coordinates added for scoring (see calculate_scary_points.add_grid_coordinates)
     :param route_df: pandas Dataframe
     :param filename: string
     :return: pandas Dataframe
@@ -54,40 +324,54 @@ def prepare_route_for_insertion(route_df, filename):
     route_df.rename({'index': 'waypoint'}, axis=1, inplace=True)
     route_df['waypoint'] = route_df['waypoint'].apply(lambda x: f'WP{x+1:04}')
     route_df['route'] = Path(filename).name.replace('.gpx', '')
-    route_df.drop(['name'], axis=1, inplace=True)
+    route_df.drop(['name'] + [x for x in ['northing', 'easting'] if x in route_df], axis=1,
+                  inplace=True)
     route_df['created_dt'] = dt.datetime.now()
     return route_df
 
 
 def get_loaded_routes(connection):
     """
-    Gets a list of all the route names that have been loaded into the databases
+    Gets a list of all the route names that have been loaded into the databases, from the
+    routes catalog
     :param connection: SQLalchemy connection
     :return: list of strings
     """
-    query = "select distinct route from waypoints"
-    routes = list(pd.read_sql(query, connection)['route'])
+    query = "select name from routes order by route_id"
+    try:
+        routes = list(pd.read_sql(query, connection)['name'])
+    except OperationalError:
+        create_routes_table(connection)
+        routes = list(pd.read_sql(query, connection)['name'])
     return routes if routes else ['None']
 
 
 def get_route_db_connection():
     """
-    Gets a SQLalchemy connection to the Routes (waypoints.sqlite) database
+    Gets a SQLalchemy connection to the Routes (waypoints.sqlite) database, from the pooled
+    engine in database_engines, reused for the rest of the request
     :return: SQLalchemy Connection object
     """
-    engine = db.create_engine('sqlite:///waypoints.sqlite')
-    connection = engine.connect()
-    return connection
+    return database_engines.get_connection('waypoints')
 
 
 def get_route_from_db(connection, route):
     """
-    Gets all the Waypoints for a selected Route from the database
+    Gets all the Waypoints for a selected Route from the routes catalog, or from the waypoints
+    table if the route is not in the catalog
     :param connection: SQLalchemy connection
     :param route: string
     :return: pandas Dataframe
     """
-    query = (f'select * '
-             f'from waypoints '
-             f'where route="{route}"')
-    return pd.read_sql(query, connection)
+    try:
+        stored = connection.execute(db.text('select route_data, created_dt from routes '
+                                            'where name = :route'), route=route).fetchone()
+    except OperationalError:
+        stored = None
+    if stored is None:
+        return pd.read_sql(db.text('select * from waypoints where route = :route'), connection,
+                           params={'route': route})
+    route_df = decode_route_arrays(stored['route_data'])
+    route_df.insert(0, 'route', route)
+    route_df['created_dt'] = pd.Timestamp(stored['created_dt'])
+    return route_df
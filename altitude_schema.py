@@ -0,0 +1,345 @@
+"""
+Storage schemas for the Locations tables of the altitude database. The 'float' schema stores
+latitude, longitude and altitude as 8 byte floats, with the two floats as the primary key. The
+'compact' schema stores them as fixed point integers, latitude and longitude in units of 1e-7
+degrees (about a centimetre) and altitude in decimetres, in a WITHOUT ROWID table clustered on
+the coordinates, so a row takes about 10 bytes rather than 24 plus a rowid, and a window of
+the table is read from neighbouring pages. Rows are converted back to floats in bulk as they are
+read. Run as a script to migrate a float altitude database to the compact schema.
+Either schema can hold the coordinates as 'latlong', latitude and longitude in degrees, or as
+'grid', northing and easting in metres in the OS national grid the asc files are in, so nothing
+is converted on ingest, and only the points of a route are converted when it is scored
+"""
+
+import argparse
+import json
+import os
+import sys
+import numpy as np
+import pandas as pd
+import sqlalchemy as db
+from config import Config
+from get_db_table import GRID_TABLE_WIDTH, LONGITUDE_TABLES, LONGITUDE_TABLE_WIDTH, \
+    MIN_TABLE_LONGITUDE, get_grid_table
+
+SCHEMA_SETTINGS = {'schema': Config.ALTITUDE_SCHEMA, 'coordinates': Config.ALTITUDE_COORDINATES}
+SCHEMAS = ['float', 'compact']
+# Coordinate columns of the Locations tables, north-south first, and of routes matched to them
+COORDINATES = {'latlong': ['latitude', 'longitude'], 'grid': ['northing', 'easting']}
+ROUTE_COLUMNS = {'latitude': 'lat', 'longitude': 'long', 'northing': 'northing',
+                 'easting': 'easting'}
+COORDINATE_SCALE = 10 ** 7
+GRID_SCALE = 10
+ALTITUDE_SCALE = 10
+COMPACT_COLUMNS = {'latitude': 'lat_e7', 'longitude': 'long_e7', 'northing': 'northing_dm',
+                   'easting': 'easting_dm', 'altitude': 'altitude_dm'}
+SCALES = {'latitude': COORDINATE_SCALE, 'longitude': COORDINATE_SCALE, 'northing': GRID_SCALE,
+          'easting': GRID_SCALE, 'altitude': ALTITUDE_SCALE}
+MIGRATION_BATCH_ROWS = 200000
+
+
+def get_schema(schema=None):
+    """
+    Gets the schema to use
+    :param schema: string, 'float' or 'compact', defaults to ALTITUDE_SCHEMA in config
+    :return: string
+    """
+    schema = schema or SCHEMA_SETTINGS['schema']
+    if schema not in SCHEMAS:
+        raise ValueError(f'Altitude schema must be one of {SCHEMAS}, not {schema}')
+    return schema
+
+
+def get_coordinates(coordinates=None):
+    """
+    Gets the coordinate columns Locations are stored with
+    :param coordinates: string, 'latlong' or 'grid', defaults to ALTITUDE_COORDINATES in config
+    :return: list of strings, north-south coordinate first
+    """
+    coordinates = coordinates or SCHEMA_SETTINGS['coordinates']
+    if coordinates not in COORDINATES:
+        raise ValueError(f'Altitude coordinates must be one of {list(COORDINATES)}, '
+                         f'not {coordinates}')
+    return COORDINATES[coordinates]
+
+
+def get_route_columns(coordinates=None):
+    """
+    Gets the columns of a route that are matched to the coordinate columns of the Locations
+    :param coordinates: string, 'latlong' or 'grid'
+    :return: list of strings, north-south coordinate first
+    """
+    return [ROUTE_COLUMNS[x] for x in get_coordinates(coordinates)]
+
+
+def is_grid(coordinates=None):
+    """
+    Checks whether Locations are stored in OS grid coordinates
+    :param coordinates: string, 'latlong' or 'grid'
+    :return: boolean
+    """
+    return get_coordinates(coordinates) == COORDINATES['grid']
+
+
+def get_table_schema(table):
+    """
+    Gets the schema of an existing Locations table from its columns
+    :param table: sqlalchemy table object
+    :return: string
+    """
+    return 'compact' if COMPACT_COLUMNS['altitude'] in table.c else 'float'
+
+
+def get_column(name, schema=None):
+    """
+    Gets the name a Locations column is stored under
+    :param name: string, 'latitude', 'longitude' or 'altitude'
+    :param schema: string
+    :return: string
+    """
+    return COMPACT_COLUMNS[name] if get_schema(schema) == 'compact' else name
+
+
+def get_scale(name, schema=None):
+    """
+    Gets the number a Locations column is multiplied by to store it
+    :param name: string, 'latitude', 'longitude' or 'altitude'
+    :param schema: string
+    :return: int
+    """
+    return SCALES[name] if get_schema(schema) == 'compact' else 1
+
+
+def get_column_condition(name, operator, value, schema=None):
+    """
+    Gets a comparison of a Locations column with a value, in the units it is stored in. Integer
+    columns are compared with the scaled value as a float, so nothing is lost to rounding
+    :param name: string, 'latitude', 'longitude' or 'altitude'
+    :param operator: string, e.g. '>='
+    :param value: float
+    :param schema: string
+    :return: string
+    """
+    return f'{get_column(name, schema)} {operator} {float(value) * get_scale(name, schema)!r}'
+
+
+def create_locations_table(connection, name='locations', schema=None, coordinates=None):
+    """
+    Creates a Locations table if it doesn't already exist
+    :param connection: sqlite database connection
+    :param name: string
+    :param schema: string
+    :param coordinates: string, 'latlong' or 'grid'
+    :return: sqlalchemy table object
+    """
+    metadata = db.MetaData(connection)
+    if get_schema(schema) == 'compact':
+        table = db.Table(name, metadata,
+                         *[db.Column(COMPACT_COLUMNS[x], db.Integer(), nullable=False,
+                                     primary_key=True) for x in get_coordinates(coordinates)],
+                         db.Column('altitude_dm', db.SmallInteger(), nullable=False),
+                         sqlite_with_rowid=False)
+    else:
+        table = db.Table(name, metadata,
+                         *[db.Column(x, db.Float(), nullable=False, primary_key=True)
+                           for x in get_coordinates(coordinates)],
+                         db.Column('altitude', db.Float(), nullable=False))
+    metadata.create_all()
+    return table
+
+
+def encode_locations(locations_df, schema=None):
+    """
+    Converts Locations to the columns they are stored in
+    :param locations_df: pandas Dataframe with columns latitude, longitude (or northing,
+                         easting) and altitude
+    :param schema: string
+    :return: pandas Dataframe
+    """
+    columns = [x for x in COMPACT_COLUMNS if x in locations_df]
+    if get_schema(schema) != 'compact':
+        return locations_df[columns]
+    return pd.DataFrame({COMPACT_COLUMNS[x]: np.rint(
+        locations_df[x].to_numpy(dtype=float) * SCALES[x]).astype(np.int64) for x in columns})
+
+
+def encode_location_rows(rows, table):
+    """
+    Converts rows of Locations to the columns they are stored in by a table, for inserting
+    :param rows: list of dicts, with keys latitude, longitude (or northing, easting) and altitude
+    :param table: sqlalchemy table object
+    :return: list of dicts
+    """
+    if get_table_schema(table) != 'compact' or not rows:
+        return rows
+    return encode_locations(pd.DataFrame(rows), 'compact').to_dict('records')
+
+
+def decode_locations(stored_df, schema=None):
+    """
+    Converts Locations as stored back to floats, a column at a time
+    :param stored_df: pandas Dataframe, as read from a Locations table
+    :param schema: string
+    :return: pandas Dataframe with columns latitude, longitude (or northing, easting) and
+             altitude
+    """
+    if get_schema(schema) != 'compact':
+        return stored_df
+    return pd.DataFrame({x: stored_df[y].to_numpy(dtype=float) / SCALES[x]
+                         for x, y in COMPACT_COLUMNS.items() if y in stored_df})
+
+
+def read_locations(connection, table, condition=None, schema=None):
+    """
+    Reads Locations from a table as floats
+    :param connection: sqlite database connection
+    :param table: string
+    :param condition: string, where clause, e.g. from get_column_condition
+    :param schema: string
+    :return: pandas Dataframe with columns latitude, longitude (or northing, easting) and
+             altitude
+    """
+    columns = ', '.join(get_column(x, schema) for x in get_coordinates() + ['altitude'])
+    where = f' where {condition}' if condition else ''
+    return decode_locations(
+        pd.read_sql_query(f'select {columns} from {table}{where}', connection), schema)
+
+
+def split_longitude_locations(connection, schema=None):
+    """
+    Copies the Locations in latitude and longitude from the Locations table into the tables
+    split by longitude that scoring reads (see get_db_table), as the queries from
+    get_set_db_tables do, but creating each table with the schema's columns and primary key,
+    which create table as select would drop. Only the tables within the longitudes of the
+    Locations are made
+    :param connection: sqlite database connection
+    :param schema: string
+    :return: list of strings, the tables copied into
+    """
+    longitude = get_column('longitude', schema)
+    extremes = connection.execute(
+        f'select min({longitude}), max({longitude}) from locations').fetchone()
+    if extremes[0] is None:
+        return []
+    min_long, max_long = [x / get_scale('longitude', schema) for x in extremes]
+    tables = []
+    for number in range(1, LONGITUDE_TABLES + 1):
+        west = round(MIN_TABLE_LONGITUDE + (number - 1) * LONGITUDE_TABLE_WIDTH, 2)
+        east = round(west + LONGITUDE_TABLE_WIDTH, 2)
+        if east < min_long or west >= max_long:
+            continue
+        table = create_locations_table(connection, f'locations{number}', schema, 'latlong')
+        with connection.begin():
+            connection.execute(f'insert or ignore into {table.name} select * from locations '
+                               f"where {get_column_condition('longitude', '>', west, schema)} "
+                               f"and {get_column_condition('longitude', '<=', east, schema)}")
+        tables.append(table.name)
+    return tables
+
+
+def split_grid_locations(connection, schema=None):
+    """
+    Copies the Locations in OS grid coordinates from the Locations table into the tables split
+    by easting that scoring reads (see get_db_table), as the queries from get_set_db_tables do
+    for latitude and longitude
+    :param connection: sqlite database connection
+    :param schema: string
+    :return: list of strings, the tables copied into
+    """
+    easting = get_column('easting', schema)
+    width = GRID_TABLE_WIDTH * get_scale('easting', schema)
+    bands = [x[0] for x in connection.execute(
+        f'select distinct cast({easting} / {width} as integer) from locations')]
+    tables = []
+    for band in sorted(bands):
+        table = create_locations_table(connection, get_grid_table(band * GRID_TABLE_WIDTH),
+                                       schema, 'grid')
+        with connection.begin():
+            connection.execute(f'insert or ignore into {table.name} select * from locations '
+                               f'where {easting} >= {band * width} and '
+                               f'{easting} < {(band + 1) * width}')
+        tables.append(table.name)
+    return tables
+
+
+def migrate_table(source, target, table, batch_rows=MIGRATION_BATCH_ROWS):
+    """
+    Copies a float Locations table into a new compact one, a batch at a time. Points that round
+    to the same fixed point coordinates are merged, keeping the first
+    :param source: sqlite database connection, to the float database
+    :param target: sqlite database connection, to the compact database
+    :param table: string
+    :param batch_rows: int
+    :return: dict, rows read and written, and the largest rounding errors
+    """
+    columns = [x['name'] for x in db.inspect(source).get_columns(table)]
+    coordinates = next(x for x, y in COORDINATES.items() if y[0] in columns)
+    compact_table = create_locations_table(target, table, 'compact', coordinates)
+    query = db.insert(compact_table).prefix_with('OR IGNORE')
+    summary = {'table': table, 'rows_read': 0, 'rows_written': 0, 'max_coordinate_error': 0.0,
+               'max_altitude_error': 0.0}
+    columns = COORDINATES[coordinates]
+    with target.begin():
+        for batch in pd.read_sql_query(f"select {', '.join(columns)}, altitude from {table}",
+                                       source, chunksize=batch_rows):
+            encoded = encode_locations(batch, 'compact')
+            decoded = decode_locations(encoded, 'compact')
+            summary['rows_read'] += len(batch)
+            summary['rows_written'] += target.execute(query, encoded.sort_values(
+                [COMPACT_COLUMNS[x] for x in columns]).to_dict('records')).rowcount
+            summary['max_coordinate_error'] = max(summary['max_coordinate_error'], float(np.abs(
+                decoded[columns].to_numpy() - batch[columns].to_numpy()).max(initial=0)))
+            summary['max_altitude_error'] = max(summary['max_altitude_error'], float(np.abs(
+                decoded['altitude'].to_numpy() - batch['altitude'].to_numpy()).max(initial=0)))
+    return summary
+
+
+def migrate_database(source_path, target_path, batch_rows=MIGRATION_BATCH_ROWS):
+    """
+    Copies every Locations table of a float altitude database into a new compact database,
+    leaving the original as it is, so the databases can be swapped once the copy is checked
+    :param source_path: string
+    :param target_path: string, must not exist
+    :param batch_rows: int
+    :return: list of dicts, from migrate_table
+    """
+    if os.path.exists(target_path):
+        raise FileExistsError(f'{target_path} already exists')
+    source_engine = db.create_engine(f'sqlite:///file:{source_path}?mode=ro&uri=true')
+    target_engine = db.create_engine(f'sqlite:///{target_path}')
+    try:
+        with source_engine.connect() as source, target_engine.connect() as target:
+            tables = [x for x in db.inspect(source).get_table_names()
+                      if x.startswith('locations')]
+            summaries = []
+            for table in tables:
+                summaries.append(migrate_table(source, target, table, batch_rows))
+                print(json.dumps(summaries[-1]), file=sys.stderr, flush=True)
+    finally:
+        source_engine.dispose()
+        target_engine.dispose()
+    return summaries
+
+
+def main(argv=None):
+    """
+    Migrates a float altitude database to the compact schema, printing a summary of each table
+    as it is copied, and of the database sizes
+    :param argv: list of strings, defaults to the command line arguments
+    """
+    parser = argparse.ArgumentParser(
+        description='Copy a float altitude database into a new one with the compact schema')
+    parser.add_argument('source', help='altitude database with the float schema')
+    parser.add_argument('target', help='new altitude database to create')
+    parser.add_argument('--batch-rows', type=int, default=MIGRATION_BATCH_ROWS)
+    args = parser.parse_args(argv)
+    summaries = migrate_database(args.source, args.target, args.batch_rows)
+    print(json.dumps({'tables': len(summaries),
+                      'rows_read': sum(x['rows_read'] for x in summaries),
+                      'rows_written': sum(x['rows_written'] for x in summaries),
+                      'source_bytes': os.path.getsize(args.source),
+                      'target_bytes': os.path.getsize(args.target)}))
+
+
+if __name__ == '__main__':
+    main()
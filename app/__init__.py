@@ -1,9 +1,52 @@
-from flask import Flask
+from io import BytesIO
+from flask import Flask, Request, g, request
 from config import Config
 from flask_bootstrap import Bootstrap
+import database_engines
+import instrumentation
+
+
+class UploadRequest(Request):
+    """
+    Request keeping uploaded files in memory rather than spooling large ones to temporary files,
+    as request bodies are capped at MAX_CONTENT_LENGTH
+    """
+    def _get_file_stream(self, total_content_length, content_type, filename=None,
+                         content_length=None):
+        return BytesIO()
+
 
 app = Flask(__name__)
+app.request_class = UploadRequest
 app.config.from_object(Config)
 bootstrap = Bootstrap(app)
 
-from app import routes, errors
+
+@app.before_request
+def start_request_trace():
+    """
+    Times each request as a trace, with the stages it runs nested in it
+    """
+    g.request_trace = instrumentation.start_trace(f'request:{request.endpoint}',
+                                                  method=request.method, path=request.path)
+
+
+@app.teardown_request
+def end_request_trace(_):
+    """
+    Ends the request's trace, recording it in the histograms and the timing log
+    :param _: exception raised by the request, unused
+    """
+    instrumentation.end_span(g.pop('request_trace', None))
+
+
+@app.teardown_appcontext
+def close_database_connections(_):
+    """
+    Returns the database connections used by a request to their pools
+    :param _: exception raised by the request, unused
+    """
+    database_engines.close_scoped_connections()
+
+
+from app import routes, errors, api, warm_up
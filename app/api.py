@@ -0,0 +1,190 @@
+"""
+Read-only API for the mountain fear finder application, returning stored routes with the
+scariness of each waypoint as compact JSON or binary columnar arrays, with strong ETags so
+clients can cache them, the progress of background scoring jobs and the application's readiness
+"""
+
+import gzip
+import json
+from flask import Response, abort, jsonify, request
+from app import app
+import administer_route_database
+import instrumentation
+import memory_accounting
+import scoring_jobs
+from app.warm_up import WARM_UP_STATE
+
+BINARY_MIMETYPE = 'application/vnd.mountain-fear-finder.route'
+GZIP_MIN_SIZE = 512
+CATALOG_FIELDS = ['name', 'content_hash', 'scoring_version', 'point_count', 'max_lat',
+                  'max_long', 'min_lat', 'min_long', 'max_scariness', 'mean_scariness',
+                  'created_dt']
+
+
+def get_route_etag(entry, route_format, encoding):
+    """
+    Gets the strong ETag of one representation of a stored route. The waypoints and scores of a
+    route only depend on its points and the version of the scoring algorithm, so the ETag
+    changes whenever either does
+    :param entry: dict, from administer_route_database.get_route_catalog_entry
+    :param route_format: string, 'json' or 'binary'
+    :param encoding: string, content encoding of the response, 'gzip' or 'identity'
+    :return: string
+    """
+    return f"{entry['content_hash'][:32]}-{entry['scoring_version']}-{route_format}-{encoding}"
+
+
+def get_response_encoding():
+    """
+    Gets the content encoding to use for the response to the current request
+    :return: string, 'gzip' or 'identity'
+    """
+    return 'gzip' if 'gzip' in request.accept_encodings else 'identity'
+
+
+def get_route_binary(route_df):
+    """
+    Gets a route as binary columnar arrays: the route data header (magic and point count) from
+    administer_route_database, then the arrays from get_route_array_bytes
+    :param route_df: pandas Dataframe with columns lat, long, elevation, scariness
+    :return: bytes
+    """
+    return (administer_route_database.ROUTE_DATA_HEADER.pack(
+        administer_route_database.ROUTE_DATA_MAGIC, len(route_df))
+            + administer_route_database.get_route_array_bytes(route_df))
+
+
+def make_api_response(body, mimetype, encoding, etag=None):
+    """
+    Makes an API response, gzipped if the client accepts it and the body is big enough to be
+    worth compressing
+    :param body: bytes
+    :param mimetype: string
+    :param encoding: string, 'gzip' or 'identity'
+    :param etag: string, strong ETag of the response, if it has one
+    :return: flask Response
+    """
+    if encoding == 'gzip' and len(body) >= GZIP_MIN_SIZE:
+        body = gzip.compress(body, compresslevel=6, mtime=0)
+    else:
+        encoding = 'identity'
+    response = Response(body, mimetype=mimetype)
+    if encoding == 'gzip':
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    if etag is not None:
+        response.set_etag(etag)
+        response.cache_control.no_cache = True
+    return response
+
+
+@app.route('/api/routes')
+def api_routes():
+    """
+    Lists the routes in the routes catalog
+    :return: flask Response, JSON list of route summaries
+    """
+    connection = administer_route_database.get_route_db_connection()
+    routes = [{x: entry[x] if x != 'created_dt' else str(entry[x]) for x in CATALOG_FIELDS}
+              for entry in administer_route_database.get_route_catalog(connection)]
+    return make_api_response(json.dumps(routes, separators=(',', ':')).encode(),
+                             'application/json', get_response_encoding())
+
+
+@app.route('/api/routes/<route_name>')
+def api_route(route_name):
+    """
+    Gets a stored route with the scariness of each waypoint, as JSON (lat, long, elevation and
+    scariness arrays) or, with ?format=binary, as binary columnar arrays (see get_route_binary).
+    Answers 304 Not Modified without reading the waypoints if the client already has the
+    current version, and 400 Bad Request for any other format
+    :param route_name: string
+    :return: flask Response
+    """
+    route_format = request.args.get('format', 'json')
+    if route_format not in ['json', 'binary']:
+        # Not abort(400), which the application answers with the out of bounds page
+        return jsonify({'error': f'Unknown format {route_format}, expected json or binary'}), 400
+    connection = administer_route_database.get_route_db_connection()
+    entry = administer_route_database.get_route_catalog_entry(connection, route_name)
+    if entry is None:
+        abort(404)
+    encoding = get_response_encoding()
+    etag = get_route_etag(entry, route_format, encoding)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        response.vary.add('Accept-Encoding')
+        return response
+    route = administer_route_database.get_route_from_db(connection, route_name)
+    if route_format == 'binary':
+        return make_api_response(get_route_binary(route), BINARY_MIMETYPE, encoding, etag)
+    body = {'name': entry['name'], 'scoring_version': entry['scoring_version'],
+            'point_count': entry['point_count'],
+            **administer_route_database.get_route_array_lists(route)}
+    return make_api_response(json.dumps(body, separators=(',', ':')).encode(),
+                             'application/json', encoding, etag)
+
+
+@app.route('/api/jobs/<job_id>')
+def api_job(job_id):
+    """
+    Gets the progress of a background job scoring an uploaded route: its status (queued,
+    running, done or failed), the stage it is on, the status of each stage and, once done, the
+    name the scored route is stored under
+    :param job_id: string
+    :return: flask Response, JSON
+    """
+    scoring_job = scoring_jobs.get_job(job_id)
+    if scoring_job is None:
+        abort(404)
+    response = jsonify(scoring_job)
+    response.cache_control.no_store = True
+    return response
+
+
+@app.route('/api/jobs/<job_id>/events')
+def api_job_events(job_id):
+    """
+    Streams the events of a background job scoring an uploaded route as server-sent events (see
+    scoring_jobs.get_job_events), so the page can draw each segment of the route as it is scored
+    :param job_id: string
+    :return: flask Response, text/event-stream
+    """
+    if scoring_jobs.get_job(job_id) is None:
+        abort(404)
+
+    def stream():
+        for event, data in scoring_jobs.get_job_events(job_id):
+            if event == 'keepalive':
+                yield ': keepalive\n\n'
+            else:
+                yield f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+    response = Response(stream(), mimetype='text/event-stream')
+    response.cache_control.no_cache = True
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@app.route('/ready')
+def ready():
+    """
+    Readiness check: 200 once the start up phase (see app.warm_up) has loaded everything, 503
+    until then or if a step of it failed, with the state of each step
+    :return: flask Response, JSON
+    """
+    response = jsonify(WARM_UP_STATE)
+    response.status_code = 200 if WARM_UP_STATE['status'] == 'ready' else 503
+    response.cache_control.no_store = True
+    return response
+
+
+@app.route('/metrics')
+def metrics():
+    """
+    Serves the latency histograms and peak memory of each stage in the Prometheus text format
+    :return: text/plain response
+    """
+    return Response(instrumentation.get_prometheus_metrics()
+                    + memory_accounting.get_prometheus_metrics(),
+                    mimetype='text/plain; version=0.0.4')
@@ -3,8 +3,8 @@ Custom error handling for mountain fear finder application
 """
 
 from flask import render_template
-import pandas as pd
 from app import app
+from calculate_scary_points import get_locations_extremes
 
 
 @app.errorhandler(400)
@@ -14,6 +14,17 @@ def bad_request_error(_):
     :param _: error, unused
     :return: flask rendered template
     """
-    return render_template('400.html', tables=[pd.read_pickle(
-        "locations_extremes.pkl").to_html(classes='Extremes')],
+    return render_template('400.html', tables=[
+        get_locations_extremes().to_html(classes='Extremes')],
                            titles=['maximum and minimum latitude and longitude available']), 400
+
+
+@app.errorhandler(413)
+def request_entity_too_large_error(_):
+    """
+    Deals with 413 error, an uploaded route file bigger than MAX_CONTENT_LENGTH
+    :param _: error, unused
+    :return: flask rendered template
+    """
+    return render_template('413.html',
+                           max_size=app.config['MAX_CONTENT_LENGTH'] // 1024), 413
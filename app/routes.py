@@ -2,15 +2,55 @@
 Defines the routes to pages for the mountain fear finder application
 """
 
+import hashlib
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from flask import render_template
+from flask import abort, redirect, render_template, request, url_for
 from werkzeug.utils import secure_filename
 from app import app
 from app.forms import UploadForm
-from get_folium_route_map import get_folium_route_map
+from get_folium_route_map import get_folium_route_map, get_route_with_scariness_from_file, \
+    translate_fear_level
+import request_profiling
+import scoring_jobs
 from administer_route_database import get_loaded_routes, get_route_db_connection
 
+_ARCHIVE_LOCK = threading.Lock()
+_ARCHIVE_EXECUTOR = {}
+
+
+def get_archive_executor():
+    """
+    Gets the worker thread uploads are archived on, creating it on first use in this process.
+    Archiving has its own thread so it neither queues behind scoring jobs nor holds one up
+    :return: ThreadPoolExecutor
+    """
+    with _ARCHIVE_LOCK:
+        executor, pid = _ARCHIVE_EXECUTOR.get('executor', (None, None))
+        if executor is None or pid != os.getpid():
+            executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='upload-archive')
+            _ARCHIVE_EXECUTOR['executor'] = (executor, os.getpid())
+    return executor
+
+
+def archive_upload(route_data, filename):
+    """
+    Writes a copy of an uploaded gpx file to the upload archive directory, named by its contents
+    so the same file uploaded again is only kept once
+    :param route_data: bytes
+    :param filename: string
+    """
+    archive_dir = Path(app.config['UPLOAD_ARCHIVE_DIR'])
+    archive_file = archive_dir / f'{hashlib.sha256(route_data).hexdigest()[:16]}-{filename}'
+    if archive_file.exists():
+        return
+    archive_dir.mkdir(parents=True, exist_ok=True)
+    temp_file = archive_file.with_suffix(f'.{os.getpid()}.tmp')
+    temp_file.write_bytes(route_data)
+    os.replace(temp_file, archive_file)
+
 
 @app.route('/', methods=['GET', 'POST'])
 @app.route('/home', methods=['GET', 'POST'])
@@ -22,26 +62,66 @@ def home():
     form = UploadForm()
     form.route_choice.choices = get_loaded_routes(get_route_db_connection())
     if form.validate_on_submit():
+        profile = request_profiling.should_profile(request.headers)
         route_file = form.route_file.data
         fear_level = form.fear_level.data
         route_choice = form.route_choice.data
         if route_file:
             filename = secure_filename(route_file.filename)
-            route_file.save(os.path.join(
-                app.instance_path, 'uploaded_files', filename
-            ))
-            filename = os.path.join(
-                app.instance_path, 'uploaded_files', filename
-            )
-            route_title = Path(filename).name.replace('.gpx', '').upper()
-            route_choice = None
-        else:
-            route_title = form.route_choice.data.upper()
-            filename = None
-        route_map = get_folium_route_map(fear_level, route_file=filename, route_choice=route_choice)
+            route_data = route_file.read()
+            if app.config['UPLOAD_ARCHIVE_DIR']:
+                get_archive_executor().submit(archive_upload, route_data, filename)
+            two_pass_threshold = translate_fear_level(fear_level) \
+                if app.config['SCORING_MODE'] == 'two-pass' else None
+            job_id = scoring_jobs.submit_job(fear_level, request_profiling.run_profiled, profile,
+                                             filename, get_route_with_scariness_from_file,
+                                             route_data, simplify=app.config['SIMPLIFY_ROUTES'],
+                                             two_pass_threshold=two_pass_threshold,
+                                             filename=filename,
+                                             keep_result=two_pass_threshold is not None)
+            if two_pass_threshold is not None and app.config['TWO_PASS_EXACT_RESCORE']:
+                # Two pass scores aren't stored, so score the route exactly for the routes catalog
+                scoring_jobs.submit_job(fear_level, get_route_with_scariness_from_file, route_data,
+                                        simplify=app.config['SIMPLIFY_ROUTES'], filename=filename)
+            return redirect(url_for('job', job_id=job_id))
+        route_title = form.route_choice.data.upper()
+        route_map = request_profiling.run_profiled(
+            profile, route_choice, get_folium_route_map, fear_level, route_choice=route_choice,
+            render_mode=app.config['MAP_RENDER_MODE'])
         form.route_choice.choices = get_loaded_routes(get_route_db_connection())
         return render_template(
             'home.html', title=f'Mountain Fear Finder - {route_title}',
             route_map=route_map, form=form, route_name=route_title)
     return render_template('home.html', title='Mountain Fear Finder',
                            form=form)
+
+
+@app.route('/jobs/<job_id>')
+def job(job_id):
+    """
+    Shows the progress of a background job scoring an uploaded route, then the scored route once
+    the job is done, from the job itself if it isn't stored in the routes catalog
+    :param job_id: string
+    :return: flask render_template
+    """
+    scoring_job = scoring_jobs.get_job(job_id)
+    if scoring_job is None:
+        abort(404)
+    if scoring_job['error'] == 'out_of_bounds':
+        abort(400)
+    if scoring_job['status'] != 'done':
+        return render_template('job.html', title='Mountain Fear Finder - Scoring route',
+                               job=scoring_job,
+                               scariness_level=translate_fear_level(scoring_job['fear_level']))
+    form = UploadForm()
+    form.route_choice.choices = get_loaded_routes(get_route_db_connection())
+    form.route_choice.data = scoring_job['route']
+    form.fear_level.data = scoring_job['fear_level']
+    route_title = scoring_job['route'].upper()
+    route_map = request_profiling.run_profiled(
+        request_profiling.should_profile(request.headers), scoring_job['route'],
+        get_folium_route_map, scoring_job['fear_level'], route_choice=scoring_job['route'],
+        render_mode=app.config['MAP_RENDER_MODE'], route=scoring_jobs.get_job_result(job_id))
+    return render_template(
+        'home.html', title=f'Mountain Fear Finder - {route_title}',
+        route_map=route_map, form=form, route_name=route_title)
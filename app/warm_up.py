@@ -0,0 +1,140 @@
+"""
+Start up phase for the mountain fear finder application, loading once per process what the first
+requests would otherwise load lazily, with a record of each step for the readiness endpoint. It is
+started by the server entry point (mountain_fear_finder), not when the application is imported,
+and only reads the databases, without creating or migrating anything in them
+"""
+
+import importlib
+import os
+import threading
+from time import perf_counter
+import sqlalchemy as db
+import administer_route_database
+import altitude_schema
+import calculate_scary_points as csp
+import database_engines
+
+WARM_UP_LIBRARIES = ['scipy.spatial', 'swifter', 'folium']
+WARM_UP_STATE = {'status': 'pending', 'steps': {}}
+
+
+def get_warm_up_regions(regions):
+    """
+    Parses the regions of altitude data to read at start up
+    :param regions: string, max_lat,max_long,min_lat,min_long;max_lat,... (or northings and
+                    eastings, if the altitude data is in OS grid coordinates)
+    :return: list of route bounds lists, [max_lat, max_long, min_lat, min_long]
+    """
+    return [[float(x) for x in region.split(',')] for region in regions.split(';')
+            if region.strip()]
+
+
+def import_libraries():
+    """
+    Imports the libraries that scoring and rendering import lazily
+    :return: int, number of libraries imported
+    """
+    for library in WARM_UP_LIBRARIES:
+        importlib.import_module(library)
+    return len(WARM_UP_LIBRARIES)
+
+
+def database_exists(database):
+    """
+    Checks whether a database's file exists, as connecting to a missing sqlite database would
+    create it
+    :param database: string, 'waypoints' or 'altitudes'
+    :return: boolean
+    """
+    return os.path.exists(database_engines.DATABASE_PATHS[database])
+
+
+def open_databases():
+    """
+    Opens a pooled connection to each database that exists, returning it to the pool
+    :return: int, number of databases opened
+    """
+    databases = [x for x in database_engines.DATABASE_PATHS if database_exists(x)]
+    for database in databases:
+        database_engines.get_engine(database).connect().close()
+    return len(databases)
+
+
+def read_altitude_indexes():
+    """
+    Reads the ends of the primary key index of each Locations table, so its upper levels are in
+    the page cache
+    :return: int, number of tables read
+    """
+    if not database_exists('altitudes'):
+        return 0
+    connection = database_engines.get_connection('altitudes')
+    tables = [x for x in db.inspect(connection).get_table_names() if x.startswith('locations')]
+    for table in tables:
+        latitude = altitude_schema.get_column(altitude_schema.get_coordinates()[0])
+        connection.execute(f'select min({latitude}), max({latitude}) from {table}').fetchall()
+    return len(tables)
+
+
+def load_route_catalog():
+    """
+    Reads the routes catalog, leaving it to be created or migrated by the first request that
+    needs it
+    :return: int, number of routes in the catalog
+    """
+    if not database_exists('waypoints'):
+        return 0
+    connection = administer_route_database.get_route_db_connection()
+    return len(administer_route_database.get_route_catalog(connection))
+
+
+def read_altitude_regions(regions):
+    """
+    Reads the altitude data for busy regions, so it is in the page cache
+    :param regions: string, see get_warm_up_regions
+    :return: int, number of altitude points read
+    """
+    return sum(len(csp.get_complete_route_altitude_df(x))
+               for x in get_warm_up_regions(regions))
+
+
+def warm_up(config):
+    """
+    Runs each start up step, recording in WARM_UP_STATE whether it worked, what it loaded and how
+    long it took. The application is ready once every step has worked
+    :param config: flask application config
+    """
+    WARM_UP_STATE['status'] = 'running'
+    steps = [('libraries', import_libraries),
+             ('coverage', lambda: len(csp.get_locations_extremes())),
+             ('databases', open_databases),
+             ('indexes', read_altitude_indexes),
+             ('catalog', load_route_catalog),
+             ('regions', lambda: read_altitude_regions(config['WARM_UP_REGIONS']))]
+    for step, func in steps:
+        start = perf_counter()
+        try:
+            result = {'status': 'done', 'loaded': func()}
+        except Exception as error:  # pylint: disable=broad-except
+            result = {'status': 'failed', 'error': f'{type(error).__name__}: {error}'}
+        result['seconds'] = round(perf_counter() - start, 3)
+        WARM_UP_STATE['steps'][step] = result
+    database_engines.close_scoped_connections()
+    failed = any(x['status'] == 'failed' for x in WARM_UP_STATE['steps'].values())
+    WARM_UP_STATE['status'] = 'failed' if failed else 'ready'
+
+
+def start_warm_up(config):
+    """
+    Starts the start up phase as configured by WARM_UP: before returning ('sync'), in a
+    background thread ('background') or not at all ('off', when the application is always ready).
+    Called by the server entry point, mountain_fear_finder
+    :param config: flask application config
+    """
+    if config['WARM_UP'] == 'off':
+        WARM_UP_STATE['status'] = 'ready'
+    elif config['WARM_UP'] == 'background':
+        threading.Thread(target=warm_up, args=(config,), name='warm-up', daemon=True).start()
+    else:
+        warm_up(config)
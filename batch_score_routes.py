@@ -0,0 +1,271 @@
+"""
+Command line batch processing for a library of gpx route files. Routes are scored in parallel,
+with the altitude data fetched once for each group of overlapping routes, or in segments for
+routes too long to fetch at once, stored in the Routes database and summarised as one line of
+json per route on stdout
+"""
+
+import argparse
+import contextlib
+import glob
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from time import perf_counter
+import altitude_schema
+import calculate_scary_points as csp
+import read_gpx
+import administer_route_database
+import memory_accounting
+from config import Config
+from memory_accounting import MemoryBudgetExceededError
+
+MAX_SHARED_WINDOW = 0.2
+MAX_SHARED_GRID_WINDOW = 20000
+
+
+def get_route_files(paths):
+    """
+    Gets the gpx files named by a list of directories, files and glob patterns
+    :param paths: list of strings
+    :return: list of strings, without duplicates
+    """
+    route_files = []
+    for path in paths:
+        if os.path.isdir(path):
+            route_files.extend(sorted(glob.glob(os.path.join(path, '*.gpx'))))
+        else:
+            route_files.extend(sorted(glob.glob(path)))
+    return list(dict.fromkeys(route_files))
+
+
+def read_route(route_file):
+    """
+    Reads a gpx route file and gets its content hash and bounds
+    :param route_file: string
+    :return: tuple, (route_file, pandas Dataframe, content hash, route bounds)
+    """
+    route = read_gpx.read_gpx(route_file)
+    return (route_file, route, administer_route_database.get_route_content_hash(route),
+            csp.get_route_bounds(route))
+
+
+def group_overlapping_routes(route_bounds, max_window=None):
+    """
+    Groups routes whose altitude windows overlap, so each group's altitude data only has to be
+    fetched once. A route is only added to a group if the group's combined window stays within
+    max_window degrees each way, so one long chain of routes can't pull in the whole database
+    :param route_bounds: dict, route file: [max_lat, max_long, min_lat, min_long], from
+                         csp.get_route_bounds
+    :param max_window: float, degrees (or metres in OS grid coordinates), by default
+                       MAX_SHARED_WINDOW (or MAX_SHARED_GRID_WINDOW)
+    :return: list of lists of route files
+    """
+    if max_window is None:
+        max_window = MAX_SHARED_GRID_WINDOW if altitude_schema.is_grid() else MAX_SHARED_WINDOW
+    margin = csp.get_route_margin()
+    groups = []
+    for route_file, bounds in sorted(route_bounds.items(), key=lambda x: x[1][3]):
+        for group in groups:
+            group_bounds = read_gpx.combine_route_bounds([route_bounds[x] for x in group])
+            combined = read_gpx.combine_route_bounds([group_bounds, bounds])
+            overlaps = (bounds[2] - margin < group_bounds[0] + margin
+                        and bounds[0] + margin > group_bounds[2] - margin
+                        and bounds[3] - margin < group_bounds[1] + margin
+                        and bounds[1] + margin > group_bounds[3] - margin)
+            if overlaps and combined[0] - combined[2] <= max_window \
+                    and combined[1] - combined[3] <= max_window:
+                group.append(route_file)
+                break
+        else:
+            groups.append([route_file])
+    return groups
+
+
+def score_route(route, route_bounds, corridor=None, simplify=False, max_rows=None,
+                segment_rows=None):
+    """
+    Scores a padded route against its own altitude data, in overlapping segments (see
+    calculate_scary_points.calculate_windowed_route_scariness) if that is more than max_rows
+    or segment_rows rows
+    :param route: pandas Dataframe, padded
+    :param route_bounds: list, from csp.get_route_bounds
+    :param corridor: list of boxes, from csp.get_fetch_corridor
+    :param simplify: boolean, simplify the route before scoring
+    :param max_rows: int, most altitude rows that fit in the memory budget, or None if there is
+                     no budget
+    :param segment_rows: int, altitude rows to aim for in each segment, or None to never segment
+    :return: pandas Dataframe
+    """
+    limits = [x for x in [max_rows, segment_rows] if x is not None]
+    window_rows = csp.count_route_altitude_rows(route_bounds, corridor) if limits else None
+    if window_rows is not None and window_rows > min(limits):
+        return csp.calculate_windowed_route_scariness(route, max_rows, window_rows=window_rows,
+                                                      simplify=simplify,
+                                                      segment_rows=segment_rows)
+    return csp.calculate_route_scariness(
+        route, csp.get_complete_route_altitude_df(route_bounds, corridor), simplify=simplify)
+
+
+def score_route_group(routes, simplify=False, max_rows=None):
+    """
+    Pads and scores a group of overlapping routes using one altitude fetch covering all of them,
+    keeping stdout free for the json summaries. If the group's altitude data is more than
+    SEGMENT_ROWS rows, or wouldn't fit in the memory budget, each route is scored on its own
+    instead (see score_route), and a route that can't be scored within the budget even in
+    segments is rejected
+    :param routes: dict, route file: pandas Dataframe (route as read from the file)
+    :param simplify: boolean, simplify the routes before scoring
+    :param max_rows: int, most altitude rows that fit in the memory budget, or None if there is
+                     no budget
+    :return: list of tuples, (route file, scored pandas Dataframe, None if the route is outside
+             the altitude data, or the MemoryBudgetExceededError rejecting it, seconds taken)
+    """
+    with contextlib.redirect_stdout(sys.stderr):
+        start = perf_counter()
+        routes = {x: read_gpx.pad_gpx_dataframe(y) for x, y in routes.items()}
+        route_bounds = {x: csp.get_route_bounds(y) for x, y in routes.items()}
+        in_bounds = [x for x, y in route_bounds.items()
+                     if csp.check_route_bounds_fit_location_data(y)]
+        results = [(x, None, 0) for x in routes if x not in in_bounds]
+        if in_bounds:
+            corridors = {x: csp.get_fetch_corridor(routes[x]) for x in in_bounds}
+            group_bounds = read_gpx.combine_route_bounds([route_bounds[x] for x in in_bounds])
+            # In corridor mode the group's fetch is the union of the routes' corridors
+            group_corridor = None if corridors[in_bounds[0]] is None \
+                else [x for y in corridors.values() for x in y]
+            segment_rows = csp.SEGMENT_SETTINGS['rows'] or None
+            limits = [x for x in [max_rows, segment_rows] if x is not None]
+            if limits and csp.count_route_altitude_rows(group_bounds,
+                                                        group_corridor) > min(limits):
+                # Too much altitude data to hold for the whole group at once
+                for route_file in in_bounds:
+                    start = perf_counter()
+                    try:
+                        route = score_route(routes[route_file], route_bounds[route_file],
+                                            corridors[route_file], simplify, max_rows,
+                                            segment_rows)
+                    except MemoryBudgetExceededError as error:
+                        route = error
+                    results.append((route_file, route, perf_counter() - start))
+            else:
+                altitudes_df = csp.get_complete_route_altitude_df(group_bounds, group_corridor)
+                fetch_time = (perf_counter() - start) / len(in_bounds)
+                for route_file in in_bounds:
+                    start = perf_counter()
+                    route_altitudes_df = csp.get_route_window(altitudes_df,
+                                                              route_bounds[route_file],
+                                                              corridors[route_file])
+                    route = csp.calculate_route_scariness(routes[route_file],
+                                                          route_altitudes_df,
+                                                          simplify=simplify)
+                    results.append((route_file, route, fetch_time + perf_counter() - start))
+    return results
+
+
+def get_route_summary(route_file, route, seconds):
+    """
+    Summarises a scored route for the json output
+    :param route_file: string
+    :param route: pandas Dataframe, or None if the route is outside the altitude data
+    :param seconds: float
+    :return: dict
+    """
+    summary = {'route': Path(route_file).name.replace('.gpx', ''), 'file': str(route_file)}
+    if route is None:
+        summary['status'] = 'out_of_bounds'
+        return summary
+    summary.update({'status': 'scored', 'points': len(route),
+                    'max_scariness': int(route['scariness'].max()),
+                    'mean_scariness': round(float(route['scariness'].mean()), 3),
+                    'seconds': round(seconds, 3)})
+    return summary
+
+
+def get_error_summary(route_file, error):
+    """
+    Summarises a route that couldn't be read or scored for the json output
+    :param route_file: string
+    :param error: Exception
+    :return: dict
+    """
+    return {'route': Path(route_file).name.replace('.gpx', ''), 'file': str(route_file),
+            'status': 'error', 'error': f'{type(error).__name__}: {error}'}
+
+
+def main(argv=None):
+    """
+    Scores every gpx file given on the command line and stores the results. A file that can't be
+    read, or a group of routes that can't be scored, is reported with an error status and the
+    rest are carried on with
+    :param argv: list of strings, defaults to the command line arguments
+    """
+    parser = argparse.ArgumentParser(description='Batch score gpx routes for scary points')
+    parser.add_argument('paths', nargs='+', help='gpx files, directories or glob patterns')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='number of scoring processes')
+    parser.add_argument('--simplify', action=argparse.BooleanOptionalAction,
+                        default=Config.SIMPLIFY_ROUTES,
+                        help='simplify routes before scoring (see simplify_route)')
+    parser.add_argument('--rescore', action='store_true',
+                        help='score routes that are already in the Routes database')
+    args = parser.parse_args(argv)
+    scoring_version = csp.get_scoring_version(args.simplify)
+
+    connection = administer_route_database.get_route_db_connection()
+    administer_route_database.create_routes_table(connection)
+    stored_routes = {} if args.rescore else administer_route_database.get_stored_content_hashes(
+        connection, scoring_version)
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        routes = {}
+        route_bounds = {}
+        content_hashes = {}
+        read_futures = {executor.submit(read_route, x): x for x in get_route_files(args.paths)}
+        for read_future, route_file in read_futures.items():
+            try:
+                route_file, route, content_hash, bounds = read_future.result()
+            except Exception as error:  # pylint: disable=broad-except
+                print(json.dumps(get_error_summary(route_file, error)), flush=True)
+                continue
+            if content_hash in stored_routes:
+                print(json.dumps({'route': stored_routes[content_hash], 'file': route_file,
+                                  'status': 'already_loaded'}), flush=True)
+                continue
+            stored_routes[content_hash] = Path(route_file).name.replace('.gpx', '')
+            routes[route_file] = route
+            route_bounds[route_file] = bounds
+            content_hashes[route_file] = content_hash
+        # Each process scoring a group at once needs its own altitude data within the budget
+        max_rows = memory_accounting.get_affordable_rows(
+            memory_accounting.FETCH_ROW_BYTES * args.workers)
+        futures = {executor.submit(score_route_group, {x: routes[x] for x in group},
+                                   args.simplify, max_rows): group
+                   for group in group_overlapping_routes(route_bounds)}
+        for future in as_completed(futures):
+            try:
+                results = future.result()
+            except Exception as error:  # pylint: disable=broad-except
+                for route_file in futures[future]:
+                    print(json.dumps(get_error_summary(route_file, error)), flush=True)
+                continue
+            for route_file, route, seconds in results:
+                if isinstance(route, MemoryBudgetExceededError):
+                    print(json.dumps(get_error_summary(route_file, route)), flush=True)
+                    continue
+                summary = get_route_summary(route_file, route, seconds)
+                if route is not None:
+                    route = administer_route_database.prepare_route_for_insertion(
+                        route, route_file)
+                    route['route'] = summary['route'] = \
+                        administer_route_database.get_unique_route_name(
+                            connection, route['route'].iloc[0], content_hashes[route_file])
+                    administer_route_database.store_route(
+                        route, connection, content_hashes[route_file], scoring_version)
+                print(json.dumps(summary), flush=True)
+
+
+if __name__ == '__main__':
+    main()
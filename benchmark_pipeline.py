@@ -0,0 +1,241 @@
+"""
+Reproducible benchmarks of each stage of the ingest and scoring pipelines on synthetic data. An
+asc tile of generated terrain, and a gpx route across it, of the sizes given on the command line,
+are ingested into a temporary altitude database and scored, timing each stage: asc read, upsample,
+coordinate transform, insert, window fetch, normalise, score and render. The results are written
+as json, and can be compared with a stored baseline to flag the stages that have got slower
+"""
+
+import argparse
+import json
+import platform
+import sys
+import tempfile
+from pathlib import Path
+from statistics import median
+from time import perf_counter
+import numpy as np
+import pandas as pd
+import sqlalchemy as db
+from OSGridConverter import grid2latlong
+import altitude_schema
+import calculate_scary_points as csp
+import database_engines
+import read_contour_data as contour
+import read_gpx
+from administer_route_database import prepare_route_for_insertion
+from get_folium_route_map import render_route_map
+
+# The tile is in the NN 100km grid square, lower left corner at NN 20000 70000
+GRID_SQUARE = 'NN'
+TILE_ORIGIN = (220000, 770000)
+CELL_SIZE = 50
+STAGES = ['asc_read', 'upsample', 'transform', 'insert', 'fetch', 'normalise', 'score', 'render']
+REGRESSION_TOLERANCE = 0.25
+
+
+def make_terrain(cells, seed=0):
+    """
+    Generates the altitudes of a square tile of hilly terrain, with a crag down the middle
+    :param cells: int, cells along each side of the tile
+    :param seed: int, random seed, so the same terrain is generated every time
+    :return: numpy array of ints, cells x cells, the first row the northernmost
+    """
+    rng = np.random.default_rng(seed)
+    x_cells, y_cells = np.meshgrid(np.arange(cells), np.arange(cells))
+    altitudes = (400 + 150 * np.sin(x_cells / 7 + rng.uniform(0, 6))
+                 * np.cos(y_cells / 9 + rng.uniform(0, 6))
+                 + 40 * (x_cells > cells / 2) + rng.normal(0, 2, (cells, cells)))
+    return np.rint(altitudes).astype(int)
+
+
+def write_asc_tile(path, altitudes):
+    """
+    Writes terrain as an asc file like those from the OS, at TILE_ORIGIN
+    :param path: pathlib Path
+    :param altitudes: numpy array of ints, see make_terrain
+    """
+    header = [f'ncols {altitudes.shape[1]}', f'nrows {altitudes.shape[0]}',
+              f'xllcorner {TILE_ORIGIN[0]}', f'yllcorner {TILE_ORIGIN[1]}',
+              f'cellsize {CELL_SIZE}']
+    rows = [' '.join(str(x) for x in row) for row in altitudes]
+    path.write_text('\n'.join(header + rows) + '\n')
+
+
+def make_route_gpx(altitudes, points, start=0.3, end=0.7):
+    """
+    Generates a gpx route crossing the middle of the tile diagonally, with the altitude of the
+    terrain under each point as its elevation
+    :param altitudes: numpy array of ints, see make_terrain
+    :param points: int, number of points in the route
+    :param start: float, fraction of the way across the tile the route starts
+    :param end: float, fraction of the way across the tile the route ends
+    :return: bytes, contents of a gpx file
+    """
+    cells = altitudes.shape[0]
+    route_points = []
+    for index, fraction in enumerate(np.linspace(start, end, points)):
+        column, row = fraction * (cells - 1), (1 - fraction) * (cells - 1)
+        easting = round(TILE_ORIGIN[0] + column * CELL_SIZE)
+        northing = round(TILE_ORIGIN[1] + (cells - 1 - row) * CELL_SIZE)
+        location = grid2latlong(f'{GRID_SQUARE} {easting % 100000:05d} {northing % 100000:05d}',
+                                tag='OSGB36')
+        elevation = altitudes[int(round(row)), int(round(column))]
+        route_points.append(f'<rtept lat="{location.latitude:.6f}" '
+                            f'lon="{location.longitude:.6f}"><ele>{elevation}</ele>'
+                            f'<name>P{index}</name></rtept>')
+    return ('<?xml version="1.0"?><gpx xmlns="http://www.topografix.com/GPX/1/1"><rte>'
+            + ''.join(route_points) + '</rte></gpx>').encode()
+
+
+def time_stage(timings, stage, func, *args, **kwargs):
+    """
+    Runs a stage, adding how long it took to its timings
+    :param timings: dict, stage name: list of seconds
+    :param stage: string
+    :param func: function
+    :param args: arguments for func
+    :param kwargs: keyword arguments for func
+    :return: whatever func returns
+    """
+    start = perf_counter()
+    result = func(*args, **kwargs)
+    timings.setdefault(stage, []).append(perf_counter() - start)
+    return result
+
+
+def insert_rows(database_path, rows):
+    """
+    Inserts altitude rows into a new altitude database, into the Locations table and into the
+    tables split by longitude (or easting) that scoring reads (see get_db_table)
+    :param database_path: pathlib Path
+    :param rows: list of dicts, with keys latitude, longitude (or northing, easting) and altitude
+    """
+    engine = db.create_engine(f'sqlite:///{database_path}')
+    with engine.connect() as connection:
+        locations = contour.create_db_table(connection)
+        with connection.begin():
+            connection.execute(db.insert(locations),
+                               altitude_schema.encode_location_rows(rows, locations))
+        if altitude_schema.is_grid():
+            altitude_schema.split_grid_locations(connection)
+        else:
+            altitude_schema.split_longitude_locations(connection)
+    engine.dispose()
+
+
+def run_benchmark(tile_cells, route_points, repeat=3, seed=0):
+    """
+    Generates a tile and a route, then ingests and scores them repeat times, timing each stage
+    :param tile_cells: int, cells along each side of the asc tile
+    :param route_points: int, points in the gpx route
+    :param repeat: int
+    :param seed: int, random seed for the terrain
+    :return: dict, with the parameters, the environment and each stage's timings
+    """
+    altitudes = make_terrain(tile_cells, seed)
+    route_gpx = make_route_gpx(altitudes, route_points)
+    timings, sizes = {}, {}
+    old_paths = dict(database_engines.DATABASE_PATHS)
+    with tempfile.TemporaryDirectory() as directory:
+        asc_path = Path(directory) / f'{GRID_SQUARE}benchmark.asc'
+        write_asc_tile(asc_path, altitudes)
+        try:
+            for run in range(repeat):
+                altitude_df = time_stage(timings, 'asc_read', contour.read_contour_file,
+                                         asc_path)
+                altitude_df = time_stage(timings, 'upsample', contour.double_pad_altitude_df,
+                                         altitude_df)
+                rows = time_stage(timings, 'transform', lambda x: list(
+                    contour.get_coords_rows(x, GRID_SQUARE)), altitude_df)
+                database_path = Path(directory) / f'altitudes{run}.sqlite'
+                time_stage(timings, 'insert', insert_rows, database_path, rows)
+                database_engines.configure_database('altitudes', database_path)
+                route = read_gpx.read_gpx(route_gpx)
+                window_df = time_stage(timings, 'fetch', csp.get_complete_route_altitude_df,
+                                       csp.get_route_bounds(route),
+                                       csp.get_fetch_corridor(route))
+                normalised_route = time_stage(timings, 'normalise', csp.normalise_points,
+                                              route.copy(), window_df)
+                route['scariness'] = time_stage(
+                    timings, 'score', lambda x: x[altitude_schema.get_route_columns()].apply(
+                        csp.calculate_scariness, axis=1, route_altitude_df=window_df),
+                    normalised_route)
+                time_stage(timings, 'render', render_route_map,
+                           prepare_route_for_insertion(route, 'benchmark.gpx'), 5, 'layer')
+                sizes = {'padded_cells': int(altitude_df.size), 'rows': len(rows),
+                         'window_rows': len(window_df), 'route_points': len(route)}
+        finally:
+            for database, path in old_paths.items():
+                database_engines.configure_database(database, path)
+    return {'parameters': {'tile_cells': tile_cells, 'route_points': route_points,
+                           'repeat': repeat, 'seed': seed},
+            'environment': {'python': platform.python_version(), 'numpy': np.__version__,
+                            'pandas': pd.__version__, 'machine': platform.machine()},
+            'sizes': sizes,
+            'stages': {x: {'min_seconds': round(min(timings[x]), 6),
+                           'median_seconds': round(median(timings[x]), 6)} for x in STAGES}}
+
+
+def compare_with_baseline(results, baseline, tolerance=REGRESSION_TOLERANCE):
+    """
+    Compares the fastest time of each stage with a baseline run of the same benchmark, with the
+    same sizes and seed
+    :param results: dict, from run_benchmark
+    :param baseline: dict, from run_benchmark
+    :param tolerance: float, fraction a stage can be slower than the baseline without being
+                      flagged
+    :return: list of dicts, one per stage slower than the baseline by more than the tolerance
+    """
+    sizes = {x: y for x, y in results['parameters'].items() if x != 'repeat'}
+    if sizes != {x: y for x, y in baseline['parameters'].items() if x != 'repeat'}:
+        raise ValueError(f"Baseline was run with {baseline['parameters']}, not "
+                         f"{results['parameters']}")
+    regressions = []
+    for stage, timing in results['stages'].items():
+        baseline_seconds = baseline['stages'].get(stage, {}).get('min_seconds')
+        if baseline_seconds and timing['min_seconds'] > baseline_seconds * (1 + tolerance):
+            regressions.append({'stage': stage, 'baseline_seconds': baseline_seconds,
+                                'seconds': timing['min_seconds'],
+                                'slowdown': round(timing['min_seconds'] / baseline_seconds, 2)})
+    return regressions
+
+
+def main(argv=None):
+    """
+    Runs the benchmark, writing the results as json, and exits with status 1 if any stage has
+    got slower than the baseline
+    :param argv: list of strings, defaults to the command line arguments
+    """
+    parser = argparse.ArgumentParser(
+        description='Time each stage of the ingest and scoring pipelines on synthetic data')
+    parser.add_argument('--tile-cells', type=int, default=20,
+                        help='cells along each side of the generated asc tile')
+    parser.add_argument('--route-points', type=int, default=100,
+                        help='points in the generated gpx route')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='json file to write the results to, default stdout')
+    parser.add_argument('--baseline', help='json results of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=REGRESSION_TOLERANCE,
+                        help='fraction a stage can be slower than the baseline')
+    args = parser.parse_args(argv)
+    results = run_benchmark(args.tile_cells, args.route_points, args.repeat, args.seed)
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            results['regressions'] = compare_with_baseline(results, json.load(baseline_file),
+                                                           args.tolerance)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+    if results.get('regressions'):
+        for regression in results['regressions']:
+            print(f"{regression['stage']} is {regression['slowdown']}x slower than the baseline",
+                  file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,77 +3,338 @@ Functions to process a dataframe containing Route data (latitude, longitude, ele
 to work out if points in route are scary, and assign scariness rating/16
 """
 
-import sqlite3
-import datetime as dt
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from statistics import mean
-from functools import wraps
-from time import perf_counter
+from functools import lru_cache
 import numpy as np
-import matplotlib.pyplot as plt
 import pandas as pd
-from scipy.spatial.distance import cdist
-import swifter   # this import is used implicitly later
-from get_db_table import get_tables
+from OSGridConverter import grid2latlong, latlong2grid
+from get_db_table import get_grid_tables, get_tables
+import altitude_schema
+import database_engines
+import read_gpx
+import simplify_route
+from config import Config
+from instrumentation import span, timer
+from memory_accounting import MemoryBudgetExceededError
 
-
-def timer(func):
-    """
-    Decorator function to time the execution of a function
-    :param func: function
-    :return: function
-    """
-    @wraps(func)
-    def wrapper(*args, **kwargs):
-        start = perf_counter()
-        result = func(*args, **kwargs)
-        end = perf_counter()
-        elapsed = end - start
-        print(f'{func.__name__} took {elapsed} seconds')
-        return result
-    return wrapper
+ROUTE_MARGIN = 0.03
+# Margin in metres when the altitude data is in OS grid coordinates, about ROUTE_MARGIN degrees
+# of latitude
+GRID_MARGIN = 3000
+SEGMENT_POINTS = 50
+FETCH_SETTINGS = {'mode': Config.ALTITUDE_FETCH, 'distance': Config.CORRIDOR_DISTANCE}
+SEGMENT_SETTINGS = {'rows': Config.SEGMENT_ROWS, 'workers': Config.SEGMENT_WORKERS}
+# Points each segment of a long route is extended by at either end, so the points at the ends of
+# the part of the segment that is kept are scored with the route either side of them
+SEGMENT_OVERLAP = 10
+METRES_PER_DEGREE_LAT = 111320
+# Corridor cells are half the corridor distance, and every cell within CORRIDOR_CELL_REACH cells
+# of a point on the path is fetched, which covers the distance plus the gap between the points
+# the path is sampled at
+CORRIDOR_CELL_REACH = 3
+# SQLite rejects a where clause nested more than 1000 deep, which a chain of a box per part of a
+# long route's corridor soon is, so the corridor is fetched this many boxes at a time
+CORRIDOR_QUERY_BOXES = 250
+# Change whenever a change to the scoring gives different scores, so stored results are redone.
+# 2: ties between equally close neighbouring points are broken by their coordinates
+SCORING_VERSION = '2'
 
 
 @timer
-def get_complete_route_altitude_df(route_bounds):
+def get_complete_route_altitude_df(route_bounds, corridor=None):
     """
     Gets all the data from the location database within the max and min latitude and longitude
-    given in route_bounds
+    given in route_bounds or, if given, within the route's corridor
     :param route_bounds: list, [max_lat, max_long, min_lat, min_long]
+    :param corridor: list of boxes, from get_route_corridor
     :return: dataframe with columns for latitude, longitude, altitude
     """
-    tables = get_tables(max_long=route_bounds[1], min_long=route_bounds[3])
     altitudes_df = pd.DataFrame()
-    for table in tables:
-        altitudes_df = altitudes_df.append(get_route_altitude_df(route_bounds, table))
+    for table in get_fetch_tables(route_bounds, corridor):
+        table_df = get_route_altitude_df(route_bounds, table, corridor)
+        # A table with nothing in the window comes back with object columns, which would make
+        # the whole dataframe object
+        if len(table_df) > 0:
+            altitudes_df = altitudes_df.append(table_df)
     altitudes_df.reset_index(inplace=True, drop=True)
     return altitudes_df
 
 
-@timer
-def get_route_altitude_df(route_bounds, table):
+def get_route_altitude_df(route_bounds, table, corridor=None):
     """
     Gets all the data from the specified location table within the max and min latitude and
-    longitude given in route_bounds
+    longitude given in route_bounds or, if given, within the route's corridor
     :param route_bounds: list, [max_lat, max_long, min_lat, min_long]
     :param table: string
+    :param corridor: list of boxes, from get_route_corridor
     :return: dataframe with columns for latitude, longitude, altitude
     """
-    query = (f'select * '
-             f'from {table} '
-             f'where latitude > {route_bounds[2] - 0.03} and '
-             f'latitude < {route_bounds[0] + 0.03} and '
-             f'longitude > {route_bounds[3] - 0.03} and '
-             f'longitude < {route_bounds[1] + 0.03}')
-    con = sqlite3.connect('altitudes.sqlite')
-    altitudes_df = pd.DataFrame()
-    start = dt.datetime.now()
-    for small_altitudes_df in pd.read_sql_query(query, con, chunksize=1000):
-        altitudes_df = altitudes_df.append(small_altitudes_df)
-    con.close()
-    print(dt.datetime.now() - start)
+    with span('fetch', table=table) as fetch_span:
+        connection = database_engines.get_connection('altitudes')
+        chunks = [altitude_schema.read_locations(connection, table, x)
+                  for x in get_fetch_conditions(route_bounds, corridor)]
+        # As for whole tables, a chunk with nothing in it comes back with object columns
+        altitudes_df = pd.concat([x for x in chunks if len(x) > 0] or chunks[:1],
+                                 ignore_index=True)
+        fetch_span.set(rows=len(altitudes_df))
     return altitudes_df
 
 
+def get_route_window_condition(route_bounds):
+    """
+    Gets the where clause picking out the Locations within the max and min latitude and longitude
+    given in route_bounds, plus the margin
+    :param route_bounds: list, [max_lat, max_long, min_lat, min_long]
+    :return: string
+    """
+    condition = altitude_schema.get_column_condition
+    latitude, longitude = altitude_schema.get_coordinates()
+    margin = get_route_margin()
+    return (f"{condition(latitude, '>', route_bounds[2] - margin)} and "
+            f"{condition(latitude, '<', route_bounds[0] + margin)} and "
+            f"{condition(longitude, '>', route_bounds[3] - margin)} and "
+            f"{condition(longitude, '<', route_bounds[1] + margin)}")
+
+
+def get_corridor_condition(corridor):
+    """
+    Gets the where clause picking out the Locations within a route's corridor
+    :param corridor: list of boxes, from get_route_corridor
+    :return: string
+    """
+    condition = altitude_schema.get_column_condition
+    latitude, longitude = altitude_schema.get_coordinates()
+    return ' or '.join(f"({condition(latitude, '>=', x[2])} and "
+                       f"{condition(latitude, '<', x[0])} and "
+                       f"{condition(longitude, '>=', x[3])} and "
+                       f"{condition(longitude, '<', x[1])})" for x in corridor)
+
+
+def get_fetch_conditions(route_bounds, corridor=None):
+    """
+    Gets the where clauses picking out the Locations to fetch for a route, a query each: the
+    window around the bounds, or the corridor CORRIDOR_QUERY_BOXES boxes at a time. The boxes
+    of a corridor don't overlap, so no Location is picked out by more than one
+    :param route_bounds: list, [max_lat, max_long, min_lat, min_long]
+    :param corridor: list of boxes, from get_route_corridor, fetched instead of the bounds
+    :return: list of strings
+    """
+    if corridor:
+        return [get_corridor_condition(corridor[x:x + CORRIDOR_QUERY_BOXES])
+                for x in range(0, len(corridor), CORRIDOR_QUERY_BOXES)]
+    return [get_route_window_condition(route_bounds)]
+
+
+def get_fetch_tables(route_bounds, corridor=None):
+    """
+    Gets the Locations tables holding the data to fetch for a route
+    :param route_bounds: list, [max_lat, max_long, min_lat, min_long]
+    :param corridor: list of boxes, from get_route_corridor, fetched instead of the bounds
+    :return: list of strings
+    """
+    get_longitude_tables = get_grid_tables if altitude_schema.is_grid() else get_tables
+    if corridor:
+        return get_longitude_tables(max(x[1] for x in corridor), min(x[3] for x in corridor))
+    return get_longitude_tables(route_bounds[1], route_bounds[3])
+
+
+def get_route_margin():
+    """
+    Gets the margin fetched around the bounds of a route, in the coordinates the altitude data
+    is stored in
+    :return: float, degrees, or metres in OS grid coordinates
+    """
+    return GRID_MARGIN if altitude_schema.is_grid() else ROUTE_MARGIN
+
+
+def get_grid_coordinates(lat, long):
+    """
+    Converts a latitude and longitude to OS grid coordinates, as the inverse of the grid2latlong
+    conversion that labelled the Locations with latitudes and longitudes, so a point lands on
+    the same ground in either. latlong2grid alone is offset from it by over 100m, so the offset
+    is measured at a first estimate, by converting it back, and taken off
+    :param lat: float
+    :param long: float
+    :return: tuple of floats, (northing, easting) in metres
+    """
+    estimate = latlong2grid(lat, long, tag='OSGB36')
+    back = grid2latlong(str(estimate), tag='OSGB36')
+    offset = latlong2grid(back.latitude, back.longitude, tag='OSGB36')
+    return float(2 * estimate.N - offset.N), float(2 * estimate.E - offset.E)
+
+
+def add_grid_coordinates(route):
+    """
+    Adds the OS grid northing and easting of each point of a route, converting each point once,
+    so the altitude data can be kept in the grid coordinates of the asc files rather than each
+    of its far more numerous points being converted to latitude and longitude. Points that
+    already have them, e.g. before the route was padded, are left as they are
+    :param route: pandas Dataframe with columns lat, long
+    :return: pandas Dataframe, the route, with columns northing and easting in metres
+    """
+    if 'easting' not in route:
+        route['northing'] = route['easting'] = np.nan
+    missing = route['easting'].isna().to_numpy()
+    if missing.any():
+        grid_refs = np.array([get_grid_coordinates(x, y) for x, y in zip(
+            route['lat'].to_numpy()[missing], route['long'].to_numpy()[missing])])
+        route.loc[missing, 'northing'] = grid_refs[:, 0]
+        route.loc[missing, 'easting'] = grid_refs[:, 1]
+    return route
+
+
+def get_route_bounds(route):
+    """
+    Gets the bounds of a route in the coordinates the altitude data is stored in, adding the
+    route's OS grid coordinates first if it is stored in those (see add_grid_coordinates)
+    :param route: pandas Dataframe with columns lat, long
+    :return: list, [max_lat, max_long, min_lat, min_long], or [max_northing, max_easting,
+             min_northing, min_easting]
+    """
+    if not altitude_schema.is_grid():
+        return read_gpx.get_route_bounds(route)
+    add_grid_coordinates(route)
+    return [route['northing'].max(), route['easting'].max(),
+            route['northing'].min(), route['easting'].min()]
+
+
+def get_route_corridor(route, distance):
+    """
+    Gets the corridor of ground within distance of a route's path, as boxes made up of the cells
+    of a grid, half the distance across, that are near the path. The path is sampled at least
+    once a cell between its points, so a long straight leg is covered all the way along. Only
+    the ground near the path is fetched, rather than the whole bounding box, which for a long
+    diagonal or horseshoe route is mostly far from it
+    :param route: pandas Dataframe with columns lat, long (or northing, easting, see
+                  get_route_bounds)
+    :param distance: float, metres
+    :return: list of boxes, [max_lat, max_long, min_lat, min_long], not overlapping, each
+             including its minimum latitude and longitude but not its maximum
+    """
+    lat_column, long_column = altitude_schema.get_route_columns()
+    lats = route[lat_column].to_numpy(dtype=float)
+    longs = route[long_column].to_numpy(dtype=float)
+    if altitude_schema.is_grid():
+        cell_lat = cell_long = distance / 2
+    else:
+        cell_lat = distance / 2 / METRES_PER_DEGREE_LAT
+        # A degree of longitude is shortest furthest from the equator, so size the cells there
+        cell_long = cell_lat / np.cos(np.radians(np.abs(lats).max()))
+    steps = np.ceil(np.maximum(np.abs(np.diff(lats)) / cell_lat,
+                               np.abs(np.diff(longs)) / cell_long)).astype(int)
+    fractions = [np.arange(x) / x for x in np.maximum(steps, 1)]
+    sample_lats = np.concatenate([x + (y - x) * z for x, y, z in zip(lats[:-1], lats[1:],
+                                                                      fractions)] + [lats[-1:]])
+    sample_longs = np.concatenate([x + (y - x) * z for x, y, z in zip(
+        longs[:-1], longs[1:], fractions)] + [longs[-1:]])
+    path_cells = np.unique(np.column_stack([np.floor(sample_lats / cell_lat),
+                                            np.floor(sample_longs / cell_long)]), axis=0)
+    reach = np.arange(-CORRIDOR_CELL_REACH, CORRIDOR_CELL_REACH + 1)
+    offsets = np.array(np.meshgrid(reach, reach)).reshape(2, -1).T
+    cells = np.unique((path_cells[:, None, :] + offsets[None, :, :]).reshape(-1, 2), axis=0)
+    # Join the cells into runs along each row, then join runs spanning the same columns in
+    # consecutive rows
+    runs = []
+    for row, column in cells:
+        if runs and runs[-1][0] == row and runs[-1][2] == column - 1:
+            runs[-1][2] = column
+        else:
+            runs.append([row, column, column])
+    boxes, open_boxes = [], {}
+    for row, first, last in runs:
+        box = open_boxes.get((first, last))
+        if box is None or box[1] != row - 1:
+            box = open_boxes[(first, last)] = [row, row, first, last]
+            boxes.append(box)
+        box[1] = row
+    return [[(x[1] + 1) * cell_lat, (x[3] + 1) * cell_long, x[0] * cell_lat, x[2] * cell_long]
+            for x in boxes]
+
+
+def get_fetch_corridor(route):
+    """
+    Gets the corridor to fetch the altitude data of a route in, if the altitude data is fetched
+    by corridor (see ALTITUDE_FETCH in config)
+    :param route: pandas Dataframe with columns lat, long (or northing, easting, see
+                  get_route_bounds)
+    :return: list of boxes, from get_route_corridor, or None to fetch the bounding box
+    """
+    if FETCH_SETTINGS['mode'] != 'corridor':
+        return None
+    return get_route_corridor(route, FETCH_SETTINGS['distance'])
+
+
+def count_route_altitude_rows(route_bounds, corridor=None):
+    """
+    Counts the rows get_complete_route_altitude_df would fetch for route_bounds, or the
+    corridor, without fetching them
+    :param route_bounds: list, [max_lat, max_long, min_lat, min_long]
+    :param corridor: list of boxes, from get_route_corridor
+    :return: int
+    """
+    connection = database_engines.get_connection('altitudes')
+    conditions = get_fetch_conditions(route_bounds, corridor)
+    return sum(connection.execute(f'select count(*) from {table} where {condition}').scalar()
+               for table in get_fetch_tables(route_bounds, corridor) for condition in conditions)
+
+
+def get_fetch_version():
+    """
+    Gets the part of the scoring version recording how the altitude data is stored and fetched.
+    Scores from a corridor can differ from those from the bounding box where the highest point
+    of a route is matched to ground outside the corridor, scores from the compact schema where
+    an altitude rounded to the decimetre crosses a threshold, and scores from OS grid
+    coordinates, where the neighbours of a point are found by distance in metres rather than
+    degrees, so they are stored separately
+    :return: string, empty for the float schema in latitude and longitude fetching the bounding
+             box
+    """
+    version = '-compact' if altitude_schema.get_schema() == 'compact' else ''
+    if altitude_schema.is_grid():
+        version += '-grid'
+    if FETCH_SETTINGS['mode'] == 'corridor':
+        version += f"-corridor{FETCH_SETTINGS['distance']:g}"
+    return version
+
+
+def get_scoring_version(simplify=False):
+    """
+    Gets the version of the scoring algorithm that stored results are keyed by
+    :param simplify: boolean, whether routes are simplified before scoring
+    :return: string
+    """
+    if simplify:
+        return f'{SCORING_VERSION}{get_fetch_version()}-simplified'
+    return f'{SCORING_VERSION}{get_fetch_version()}'
+
+
+def get_route_window(altitudes_df, route_bounds, corridor=None):
+    """
+    Cuts the altitude data for a single route out of a larger altitudes dataframe, e.g. one
+    fetched for a group of overlapping routes, so the route sees the same data as if it had been
+    fetched on its own
+    :param altitudes_df: dataframe with columns for latitude, longitude, altitude
+    :param route_bounds: list, [max_lat, max_long, min_lat, min_long]
+    :param corridor: list of boxes, from get_route_corridor, cut out instead of the bounds
+    :return: dataframe with columns for latitude, longitude, altitude
+    """
+    latitudes, longitudes = [altitudes_df[x] for x in altitude_schema.get_coordinates()]
+    if corridor:
+        in_corridor = np.zeros(len(altitudes_df), dtype=bool)
+        for box in corridor:
+            in_corridor |= ((latitudes >= box[2]) & (latitudes < box[0])
+                            & (longitudes >= box[3]) & (longitudes < box[1])).to_numpy()
+        return altitudes_df.loc[in_corridor].reset_index(drop=True)
+    margin = get_route_margin()
+    window = altitudes_df.loc[(latitudes > route_bounds[2] - margin)
+                              & (latitudes < route_bounds[0] + margin)
+                              & (longitudes > route_bounds[3] - margin)
+                              & (longitudes < route_bounds[1] + margin)]
+    return window.reset_index(drop=True)
+
+
 def get_neighbouring_points(point, route_altitude_df, no_points):
     """
     Gets the closest points in a Dataframe of locations to the point passed
@@ -82,27 +343,32 @@ def get_neighbouring_points(point, route_altitude_df, no_points):
     :param no_points: int (number of neighbours required)
     :return: pandas Dataframe
     """
-    point_arr = np.reshape(point[['lat', 'long']].to_numpy(), (-1, 2))
-    route_altitude_arr = route_altitude_df[['latitude', 'longitude']].to_numpy()
-    distances = cdist(route_altitude_arr, point_arr)
-    distances_df = pd.DataFrame(distances)
-    distances_df.sort_values(by=[0], inplace=True)
-    indices = list(distances_df.iloc[list(range(no_points))].index)
-    return route_altitude_df.iloc[indices]
+    # scipy is imported on first use, to keep it out of the web application's start up
+    from scipy.spatial.distance import cdist  # pylint: disable=import-outside-toplevel
+    point_arr = np.reshape(point[altitude_schema.get_route_columns()].to_numpy(), (-1, 2))
+    route_altitude_arr = route_altitude_df[altitude_schema.get_coordinates()].to_numpy()
+    distances = cdist(route_altitude_arr, point_arr)[:, 0]
+    # Points as close as the furthest neighbour are all candidates, and ties between them, common
+    # on the regular grid of OS grid coordinates, are broken by their coordinates rather than by
+    # the order they were fetched in, which differs between a route's window, corridor and
+    # segments
+    cutoff = np.partition(distances, no_points - 1)[no_points - 1]
+    candidates = np.flatnonzero(distances <= cutoff)
+    order = np.lexsort((route_altitude_arr[candidates, 1], route_altitude_arr[candidates, 0],
+                        distances[candidates]))
+    return route_altitude_df.iloc[candidates[order[:no_points]]]
 
 
 def plot_route_on_altitudes_df(route_df, altitudes_df, region_name):
     """
-    Plots the route on the background of the altitudes, for sanity checks
+    Plots the route on the background of the altitudes, for sanity checks (see
+    plot_altitude_data, which imports matplotlib)
     :param route_df: pandas dataframe from gpx file
     :param altitudes_df: pandas dataframe containing background Locations
     :param region_name: string
     """
-    plt.scatter(altitudes_df['longitude'], altitudes_df['latitude'],
-                c=altitudes_df['altitude'])
-    plt.scatter(route_df['long'], route_df['lat'], marker=11)
-    plt.title(region_name)
-    plt.show()
+    import plot_altitude_data  # pylint: disable=import-outside-toplevel
+    plot_altitude_data.plot_route_on_altitudes_df(route_df, altitudes_df, region_name)
 
 
 def calculate_scariness(point, route_altitude_df):
@@ -112,13 +378,15 @@ def calculate_scariness(point, route_altitude_df):
     :param route_altitude_df: Pandas Dataframe
     :return: int, max 16
     """
-    neighbours = get_neighbouring_points(point, route_altitude_df, 64)
-    midpoint = neighbours['altitude'].head(4).mean()
-    sectors = get_sectors(point, neighbours)
-    scariness = 0
-    for listy in [x for x in sectors.values() if len(x) > 0]:
-        if abs(mean(listy) - midpoint) > 10:
-            scariness += 1
+    with span('neighbour_search'):
+        neighbours = get_neighbouring_points(point, route_altitude_df, 64)
+    with span('sector_scoring'):
+        midpoint = neighbours['altitude'].head(4).mean()
+        sectors = get_sectors(point, neighbours)
+        scariness = 0
+        for listy in [x for x in sectors.values() if len(x) > 0]:
+            if abs(mean(listy) - midpoint) > 10:
+                scariness += 1
     return scariness
 
 
@@ -132,11 +400,13 @@ def get_sectors(point, neighbours):
     """
     sectors = {'ene': [], 'nne': [], 'nnw': [], 'wnw': [],
                'wsw': [], 'ssw': [], 'sse': [], 'ese': []}
+    latitude, longitude = altitude_schema.get_coordinates()
+    lat_column, long_column = altitude_schema.get_route_columns()
     for _, row in neighbours.iterrows():
-        lat2 = row['latitude']
-        lat1 = point['lat']
-        long2 = row['longitude']
-        long1 = point['long']
+        lat2 = row[latitude]
+        lat1 = point[lat_column]
+        long2 = row[longitude]
+        long1 = point[long_column]
         angle = get_angle_between_two_points(long1, lat1, long2, lat2)
         if angle < 45:
             sectors['ene'].append(row['altitude'])
@@ -178,17 +448,284 @@ def get_angle_between_two_points(point1_x, point1_y, point2_x, point2_y):
 
 
 @timer
-def calculate_route_scariness(route, altitude_df):
+def calculate_route_scariness(route, altitude_df, simplify=False):
     """
     For each point in a route, calculate the scariness of that point /16
     :param route: pandas Dataframe from .gpx file
     :param altitude_df: pandas Dataframe containing Location data (latitude, longitude, altitude)
                         surrounding the Route
+    :param simplify: boolean, only fully score the points picked out by simplify_route and
+                     interpolate the rest
     :return: pandas Dataframe
     """
+    # swifter (and dask with it) is imported on first use, and registers the .swifter accessor
+    import swifter  # pylint: disable=import-outside-toplevel,unused-import
     normalised_route = normalise_points(route.copy(), altitude_df)
-    route['scariness'] = normalised_route[['lat', 'long']].swifter.apply(
-            calculate_scariness, axis=1, route_altitude_df=altitude_df)
+    if simplify:
+        route['scariness'] = calculate_simplified_route_scariness(normalised_route, altitude_df)
+    else:
+        route['scariness'] = normalised_route[altitude_schema.get_route_columns()].swifter.apply(
+                calculate_scariness, axis=1, route_altitude_df=altitude_df)
+    return route
+
+
+@timer
+def calculate_simplified_route_scariness(normalised_route, altitude_df):
+    """
+    Calculates the scariness of the points of a simplified route, and of the points on steep
+    ground, then interpolates the scores for the rest of the route
+    :param normalised_route: pandas Dataframe, route normalised to the altitude data
+    :param altitude_df: pandas Dataframe containing Location data (latitude, longitude, altitude)
+                        surrounding the Route
+    :return: numpy array of ints, one score per point in the route
+    """
+    import swifter  # pylint: disable=import-outside-toplevel,unused-import
+    to_score = simplify_route.get_points_to_score(normalised_route, altitude_df)
+    scores = normalised_route.loc[to_score, altitude_schema.get_route_columns()].swifter.apply(
+        calculate_scariness, axis=1, route_altitude_df=altitude_df)
+    return simplify_route.interpolate_scores(
+        simplify_route.get_route_distances(normalised_route), to_score, scores.to_numpy())
+
+
+def score_route_segments(route, altitude_df, simplify=False, segment_points=SEGMENT_POINTS):
+    """
+    Calculates the scariness of each point in a route a segment at a time, in route order, so the
+    start of the route can be shown before the rest is scored. The whole route is normalised to
+    the altitude data before the first segment, and the scores are the same as those from
+    calculate_route_scariness. When simplifying, each segment is a run of the points picked out
+    by simplify_route, with the points in between interpolated from the scores either side
+    :param route: pandas Dataframe from .gpx file
+    :param altitude_df: pandas Dataframe containing Location data (latitude, longitude, altitude)
+                        surrounding the Route
+    :param simplify: boolean, only fully score the points picked out by simplify_route and
+                     interpolate the rest
+    :param segment_points: int, number of points fully scored in each segment
+    :return: generator of tuples, (index of the first point in the segment, numpy array of ints
+             with the scores of the points in the segment)
+    """
+    normalised_route = normalise_points(route.copy(), altitude_df)
+    if not simplify:
+        for start in range(0, len(normalised_route), segment_points):
+            segment = normalised_route.iloc[start:start + segment_points]
+            yield start, segment[altitude_schema.get_route_columns()].apply(
+                calculate_scariness, axis=1, route_altitude_df=altitude_df).to_numpy(dtype=int)
+        return
+    scored_points = np.flatnonzero(simplify_route.get_points_to_score(normalised_route,
+                                                                      altitude_df))
+    distances = simplify_route.get_route_distances(normalised_route)
+    start = 0
+    anchor_points, anchor_scores = np.array([], dtype=int), np.array([], dtype=float)
+    for group_start in range(0, len(scored_points), segment_points):
+        group = scored_points[group_start:group_start + segment_points]
+        scores = normalised_route.iloc[group][altitude_schema.get_route_columns()].apply(
+            calculate_scariness, axis=1, route_altitude_df=altitude_df).to_numpy(dtype=float)
+        end = len(normalised_route) if group_start + segment_points >= len(scored_points) \
+            else group[-1] + 1
+        anchor_points = np.concatenate((anchor_points[-1:], group))
+        anchor_scores = np.concatenate((anchor_scores[-1:], scores))
+        segment_scores = np.interp(distances[start:end], distances[anchor_points], anchor_scores)
+        segment_scores[group - start] = scores
+        yield start, np.rint(segment_scores).astype(int)
+        start = end
+
+
+@timer
+def calculate_route_scariness_by_segment(route, altitude_df, on_segment, simplify=False):
+    """
+    For each point in a route, calculate the scariness of that point /16 a segment at a time (see
+    score_route_segments), passing each segment's scores on as soon as they are calculated
+    :param route: pandas Dataframe from .gpx file
+    :param altitude_df: pandas Dataframe containing Location data (latitude, longitude, altitude)
+                        surrounding the Route
+    :param on_segment: function called with the route, the index of the first point in the
+                       segment and the segment's scores
+    :param simplify: boolean, only fully score the points picked out by simplify_route and
+                     interpolate the rest
+    :return: pandas Dataframe
+    """
+    scores = np.zeros(len(route), dtype=int)
+    for start, segment_scores in score_route_segments(route, altitude_df, simplify=simplify):
+        scores[start:start + len(segment_scores)] = segment_scores
+        on_segment(route, start, segment_scores)
+    route['scariness'] = scores
+    return route
+
+
+def get_window_area(route_bounds):
+    """
+    Gets the area of the altitude window fetched for route_bounds, including the margin
+    :param route_bounds: list, [max_lat, max_long, min_lat, min_long]
+    :return: float, square degrees (or square metres in OS grid coordinates)
+    """
+    margin = get_route_margin()
+    return ((route_bounds[0] - route_bounds[2] + 2 * margin)
+            * (route_bounds[1] - route_bounds[3] + 2 * margin))
+
+
+def get_corridor_area(route_bounds, corridor=None):
+    """
+    Gets the area of the altitude data fetched for a route, its corridor if given, otherwise
+    its window
+    :param route_bounds: list, [max_lat, max_long, min_lat, min_long]
+    :param corridor: list of boxes, from get_route_corridor
+    :return: float, square degrees (or square metres in OS grid coordinates)
+    """
+    if corridor:
+        return sum((x[0] - x[2]) * (x[1] - x[3]) for x in corridor)
+    return get_window_area(route_bounds)
+
+
+def get_point_area(route):
+    """
+    Gets the area of the altitude data fetched for a single point of a route, in the same units
+    as get_corridor_area: the corridor around the point when fetching by corridor, otherwise
+    the window around it. The point furthest from the equator is measured, as the corridor's
+    cells are sized there (see get_route_corridor)
+    :param route: pandas Dataframe with columns lat, long (or northing, easting, see
+                  get_route_bounds)
+    :return: float, square degrees (or square metres in OS grid coordinates)
+    """
+    if FETCH_SETTINGS['mode'] != 'corridor':
+        return get_window_area([0, 0, 0, 0])
+    lat_column = altitude_schema.get_route_columns()[0]
+    point = route.loc[[route[lat_column].abs().idxmax()]]
+    return get_corridor_area(None, get_route_corridor(point, FETCH_SETTINGS['distance']))
+
+
+def split_route_into_windows(route, max_rows, rows_per_square_degree):
+    """
+    Splits a route into runs of consecutive points whose altitude windows are each estimated,
+    from the density of the altitude data, to hold at most max_rows rows
+    :param route: pandas Dataframe with columns lat, long
+    :param max_rows: int
+    :param rows_per_square_degree: float, density of the altitude data around the route
+    :return: list of tuples, (index of the first point in the run, index after the last point)
+    """
+    point_rows = get_point_area(route) * rows_per_square_degree
+    if point_rows > max_rows:
+        raise MemoryBudgetExceededError(
+            f'The altitude data around a single point of the route, about {point_rows:.0f} '
+            f'rows, is more than the {max_rows} rows that fit in the memory budget')
+    windows, start, bounds = [], 0, None
+    lats, longs = [route[x].to_numpy() for x in altitude_schema.get_route_columns()]
+    for index, (lat, long) in enumerate(zip(lats, longs)):
+        if bounds is not None:
+            bounds = [max(bounds[0], lat), max(bounds[1], long),
+                      min(bounds[2], lat), min(bounds[3], long)]
+        if bounds is None or get_window_area(bounds) * rows_per_square_degree > max_rows:
+            if bounds is not None:
+                windows.append((start, index))
+            start, bounds = index, [lat, long, lat, long]
+    windows.append((start, len(route)))
+    return windows
+
+
+def split_route_into_segments(windows, points, overlap=SEGMENT_OVERLAP):
+    """
+    Extends the windows a route is split into by overlap points at either end
+    :param windows: list of tuples, from split_route_into_windows
+    :param points: int, number of points in the route
+    :param overlap: int
+    :return: list of tuples, (index of the first point in the segment, index after the last,
+             index of the first point to keep the score of, index after the last)
+    """
+    return [(max(0, start - overlap), min(points, end + overlap), start, end)
+            for start, end in windows]
+
+
+def init_segment_worker(altitudes_path, schema_settings, fetch_settings):
+    """
+    Sets up a process scoring segments to read the same altitude data in the same way as the
+    process that started it. Segment workers are spawned rather than forked, as they can be
+    started from a thread of the application, so each opens its own database engine instead of
+    inheriting the pooled connections
+    :param altitudes_path: string, path of the altitude database
+    :param schema_settings: dict, altitude_schema.SCHEMA_SETTINGS
+    :param fetch_settings: dict, FETCH_SETTINGS
+    """
+    database_engines.configure_database('altitudes', altitudes_path)
+    altitude_schema.SCHEMA_SETTINGS.update(schema_settings)
+    FETCH_SETTINGS.update(fetch_settings)
+
+
+def score_segment(segment, simplify=False):
+    """
+    Scores a segment of a normalised route against the altitude data around the segment alone,
+    so only that data is held while it is scored
+    :param segment: pandas Dataframe, run of points of a route normalised to the altitude data
+    :param simplify: boolean, only fully score the points of the segment picked out by
+                     simplify_route and interpolate the rest
+    :return: numpy array of ints, one score per point in the segment
+    """
+    altitude_df = get_complete_route_altitude_df(get_route_bounds(segment),
+                                                 get_fetch_corridor(segment))
+    if simplify:
+        return np.rint(calculate_simplified_route_scariness(segment, altitude_df)).astype(int)
+    return segment[altitude_schema.get_route_columns()].apply(
+        calculate_scariness, axis=1, route_altitude_df=altitude_df).to_numpy(dtype=int)
+
+
+@timer
+def calculate_windowed_route_scariness(route, max_rows, on_segment=None, window_rows=None,
+                                       simplify=False, workers=1, segment_rows=None):
+    """
+    For each point in a route, calculate the scariness of that point /16, splitting the route
+    into overlapping segments that each fetch their own altitude data, rather than fetching it
+    for the whole route, so that no more than about max_rows rows are held at once for each
+    segment being scored. Each point's score is kept from the segment that holds it at least
+    SEGMENT_OVERLAP points from the segment's ends, so it is scored with the route and the ground
+    either side of it, and a point at a segment boundary gets the same score as if the route was
+    scored whole (and nearly the same when simplifying). The route is normalised
+    against the window around its highest point, which finds the same match as the whole
+    route's window unless the nearest point of the same height is further away than the margin
+    :param route: pandas Dataframe from .gpx file
+    :param max_rows: int, most altitude rows that fit in the memory budget for a segment, or
+                     None if there is no budget
+    :param on_segment: function called with the route, the index of the first point in each
+                       window and the window's scores, in route order
+    :param window_rows: int, rows in the whole route's altitude window, if already counted
+    :param simplify: boolean, only fully score the points picked out by simplify_route in each
+                     segment and interpolate the rest
+    :param workers: int, segments scored at once, each in its own spawned process (see
+                    init_segment_worker)
+    :param segment_rows: int, altitude rows to aim for in each segment, within max_rows, though
+                         never fewer than around a single point
+    :return: pandas Dataframe
+    """
+    route_bounds = get_route_bounds(route)
+    corridor = get_fetch_corridor(route)
+    if window_rows is None:
+        window_rows = count_route_altitude_rows(route_bounds, corridor)
+    rows_per_square_degree = window_rows / get_corridor_area(route_bounds, corridor)
+    if segment_rows:
+        point_rows = int(np.ceil(get_point_area(route) * rows_per_square_degree))
+        segment_rows = max(segment_rows, point_rows)
+        max_rows = segment_rows if max_rows is None else min(max_rows, segment_rows)
+    windows = split_route_into_windows(route, max_rows, rows_per_square_degree)
+    segments = split_route_into_segments(windows, len(route))
+    highest_point = route.loc[[route['elevation'].idxmax()]]
+    normalised_route = normalise_points(route.copy(), get_complete_route_altitude_df(
+        get_route_bounds(highest_point), get_fetch_corridor(highest_point)))
+    segment_routes = [normalised_route.iloc[x[0]:x[1]] for x in segments]
+    scores = np.zeros(len(route), dtype=int)
+    executor = ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+        initializer=init_segment_worker,
+        initargs=(database_engines.DATABASE_PATHS['altitudes'],
+                  dict(altitude_schema.SCHEMA_SETTINGS), dict(FETCH_SETTINGS))) \
+        if workers > 1 and len(segments) > 1 else None
+    try:
+        segment_scores = executor.map(score_segment, segment_routes,
+                                      [simplify] * len(segments)) if executor \
+            else (score_segment(x, simplify) for x in segment_routes)
+        for (first, _, start, end), segment_score in zip(segments, segment_scores):
+            scores[start:end] = segment_score[start - first:end - first]
+            if on_segment is not None:
+                on_segment(route, start, scores[start:end])
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+    route['scariness'] = scores
     return route
 
 
@@ -202,6 +739,10 @@ def normalise_points(route, altitude_df):
     locations
     :return: pandas dataframe
     """
+    if altitude_schema.is_grid():
+        add_grid_coordinates(route)
+    latitude, longitude = altitude_schema.get_coordinates()
+    lat_column, long_column = altitude_schema.get_route_columns()
     max_route_height = route['elevation'].max()
     max_route_point = route.loc[route['elevation'] == max_route_height]
     equivalent_heights_from_alt = altitude_df.loc[
@@ -210,38 +751,49 @@ def normalise_points(route, altitude_df):
     equivalent_alt_point = get_neighbouring_points(
         max_route_point, equivalent_heights_from_alt, 1
     )
-    lat_diff = equivalent_alt_point.iloc[0]['latitude'] - max_route_point['lat']
-    lon_diff = equivalent_alt_point.iloc[0]['longitude'] - max_route_point['long']
-    route['lat'] = route['lat'] + lat_diff.iloc[0]
-    route['long'] = route['long'] + lon_diff.iloc[0]
+    lat_diff = equivalent_alt_point.iloc[0][latitude] - max_route_point[lat_column]
+    lon_diff = equivalent_alt_point.iloc[0][longitude] - max_route_point[long_column]
+    route[lat_column] = route[lat_column] + lat_diff.iloc[0]
+    route[long_column] = route[long_column] + lon_diff.iloc[0]
     return route
 
 
 def get_altitudes_max_and_min_lat_and_long():
     """
-    Gets the maximum and minimum latitude and longitude from the big altitudes table
+    Gets the maximum and minimum latitude and longitude from the big altitudes table, or the
+    northing and easting in OS grid coordinates (as maxnorthing, minnorthing and so on)
     For setting application config only
     :return: pandas dataframe
     """
-    con = sqlite3.connect('altitudes.sqlite')
-    query = "select max(latitude) maxlat, min(latitude) minlat, " \
-            "max(longitude) maxlong, min(longitude) minlong " \
-            "from locations"
-    result = pd.read_sql_query(query, con)
-    con.close()
-    return result
+    coordinates = altitude_schema.get_coordinates()
+    query = 'select ' + ', '.join(
+        f'max({altitude_schema.get_column(x)}) max{y}, min({altitude_schema.get_column(x)}) min{y}'
+        for x, y in zip(coordinates, altitude_schema.get_route_columns())) + ' from locations'
+    return pd.read_sql_query(query, database_engines.get_connection('altitudes')) \
+        / altitude_schema.get_scale(coordinates[0])
+
+
+@lru_cache(maxsize=1)
+def get_locations_extremes():
+    """
+    Gets the maximum and minimum latitude and longitude of the Location data, as saved from
+    get_altitudes_max_and_min_lat_and_long, reading the file once per process
+    :return: pandas dataframe
+    """
+    return pd.read_pickle(Config.LOCATIONS_EXTREMES_FILE)
 
 
 def check_route_bounds_fit_location_data(route_bounds):
     """
     Checks that the bounds of a given route are within the Location database limits
-    :param route_bounds: list
+    :param route_bounds: list, from get_route_bounds
     :return: boolean
     """
-    database_maxima_minima = pd.read_pickle("tests/locations_extremes.pkl").iloc[0]
-    if route_bounds[0] < database_maxima_minima['maxlat'] \
-        and route_bounds[1] < database_maxima_minima['maxlong'] \
-        and route_bounds[2] > database_maxima_minima['minlat'] \
-        and route_bounds[3] > database_maxima_minima['minlong']:
+    database_maxima_minima = get_locations_extremes().iloc[0]
+    lat_column, long_column = altitude_schema.get_route_columns()
+    if route_bounds[0] < database_maxima_minima[f'max{lat_column}'] \
+        and route_bounds[1] < database_maxima_minima[f'max{long_column}'] \
+        and route_bounds[2] > database_maxima_minima[f'min{lat_column}'] \
+        and route_bounds[3] > database_maxima_minima[f'min{long_column}']:
         return True
     return False
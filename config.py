@@ -2,4 +2,84 @@ import os
 
 class Config(object):
     # Protection against CSRF attacks
-    SECRET_KEY = os.environ.get('SECRET_KEY') or 'you-will-never-guess'
\ No newline at end of file
+    SECRET_KEY = os.environ.get('SECRET_KEY') or 'you-will-never-guess'
+    # Only fully score the simplified route and steep ground of uploaded routes
+    SIMPLIFY_ROUTES = (os.environ.get('SIMPLIFY_ROUTES') or 'true').lower() == 'true'
+    # Database files, and the pool and sqlite page cache settings used to read them
+    WAYPOINTS_DATABASE = os.environ.get('WAYPOINTS_DATABASE') or 'waypoints.sqlite'
+    ALTITUDES_DATABASE = os.environ.get('ALTITUDES_DATABASE') or 'altitudes.sqlite'
+    DATABASE_POOL_SIZE = int(os.environ.get('DATABASE_POOL_SIZE') or 5)
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE') or 256 * 1024 * 1024)
+    # Negative cache sizes are in KiB rather than pages
+    SQLITE_CACHE_SIZE = int(os.environ.get('SQLITE_CACHE_SIZE') or -64 * 1024)
+    # Also store routes as one row per waypoint, as well as in the routes catalog
+    STORE_WAYPOINT_ROWS = (os.environ.get('STORE_WAYPOINT_ROWS') or 'false').lower() == 'true'
+    # Schema of the Locations tables in the altitude database: 'float' for latitude, longitude
+    # and altitude as floats, or 'compact' for fixed point integers in WITHOUT ROWID tables (see
+    # altitude_schema, which also migrates a database from one to the other)
+    ALTITUDE_SCHEMA = os.environ.get('ALTITUDE_SCHEMA') or 'float'
+    # Coordinates of the Locations: 'latlong' for latitude and longitude, or 'grid' for OS grid
+    # northing and easting in metres, split into tables by easting, with the points of routes
+    # converted to the grid as they are scored
+    ALTITUDE_COORDINATES = os.environ.get('ALTITUDE_COORDINATES') or 'latlong'
+    # Altitude data fetched around a route: 'bbox' for everything in its bounding box plus a
+    # margin, or 'corridor' for only the ground within CORRIDOR_DISTANCE metres of its path
+    ALTITUDE_FETCH = os.environ.get('ALTITUDE_FETCH') or 'bbox'
+    CORRIDOR_DISTANCE = float(os.environ.get('CORRIDOR_DISTANCE') or 1000)
+    # Routes whose altitude data would be more than SEGMENT_ROWS rows are scored in overlapping
+    # segments of about that many rows each, 0 for never, SEGMENT_WORKERS segments at a time in
+    # separate processes
+    SEGMENT_ROWS = int(os.environ.get('SEGMENT_ROWS') or 1000000)
+    SEGMENT_WORKERS = int(os.environ.get('SEGMENT_WORKERS') or 1)
+    # Number of rendered route maps cached in memory, and an optional directory to cache them on
+    # disk as well
+    MAP_CACHE_SIZE = int(os.environ.get('MAP_CACHE_SIZE') or 128)
+    MAP_CACHE_DIR = os.environ.get('MAP_CACHE_DIR')
+    # 'layer' draws a route as a single layer built in the browser, 'markers' as a folium marker
+    # per waypoint
+    MAP_RENDER_MODE = os.environ.get('MAP_RENDER_MODE') or 'layer'
+    # Worker threads scoring uploaded routes in the background, and the number of finished jobs
+    # remembered for the job status page. Jobs left queued or running by a process that has died,
+    # or for longer than SCORING_JOB_TIMEOUT seconds, are marked as failed when a process starts
+    SCORING_WORKERS = int(os.environ.get('SCORING_WORKERS') or 2)
+    SCORING_JOB_HISTORY = int(os.environ.get('SCORING_JOB_HISTORY') or 256)
+    SCORING_JOB_TIMEOUT = float(os.environ.get('SCORING_JOB_TIMEOUT') or 3600)
+    # 'exact' scores uploaded routes in full, 'two-pass' shows provisional scores from a coarse
+    # grid first and then refines the scores near the chosen fear level (see two_pass_scoring).
+    # Two pass scores are only kept with their job, not in the routes catalog, unless
+    # TWO_PASS_EXACT_RESCORE also scores each upload exactly in the background, which costs more
+    # than exact mode alone
+    SCORING_MODE = os.environ.get('SCORING_MODE') or 'exact'
+    TWO_PASS_EXACT_RESCORE = (os.environ.get('TWO_PASS_EXACT_RESCORE') or 'false').lower() == \
+        'true'
+    # Uploaded gpx files are read in memory, so requests are capped at this size in bytes, and
+    # are only kept if an archive directory is given
+    MAX_CONTENT_LENGTH = int(os.environ.get('MAX_UPLOAD_SIZE') or 5 * 1024 * 1024)
+    UPLOAD_ARCHIVE_DIR = os.environ.get('UPLOAD_ARCHIVE_DIR')
+    # Maximum and minimum latitude and longitude of the altitude data, saved from
+    # calculate_scary_points.get_altitudes_max_and_min_lat_and_long
+    LOCATIONS_EXTREMES_FILE = os.environ.get('LOCATIONS_EXTREMES_FILE') or \
+        'tests/locations_extremes.pkl'
+    # Load data and open databases when the server starts: 'background' in a thread while it
+    # starts serving (the readiness endpoint reports when it's done), 'sync' before it starts
+    # serving, or 'off'. Optionally also read the altitude data for regions given as
+    # max_lat,max_long,min_lat,min_long;... into the database page cache
+    WARM_UP = os.environ.get('WARM_UP') or 'background'
+    WARM_UP_REGIONS = os.environ.get('WARM_UP_REGIONS') or ''
+    # Time each request, scoring job and ingested tile as nested spans for each stage, served as
+    # histograms from /metrics, and log each one as a line of json to TIMING_LOG ('-' for stderr)
+    INSTRUMENTATION = (os.environ.get('INSTRUMENTATION') or 'true').lower() == 'true'
+    TIMING_LOG = os.environ.get('TIMING_LOG')
+    # Profile the route map pipeline of requests sending PROFILE_TOKEN in the X-Profile-Token
+    # header, and of a sampled percentage of all requests, keeping the newest PROFILE_MAX_FILES
+    # profiles in PROFILE_DIR (see request_profiling)
+    PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')
+    PROFILE_SAMPLE_PERCENT = float(os.environ.get('PROFILE_SAMPLE_PERCENT') or 0)
+    PROFILE_DIR = os.environ.get('PROFILE_DIR') or 'profiles'
+    PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES') or 20)
+    # Memory budget in bytes for each scoring or ingest job, 0 for none. Routes whose altitude
+    # data wouldn't fit are scored a window at a time, as are asc tiles padded and inserted, and
+    # jobs that can't fit even then are rejected. MEMORY_TRACKING records the peak memory of each
+    # stage with tracemalloc, which slows everything down
+    MEMORY_BUDGET = int(os.environ.get('MEMORY_BUDGET') or 0)
+    MEMORY_TRACKING = (os.environ.get('MEMORY_TRACKING') or 'false').lower() == 'true'
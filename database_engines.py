@@ -0,0 +1,111 @@
+"""
+Process-wide pooled database engines for the Routes (waypoints.sqlite) and Locations
+(altitudes.sqlite) databases, with one connection per database reused for the length of a request
+"""
+
+import os
+import threading
+import sqlalchemy as db
+from sqlalchemy.pool import QueuePool
+from config import Config
+
+DATABASE_PATHS = {'waypoints': Config.WAYPOINTS_DATABASE,
+                  'altitudes': Config.ALTITUDES_DATABASE}
+READ_ONLY_DATABASES = {'altitudes'}
+
+_ENGINES = {}
+_ENGINES_LOCK = threading.Lock()
+_SCOPED = threading.local()
+
+
+def get_database_url(database):
+    """
+    Gets the SQLalchemy url for a database, opening the Locations database read only
+    :param database: string, 'waypoints' or 'altitudes'
+    :return: string
+    """
+    path = DATABASE_PATHS[database]
+    if database in READ_ONLY_DATABASES:
+        return f'sqlite:///file:{path}?mode=ro&uri=true'
+    return f'sqlite:///{path}'
+
+
+def set_sqlite_pragmas(database):
+    """
+    Gets a listener to set the read-optimised pragmas on each new sqlite connection: a memory
+    mapped file and larger page cache for both databases, and write-ahead logging for the
+    Routes database so page loads can read while a route is being stored
+    :param database: string, 'waypoints' or 'altitudes'
+    :return: function
+    """
+    def on_connect(dbapi_connection, _):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f'pragma mmap_size={Config.SQLITE_MMAP_SIZE}')
+        cursor.execute(f'pragma cache_size={Config.SQLITE_CACHE_SIZE}')
+        cursor.execute('pragma temp_store=memory')
+        if database not in READ_ONLY_DATABASES:
+            cursor.execute('pragma journal_mode=wal')
+            cursor.execute('pragma synchronous=normal')
+        cursor.close()
+    return on_connect
+
+
+def get_engine(database):
+    """
+    Gets the pooled engine for a database, creating it on first use in this process
+    :param database: string, 'waypoints' or 'altitudes'
+    :return: SQLalchemy Engine object
+    """
+    with _ENGINES_LOCK:
+        engine, pid = _ENGINES.get(database, (None, None))
+        if engine is None or pid != os.getpid():
+            engine = db.create_engine(get_database_url(database), poolclass=QueuePool,
+                                      pool_size=Config.DATABASE_POOL_SIZE, max_overflow=10,
+                                      connect_args={'check_same_thread': False})
+            db.event.listen(engine, 'connect', set_sqlite_pragmas(database))
+            _ENGINES[database] = (engine, os.getpid())
+    return engine
+
+
+def get_connection(database):
+    """
+    Gets a connection to a database, reusing the one already checked out by this thread until
+    close_scoped_connections is called (at the end of each request in the application)
+    :param database: string, 'waypoints' or 'altitudes'
+    :return: SQLalchemy Connection object
+    """
+    if getattr(_SCOPED, 'pid', None) != os.getpid():
+        _SCOPED.connections = {}
+        _SCOPED.pid = os.getpid()
+    connection = _SCOPED.connections.get(database)
+    if connection is None or connection.closed:
+        connection = get_engine(database).connect()
+        _SCOPED.connections[database] = connection
+    return connection
+
+
+def close_scoped_connections():
+    """
+    Returns the connections checked out by this thread to their pools
+    """
+    if getattr(_SCOPED, 'pid', None) != os.getpid():
+        return
+    connections = _SCOPED.connections
+    _SCOPED.connections = {}
+    for connection in connections.values():
+        connection.close()
+
+
+def configure_database(database, path):
+    """
+    Points a database at a different file, e.g. a temporary database for testing, disposing of
+    any engine already open on the old file
+    :param database: string, 'waypoints' or 'altitudes'
+    :param path: string or Path object
+    """
+    close_scoped_connections()
+    with _ENGINES_LOCK:
+        engine, _ = _ENGINES.pop(database, (None, None))
+        DATABASE_PATHS[database] = str(path)
+    if engine is not None:
+        engine.dispose()
@@ -0,0 +1,187 @@
+"""
+Frozen copies of the scoring and ingest functions the equivalence harness (see
+reference_equivalence) compares engines against, as they were at scoring version
+FROZEN_SCORING_VERSION, for altitude data in latitude and longitude. The live functions are
+checked against these too, so a change to the live code that changes its answers is caught rather
+than silently becoming the new reference. Only change these deliberately, alongside
+calculate_scary_points.SCORING_VERSION
+"""
+
+from statistics import mean
+import numpy as np
+import altitude_schema
+from OSGridConverter import grid2latlong
+from sqlalchemy.exc import IntegrityError
+
+FROZEN_SCORING_VERSION = '2'
+
+
+def get_neighbouring_points(point, route_altitude_df, no_points):
+    """
+    Gets the closest points in a Dataframe of locations to the point passed, ties broken by their
+    coordinates
+    :param point: point to find neighbours of, pd.Series
+    :param route_altitude_df: pandas Dataframe
+    :param no_points: int (number of neighbours required)
+    :return: pandas Dataframe
+    """
+    from scipy.spatial.distance import cdist  # pylint: disable=import-outside-toplevel
+    point_arr = np.reshape(point[['lat', 'long']].to_numpy(), (-1, 2))
+    route_altitude_arr = route_altitude_df[['latitude', 'longitude']].to_numpy()
+    distances = cdist(route_altitude_arr, point_arr)[:, 0]
+    cutoff = np.partition(distances, no_points - 1)[no_points - 1]
+    candidates = np.flatnonzero(distances <= cutoff)
+    order = np.lexsort((route_altitude_arr[candidates, 1], route_altitude_arr[candidates, 0],
+                        distances[candidates]))
+    return route_altitude_df.iloc[candidates[order[:no_points]]]
+
+
+def get_angle_between_two_points(point1_x, point1_y, point2_x, point2_y):
+    """
+    Gets the angle of orientation between point 1 (x1, y1) and point 2 (x2, y2)
+    :param point1_x: float
+    :param point1_y: float
+    :param point2_x: float
+    :param point2_y: float
+    :return: float
+    """
+    vector1 = [point2_x-point1_x, point2_y-point1_y]
+    vector2 = [1, 0]
+    unit_vector1 = vector1 / np.linalg.norm(vector1)
+    unit_vector2 = vector2 / np.linalg.norm(vector2)
+    dot_product = np.dot(unit_vector1, unit_vector2)
+    angle = np.arccos(np.clip(dot_product, -1.0, 1.0)) / np.pi * 180
+    if point2_y < point1_y:
+        angle = 360 - angle
+    return angle
+
+
+def get_sectors(point, neighbours):
+    """
+    For each neighbour in the neighbours dataframe, assigns it to a sector around the main point,
+    each sector comprising 45 degrees
+    :param point: pandas Series
+    :param neighbours: pandas Dataframe
+    :return: dict of lists
+    """
+    sectors = {'ene': [], 'nne': [], 'nnw': [], 'wnw': [],
+               'wsw': [], 'ssw': [], 'sse': [], 'ese': []}
+    for _, row in neighbours.iterrows():
+        angle = get_angle_between_two_points(point['long'], point['lat'], row['longitude'],
+                                             row['latitude'])
+        sectors[list(sectors)[min(int(angle // 45), 7)]].append(row['altitude'])
+    return sectors
+
+
+def calculate_scariness(point, route_altitude_df):
+    """
+    For a given point, calculates how scary that point is out of 16
+    :param point: pandas Series
+    :param route_altitude_df: Pandas Dataframe
+    :return: int, max 16
+    """
+    neighbours = get_neighbouring_points(point, route_altitude_df, 64)
+    midpoint = neighbours['altitude'].head(4).mean()
+    scariness = 0
+    for listy in [x for x in get_sectors(point, neighbours).values() if len(x) > 0]:
+        if abs(mean(listy) - midpoint) > 10:
+            scariness += 1
+    return scariness
+
+
+def normalise_points(route, altitude_df):
+    """
+    Ensures location of highest point of route is matched to point of same altitude in altitude
+    dataframe, and then subtracts difference from each point in Route
+    :param route: pandas dataframe from .gpx file
+    :param altitude_df: pandas dataframe with latitude, longitude, altitude for all surrounding
+    locations
+    :return: pandas dataframe
+    """
+    max_route_height = route['elevation'].max()
+    max_route_point = route.loc[route['elevation'] == max_route_height]
+    equivalent_heights_from_alt = altitude_df.loc[
+        (altitude_df['altitude'] >= (max_route_height - 20))
+        & (altitude_df['altitude'] <= (max_route_height + 20))]
+    equivalent_alt_point = get_neighbouring_points(max_route_point, equivalent_heights_from_alt,
+                                                   1)
+    lat_diff = equivalent_alt_point.iloc[0]['latitude'] - max_route_point['lat']
+    lon_diff = equivalent_alt_point.iloc[0]['longitude'] - max_route_point['long']
+    route['lat'] = route['lat'] + lat_diff.iloc[0]
+    route['long'] = route['long'] + lon_diff.iloc[0]
+    return route
+
+
+def get_neighbouring_cell_average(altitude_df, cell_x, cell_y):
+    """
+    For a given cell in the dataframe, gets the average value of all neighbouring cells
+    :param altitude_df: DataFrame matrix with x as the column names,
+                        y as the index and altitude as the values
+    :param cell_x: x value of the cell
+    :param cell_y: y value of the cell
+    :return: float
+    """
+    y_values = altitude_df.index.tolist()
+    x_values = list(altitude_df)
+    y_step = y_values[1] - y_values[0]
+    x_step = x_values[1] - x_values[0]
+    neighbour_values = []
+    for x_offset, y_offset in [(-1, 1), (0, 1), (1, 1), (-1, 0), (1, 0), (-1, -1), (0, -1),
+                               (1, -1)]:
+        try:
+            value = altitude_df[cell_x + x_offset * x_step][cell_y + y_offset * y_step]
+        except KeyError:
+            continue
+        if not np.isnan(value):
+            neighbour_values.append(value)
+    return sum(neighbour_values) / len(neighbour_values)
+
+
+def double_pad_altitude_df(altitude_df):
+    """
+    Pads the altitude dataframe twice, to increase the resolution twofold, each new cell the
+    average of the cells around it that have values
+    :param altitude_df: DataFrame matrix with x as the column names,
+                        y as the index and altitude as the values
+    :return: DataFrame matrix with x as the column names,
+             y as the index and altitude as the values, but much bigger
+    """
+    for _ in range(2):
+        old_rows = altitude_df.index.tolist()
+        altitude_df = altitude_df.reindex(
+            old_rows + [(x + y) / 2 for x, y in zip(old_rows, old_rows[1:])]).sort_index()
+        old_columns = list(altitude_df)
+        altitude_df[[(x + y) / 2 for x, y in zip(old_columns, old_columns[1:])]] = np.nan
+        altitude_df.sort_index(axis=1, inplace=True)
+        for x_coord in list(altitude_df):
+            for y_coord in altitude_df.index.tolist():
+                if np.isnan(altitude_df[x_coord][y_coord]):
+                    altitude_df[x_coord][y_coord] = get_neighbouring_cell_average(
+                        altitude_df, x_coord, y_coord)
+    return altitude_df
+
+
+def insert_coords_into_db_table(altitude_df, grid_ref_initials, connection, table):
+    """
+    Works out the latitude and longitude of each point in the dataframe from its x and y
+    coordinates, one point at a time, and puts them into the database table
+    :param altitude_df: DataFrame matrix with x as the column names,
+                        y as the index and altitude as the values
+    :param grid_ref_initials: string (two letters denoting the grid reference area)
+    :param connection: sqlite database connection
+    :param table: sqlalchemy table object
+    """
+    rows = []
+    for x_coord in list(altitude_df):
+        for y_coord in altitude_df.index.tolist():
+            x_coordy = str(x_coord).split('.', maxsplit=1)[0]
+            y_coordy = str(y_coord).split('.', maxsplit=1)[0]
+            loc_ll = grid2latlong(f'{grid_ref_initials} {x_coordy[1:]} {y_coordy[1:]}',
+                                  tag='OSGB36')
+            rows.append({'latitude': loc_ll.latitude, 'longitude': loc_ll.longitude,
+                         'altitude': altitude_df[x_coord][y_coord]})
+    try:
+        with connection.begin():
+            connection.execute(table.insert(), altitude_schema.encode_location_rows(rows, table))
+    except IntegrityError:
+        print("Entry already in table")
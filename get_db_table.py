@@ -1,8 +1,16 @@
 """
-Single function to get a set of database table names needed to cover the Locations encompassed by
-a given route, whose max long and min long are passed.
+Functions to get a set of database table names needed to cover the Locations encompassed by
+a given route, whose max long and min long (or max and min easting) are passed.
 """
 
+# Width of the band of eastings, in metres, in each table of Locations in OS grid coordinates
+GRID_TABLE_WIDTH = 5000
+# Bands of longitude, in degrees, of the tables of Locations in latitude and longitude made by
+# the queries from get_set_db_tables, locations1 being the furthest west
+MIN_TABLE_LONGITUDE = -7.10
+LONGITUDE_TABLE_WIDTH = 0.05
+LONGITUDE_TABLES = 83
+
 
 def get_tables(max_long, min_long):
     """
@@ -184,3 +192,23 @@ def get_tables(max_long, min_long):
         else:
             pass
     return tables
+
+
+def get_grid_table(easting):
+    """
+    Gets the table holding the Locations in OS grid coordinates at an easting
+    :param easting: float, metres
+    :return: string
+    """
+    return f'locations_grid{int(easting // GRID_TABLE_WIDTH)}'
+
+
+def get_grid_tables(max_easting, min_easting):
+    """
+    Gets the tables of Locations in OS grid coordinates covering a range of eastings
+    :param max_easting: float, metres
+    :param min_easting: float, metres
+    :return: set of strings
+    """
+    return {f'locations_grid{x}' for x in range(int(min_easting // GRID_TABLE_WIDTH),
+                                                 int(max_easting // GRID_TABLE_WIDTH) + 1)}
@@ -3,36 +3,112 @@ Functions to gather data for, configure and return the html representation of a
 with scarier points highlighted, for plugging into a flask application
 """
 
-from pathlib import Path
-import folium
 from flask import abort
 import calculate_scary_points as csp
 import read_gpx
+import two_pass_scoring
 import administer_route_database
-from calculate_scary_points import timer
+import route_map_cache
+import memory_accounting
+from instrumentation import span, timer
+from memory_accounting import track_memory
+
+FEAR_LEVEL_THRESHOLDS = {1: 6, 2: 5, 3: 4}
 
 
 @timer
-def get_route_with_scariness_from_file(route_file_path):
+def get_route_with_scariness_from_file(route_file_path, simplify=False, progress=None,
+                                       on_segment=None, two_pass_threshold=None, filename=None):
     """
-    Processes a gpx route file to assign scariness score to each waypoint
-    :param route_file_path: string
+    Processes a gpx route file to assign scariness score to each waypoint. If a route with the
+    same points has already been scored by the current scoring version, whatever its file was
+    called, the stored route is returned instead. If the altitude data around the route is more
+    than SEGMENT_ROWS rows, or wouldn't fit in the memory budget, the route is scored in
+    overlapping segments, without two pass scoring (see
+    calculate_scary_points.calculate_windowed_route_scariness). Two pass scores are only
+    accurate near their threshold, so they are returned without being stored in the routes
+    catalog, and keep their refined column to tell the provisional scores from the refined ones.
+    A route already scored exactly is returned instead of being scored in two passes
+    :param route_file_path: string, or the contents of the gpx file (see read_gpx.read_gpx)
+    :param simplify: boolean, simplify the route before scoring (see simplify_route)
+    :param progress: function called with the name of each stage (see scoring_jobs) as it starts
+    :param on_segment: function called with the route, the index of the first point in the
+                       segment and the segment's scores as each segment of the route is scored
+                       (see calculate_scary_points.score_route_segments)
+    :param two_pass_threshold: int, score the route in two passes (see two_pass_scoring),
+                               refining the scores near this scariness threshold
+    :param filename: string, name of the gpx file the route is named after, if route_file_path
+                     is the contents of the file rather than its path
     :return: pandas Dataframe
     """
+    progress = progress or (lambda stage: None)
+    progress('read')
     route = read_gpx.read_gpx(route_file_path)
+    connection = administer_route_database.get_route_db_connection()
+    content_hash = administer_route_database.get_route_content_hash(route)
+    scoring_version = csp.get_scoring_version(simplify)
+    stored_route_name = administer_route_database.get_stored_route_name(
+        connection, content_hash, scoring_version)
+    if stored_route_name:
+        return get_route_with_scariness_from_db(stored_route_name)
     route = read_gpx.pad_gpx_dataframe(route)
-    route_bounds = read_gpx.get_route_bounds(route)
+    route_bounds = csp.get_route_bounds(route)
     if not csp.check_route_bounds_fit_location_data(route_bounds):
         abort(400)
-    altitudes_df = csp.get_complete_route_altitude_df(route_bounds)
-    route = csp.calculate_route_scariness(route, altitudes_df)
-    administer_route_database.insert_route_into_db_table(
-        administer_route_database.prepare_route_for_insertion(route, route_file_path),
-        administer_route_database.get_route_db_connection(), 'waypoints'
-    )
+    progress('fetch')
+    corridor = csp.get_fetch_corridor(route)
+    # Each segment scored at once needs its own altitude data within the budget
+    workers = max(1, csp.SEGMENT_SETTINGS['workers'])
+    max_rows = memory_accounting.get_affordable_rows(memory_accounting.FETCH_ROW_BYTES * workers)
+    segment_rows = csp.SEGMENT_SETTINGS['rows'] or None
+    limits = [x for x in [max_rows, segment_rows] if x is not None]
+    window_rows = csp.count_route_altitude_rows(route_bounds, corridor) if limits else None
+    if window_rows is not None and window_rows > min(limits):
+        # Too much altitude data to hold at once, so score the route in segments
+        progress('score')
+        with track_memory('score'):
+            route = csp.calculate_windowed_route_scariness(route, max_rows, on_segment,
+                                                           window_rows, simplify, workers,
+                                                           segment_rows)
+        two_pass_threshold = None
+    else:
+        with track_memory('fetch'):
+            altitudes_df = csp.get_complete_route_altitude_df(route_bounds, corridor)
+        progress('score')
+        with track_memory('score'):
+            route = score_route(route, altitudes_df, simplify, on_segment, two_pass_threshold)
+    progress('store')
+    route = administer_route_database.prepare_route_for_insertion(
+        route, filename or route_file_path)
+    route['route'] = administer_route_database.get_unique_route_name(
+        connection, route['route'].iloc[0], content_hash)
+    if two_pass_threshold is None:
+        administer_route_database.store_route(route, connection, content_hash, scoring_version)
     return route
 
 
+def score_route(route, altitudes_df, simplify=False, on_segment=None, two_pass_threshold=None):
+    """
+    Scores a route against the altitude data around it, as set by the options of
+    get_route_with_scariness_from_file
+    :param route: pandas Dataframe from .gpx file, padded
+    :param altitudes_df: pandas Dataframe containing Location data (latitude, longitude,
+                         altitude) surrounding the Route
+    :param simplify: boolean, simplify the route before scoring (see simplify_route)
+    :param on_segment: function called as each segment of the route is scored
+    :param two_pass_threshold: int, score the route in two passes (see two_pass_scoring)
+    :return: pandas Dataframe, with a refined column if scored in two passes, False for the points
+             whose scores are provisional
+    """
+    if two_pass_threshold is not None:
+        return two_pass_scoring.calculate_route_scariness_two_pass(
+            route, altitudes_df, two_pass_threshold, on_segment)
+    if on_segment is None:
+        return csp.calculate_route_scariness(route, altitudes_df, simplify=simplify)
+    return csp.calculate_route_scariness_by_segment(route, altitudes_df, on_segment,
+                                                    simplify=simplify)
+
+
 @timer
 def get_route_with_scariness_from_db(route_name):
     """
@@ -45,20 +121,20 @@ def get_route_with_scariness_from_db(route_name):
     return route
 
 
-def check_route_not_loaded(route_file):
+def get_route_map_cache_key(route_name, scariness_level, render_mode='markers'):
     """
-    Checks that a route matching the route file name is not already in the Routes database
-    :param route_file: string
-    :return: boolean
+    Gets the key the rendered map of a stored route is cached under
+    :param route_name: string
+    :param scariness_level: int, minimum scariness rating flagged
+    :param render_mode: string, 'markers' or 'layer'
+    :return: tuple, or None if the route is not in the routes catalog
     """
-    loaded_routes = administer_route_database.get_loaded_routes(
-        administer_route_database.get_route_db_connection()
-    )
-    route_file_route_name = Path(route_file).name.replace('.gpx', '')
-    for group in loaded_routes:
-        if route_file_route_name in group:
-            return True
-    return False
+    entry = administer_route_database.get_route_catalog_entry(
+        administer_route_database.get_route_db_connection(), route_name)
+    if entry is None:
+        return None
+    return route_map_cache.get_cache_key(entry['route_id'], entry['content_hash'],
+                                         scariness_level, entry['scoring_version'], render_mode)
 
 
 def translate_fear_level(fear_level):
@@ -68,39 +144,20 @@ def translate_fear_level(fear_level):
     :param fear_level: int
     :return: int
     """
-    if fear_level == 1:
-        scariness_threshold = 6
-    elif fear_level == 2:
-        scariness_threshold = 5
-    else:
-        scariness_threshold = 4
-    return scariness_threshold
+    return FEAR_LEVEL_THRESHOLDS.get(fear_level, FEAR_LEVEL_THRESHOLDS[3])
 
 
-@timer
-def get_folium_route_map(scariness_level, route_file=None, route_choice=None):
+def add_route_markers(mappy, route, scariness_level):
     """
-    Creates a folium route map html representation for easy implementation into Flask for a route
-    requested in the application
+    Adds a folium marker to the map for each waypoint in the route, red for the waypoints
+    scarier than the scariness level, with the scores that are only provisional marked as such
+    :param mappy: folium Map object
+    :param route: pandas Dataframe, with a refined column if scored in two passes
     :param scariness_level: int
-    :param route_file: string
-    :param route_choice: string
-    :return: folium map html representation
     """
-    scariness_level = translate_fear_level(scariness_level)
-    if route_file and not check_route_not_loaded(route_file):
-        route = get_route_with_scariness_from_file(route_file)
-    elif route_file:
-        route_choice = Path(route_file).name.replace('.gpx', '')
-        route = get_route_with_scariness_from_db(route_choice)
-    else:
-        route = get_route_with_scariness_from_db(route_choice)
-    first_point = (route['lat'].mean(), route['long'].mean())
-    mappy = folium.Map(location=first_point,
-                       tiles='http://tile.mtbmap.cz/mtbmap_tiles/{z}/{x}/{y}.png', zoom_start=13,
-                       attr='&copy; <a href="https://www.openstreetmap.org/copyright">'
-                            'OpenStreetMap</a> contributors &amp; USGS')
+    import folium  # pylint: disable=import-outside-toplevel
     for _, row in route.iterrows():
+        provisional = ' (provisional)' if not row.get('refined', True) else ''
         if row['scariness'] > scariness_level:
             colour = 'red'
         else:
@@ -109,13 +166,79 @@ def get_folium_route_map(scariness_level, route_file=None, route_choice=None):
             folium.Marker(
                 [row['lat'], row['long']],
                 popup=f"<i>{row['waypoint']}, Latitude: {row['lat']},\n Longitude: {row['long']},\n"
-                      f"Altitude: {row['elevation']},\n Scariness: {row['scariness']}/16\n</i>",
+                      f"Altitude: {row['elevation']},\n "
+                      f"Scariness: {row['scariness']}/16{provisional}\n</i>",
                 icon=folium.Icon(color=colour),
                 tooltip="Click me").add_to(mappy)
         if colour == 'blue':
             folium.CircleMarker(
                 [row['lat'], row['long']],
                 popup=f"<i>{row['waypoint']}, {row['lat']}, {row['long']}, {row['elevation']}, "
-                      f"{row['scariness']}</i>",
+                      f"{row['scariness']}{provisional}</i>",
                 tooltip="Click me", radius=3).add_to(mappy)
-    return mappy._repr_html_()
+
+
+def render_route_map(route, scariness_level, render_mode='markers'):
+    """
+    Draws a scored route on a folium map
+    :param route: pandas Dataframe, with columns lat, long and scariness, and refined if scored
+                  in two passes
+    :param scariness_level: int, points scarier than this are highlighted
+    :param render_mode: string, 'markers' for a folium marker per waypoint, or 'layer' for the
+                        whole route as a single RouteLayer
+    :return: string, html document of the map, embedded directly in the srcdoc of the page's map
+             frame so the page can post the map a new fear level
+    """
+    # folium is only imported once a map has to be drawn, as it is slow to import
+    import folium  # pylint: disable=import-outside-toplevel
+    from route_map_layers import RouteLayer  # pylint: disable=import-outside-toplevel
+    with span('render', render_mode=render_mode, points=len(route)):
+        first_point = (route['lat'].mean(), route['long'].mean())
+        mappy = folium.Map(location=first_point,
+                           tiles='http://tile.mtbmap.cz/mtbmap_tiles/{z}/{x}/{y}.png',
+                           zoom_start=13,
+                           attr='&copy; <a href="https://www.openstreetmap.org/copyright">'
+                                'OpenStreetMap</a> contributors &amp; USGS')
+        if render_mode == 'layer':
+            RouteLayer(route, scariness_level, FEAR_LEVEL_THRESHOLDS).add_to(mappy)
+        else:
+            add_route_markers(mappy, route, scariness_level)
+        # _repr_html_ would wrap the map in an iframe of its own, a frame too deep for messages
+        # from the page to reach the RouteLayer
+        route_map = mappy.get_root().render()
+    return route_map
+
+
+@timer
+def get_folium_route_map(scariness_level, route_file=None, route_choice=None, simplify=False,
+                         render_mode='markers', route=None):
+    """
+    Creates a folium route map html representation for easy implementation into Flask for a route
+    requested in the application
+    :param scariness_level: int
+    :param route_file: string
+    :param route_choice: string
+    :param simplify: boolean, simplify an uploaded route before scoring it
+    :param render_mode: string, 'markers' for a folium marker per waypoint, or 'layer' for the
+                        whole route as a single RouteLayer
+    :param route: pandas Dataframe, a scored route that isn't stored in the routes catalog, such
+                  as a route scored in two passes, drawn without caching the map
+    :return: folium map html representation
+    """
+    scariness_level = translate_fear_level(scariness_level)
+    if route is not None:
+        return render_route_map(route, scariness_level, render_mode)
+    if route_file:
+        route = get_route_with_scariness_from_file(route_file, simplify=simplify)
+        route_choice = route['route'].iloc[0]
+    cache_key = get_route_map_cache_key(route_choice, scariness_level, render_mode)
+    if cache_key is not None:
+        route_map = route_map_cache.get_cached_map(cache_key)
+        if route_map is not None:
+            return route_map
+    if route is None:
+        route = get_route_with_scariness_from_db(route_choice)
+    route_map = render_route_map(route, scariness_level, render_mode)
+    if cache_key is not None:
+        route_map_cache.cache_map(cache_key, route_map)
+    return route_map
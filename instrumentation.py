@@ -0,0 +1,244 @@
+"""
+Hierarchical timing instrumentation. Each request, background job or ingested tile is a top level
+span, with a nested span for each stage inside it (fetch, normalise, neighbour search, sector
+scoring, render...). Every span is timed into a latency histogram for its stage, exported in the
+Prometheus text format, and each finished top level span can be logged as a line of json. When
+disabled, spans do nothing beyond checking a flag
+"""
+
+import contextvars
+import json
+import sys
+import threading
+from bisect import bisect_left
+from functools import wraps
+from time import perf_counter
+from config import Config
+
+HISTOGRAM_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60)
+METRIC_NAME = 'mountain_fear_finder_stage_seconds'
+SETTINGS = {'enabled': Config.INSTRUMENTATION, 'log_file': Config.TIMING_LOG}
+
+_CURRENT_SPAN = contextvars.ContextVar('current_span', default=None)
+_HISTOGRAMS = {}
+_HISTOGRAMS_LOCK = threading.Lock()
+_LOG_LOCK = threading.Lock()
+
+
+class Span:
+    """
+    A timed stage, nested in the span that was current when it started. Spans with the same name
+    in the same parent, e.g. the neighbour search for each point of a route, are merged into one
+    child with a count, so the tree stays the size of the pipeline rather than of the data
+    """
+    def __init__(self, name, attributes, logged=False):
+        """
+        :param name: string, name of the stage, used as the histogram label
+        :param attributes: dict, extra details reported with the span, e.g. the route
+        :param logged: boolean, write the span to the timing log when it finishes, if it isn't
+                       nested in another span
+        """
+        self.name = name
+        self.attributes = attributes
+        self.logged = logged
+        self.seconds = 0.0
+        self.count = 0
+        self.children = {}
+        self.parent = None
+        self.start = None
+        self.token = None
+
+    def set(self, **attributes):
+        """
+        Adds details to report with the span, e.g. the number of rows fetched
+        :param attributes: extra details
+        """
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        self.parent = _CURRENT_SPAN.get()
+        self.token = _CURRENT_SPAN.set(self)
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *_):
+        elapsed = perf_counter() - self.start
+        try:
+            _CURRENT_SPAN.reset(self.token)
+        except ValueError:
+            # Ended in a different context to the one it started in, e.g. by a request hook
+            _CURRENT_SPAN.set(self.parent)
+        self.seconds += elapsed
+        self.count += 1
+        observe(self.name, elapsed)
+        if self.parent is not None:
+            merge_span(self.parent, self)
+        elif self.logged and SETTINGS['log_file']:
+            write_span_log(self)
+        return False
+
+    def to_dict(self):
+        """
+        Gets the span and the spans nested in it for logging
+        :return: dict
+        """
+        return {'name': self.name, 'seconds': round(self.seconds, 6), 'count': self.count,
+                **self.attributes, 'children': [x.to_dict() for x in self.children.values()]}
+
+
+class NoSpan:
+    """
+    Stands in for a span when instrumentation is disabled
+    """
+    def set(self, **attributes):
+        """
+        Ignores details to report with the span
+        :param attributes: extra details
+        """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        return False
+
+
+NO_SPAN = NoSpan()
+
+
+def span(name, **attributes):
+    """
+    Gets a span to time a stage with, as a context manager
+    :param name: string, name of the stage
+    :param attributes: extra details reported with the span
+    :return: Span, or NO_SPAN if instrumentation is disabled
+    """
+    if not SETTINGS['enabled']:
+        return NO_SPAN
+    return Span(name, attributes)
+
+
+def trace(name, **attributes):
+    """
+    Gets a span for a whole unit of work, such as a request, a scoring job or an ingested tile,
+    which is written to the timing log when it finishes. Stage spans that aren't nested in one,
+    e.g. those timed in worker processes, only go into the histograms
+    :param name: string, name of the unit of work
+    :param attributes: extra details reported with the span
+    :return: Span, or NO_SPAN if instrumentation is disabled
+    """
+    if not SETTINGS['enabled']:
+        return NO_SPAN
+    return Span(name, attributes, logged=True)
+
+
+def start_trace(name, **attributes):
+    """
+    Starts a trace that can't be used as a context manager, e.g. one opened and closed by separate
+    request hooks
+    :param name: string, name of the unit of work
+    :param attributes: extra details reported with the span
+    :return: Span, or NO_SPAN if instrumentation is disabled
+    """
+    return trace(name, **attributes).__enter__()
+
+
+def end_span(started_span):
+    """
+    Ends a span started by start_trace
+    :param started_span: Span, or NO_SPAN
+    """
+    if started_span is not None:
+        started_span.__exit__(None, None, None)
+
+
+def timer(func):
+    """
+    Decorator function to time the execution of a function as a span named after the function
+    :param func: function
+    :return: function
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not SETTINGS['enabled']:
+            return func(*args, **kwargs)
+        with Span(func.__name__, {}):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def merge_span(parent, child):
+    """
+    Merges a finished span into its parent's children, adding it to any child of the same name
+    :param parent: Span
+    :param child: Span
+    """
+    existing = parent.children.get(child.name)
+    if existing is None:
+        parent.children[child.name] = child
+        return
+    if existing is child:
+        return
+    existing.seconds += child.seconds
+    existing.count += child.count
+    for grandchild in child.children.values():
+        merge_span(existing, grandchild)
+
+
+def observe(name, seconds):
+    """
+    Adds a stage timing to the stage's latency histogram
+    :param name: string, name of the stage
+    :param seconds: float
+    """
+    with _HISTOGRAMS_LOCK:
+        histogram = _HISTOGRAMS.get(name)
+        if histogram is None:
+            histogram = _HISTOGRAMS[name] = {'buckets': [0] * (len(HISTOGRAM_BUCKETS) + 1),
+                                             'sum': 0.0, 'count': 0}
+        histogram['buckets'][bisect_left(HISTOGRAM_BUCKETS, seconds)] += 1
+        histogram['sum'] += seconds
+        histogram['count'] += 1
+
+
+def get_prometheus_metrics():
+    """
+    Gets the stage latency histograms in the Prometheus text exposition format
+    :return: string
+    """
+    lines = [f'# HELP {METRIC_NAME} Time spent in each stage of the pipeline',
+             f'# TYPE {METRIC_NAME} histogram']
+    with _HISTOGRAMS_LOCK:
+        histograms = {x: dict(y, buckets=list(y['buckets'])) for x, y in _HISTOGRAMS.items()}
+    for name, histogram in sorted(histograms.items()):
+        label = name.replace('\\', '\\\\').replace('"', '\\"')
+        cumulative = 0
+        for bound, count in zip(list(HISTOGRAM_BUCKETS) + ['+Inf'], histogram['buckets']):
+            cumulative += count
+            lines.append(f'{METRIC_NAME}_bucket{{stage="{label}",le="{bound}"}} {cumulative}')
+        lines.append(f'{METRIC_NAME}_sum{{stage="{label}"}} {histogram["sum"]:.6f}')
+        lines.append(f'{METRIC_NAME}_count{{stage="{label}"}} {histogram["count"]}')
+    return '\n'.join(lines) + '\n'
+
+
+def write_span_log(finished_span):
+    """
+    Writes a finished top level span, with the spans nested in it, as a line of json to the
+    timing log ('-' for stderr)
+    :param finished_span: Span
+    """
+    line = json.dumps(finished_span.to_dict(), default=str) + '\n'
+    with _LOG_LOCK:
+        if SETTINGS['log_file'] == '-':
+            sys.stderr.write(line)
+        else:
+            with open(SETTINGS['log_file'], 'a') as log_file:
+                log_file.write(line)
+
+
+def reset_metrics():
+    """
+    Empties the stage latency histograms
+    """
+    with _HISTOGRAMS_LOCK:
+        _HISTOGRAMS.clear()
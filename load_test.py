@@ -0,0 +1,388 @@
+"""
+HTTP load test of the mountain fear finder application on one machine. A stand in dataset is
+generated (a tile of synthetic terrain in an altitude database, see benchmark_pipeline, and a set
+of scored routes in a waypoints database), the application is started on it with flask run in a
+separate process, and a mix of requests is sent at a target rate by a pool of clients: views of
+stored routes, changes of fear level on stored routes and gpx uploads (timed until the uploaded
+route is scored). Latency percentiles and error rates are reported per request type as json.
+Requests are sent on a fixed schedule, and their latency is timed from when they were due, so a
+server that can't keep up shows as growing latency rather than a lower request rate
+"""
+
+import argparse
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import CookieJar
+from pathlib import Path
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+from urllib.request import HTTPCookieProcessor, Request, build_opener
+import numpy as np
+import pandas as pd
+import altitude_schema
+import benchmark_pipeline
+import read_contour_data as contour
+
+REQUEST_TYPES = ['view', 'fear_level', 'upload']
+DEFAULT_MIX = 'view=70,fear_level=25,upload=5'
+# Fear level stored routes are viewed at, and the levels the fear level changes choose from
+VIEW_FEAR_LEVEL = 2
+FEAR_LEVELS = [1, 2, 3]
+PERCENTILES = [50, 90, 95, 99]
+CSRF_TOKEN_PATTERN = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+JOB_POLL_SECONDS = 0.1
+REQUEST_TIMEOUT = 120
+
+
+def parse_mix(mix):
+    """
+    Parses the mix of request types
+    :param mix: string, type=weight,..., e.g. view=70,fear_level=25,upload=5
+    :return: dict, request type: fraction of requests
+    """
+    weights = {x: float(y) for x, y in (part.split('=') for part in mix.split(','))}
+    unknown = set(weights) - set(REQUEST_TYPES)
+    if unknown or not sum(weights.values()) > 0:
+        raise ValueError(f'Mix must weight some of {REQUEST_TYPES}, not {mix}')
+    return {x: y / sum(weights.values()) for x, y in weights.items() if y > 0}
+
+
+def make_dataset(directory, tile_cells=60, stored_routes=5, route_points=100, seed=0):
+    """
+    Generates the altitude database, the extremes of its locations, and gpx files of the routes
+    to store before the test
+    :param directory: pathlib Path
+    :param tile_cells: int, cells along each side of the synthetic tile
+    :param stored_routes: int
+    :param route_points: int, points in each route
+    :param seed: int, random seed for the terrain
+    :return: tuple, (terrain altitudes, see benchmark_pipeline.make_terrain, list of gpx files)
+    """
+    altitudes = benchmark_pipeline.make_terrain(tile_cells, seed)
+    asc_file = directory / f'{benchmark_pipeline.GRID_SQUARE}load.asc'
+    benchmark_pipeline.write_asc_tile(asc_file, altitudes)
+    rows = list(contour.get_coords_rows(
+        contour.double_pad_altitude_df(contour.read_contour_file(asc_file)),
+        benchmark_pipeline.GRID_SQUARE))
+    benchmark_pipeline.insert_rows(directory / 'altitudes.sqlite', rows)
+    rows_df = pd.DataFrame(rows)
+    extremes = {}
+    for name, column in zip(altitude_schema.get_route_columns(),
+                            altitude_schema.get_coordinates()):
+        extremes.update({f'max{name}': rows_df[column].max(), f'min{name}': rows_df[column].min()})
+    pd.DataFrame([extremes]).to_pickle(directory / 'locations_extremes.pkl')
+    route_files = []
+    for index in range(stored_routes):
+        route_file = directory / f'stored{index}.gpx'
+        route_file.write_bytes(benchmark_pipeline.make_route_gpx(
+            altitudes, route_points, 0.2 + 0.05 * index, 0.8 - 0.05 * index))
+        route_files.append(route_file)
+    return altitudes, route_files
+
+
+def get_free_port():
+    """
+    Gets a free local port for the application to listen on
+    :return: int
+    """
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(directory, port, environment=None, startup_timeout=120):
+    """
+    Starts the application on the dataset in a separate process, waiting until it is ready
+    :param directory: pathlib Path, holding the dataset
+    :param port: int
+    :param environment: dict, extra environment variables for the application, e.g. Config
+                        settings
+    :param startup_timeout: float, seconds
+    :return: subprocess.Popen
+    """
+    repository = str(Path(__file__).resolve().parent)
+    python_path = os.pathsep.join([repository] + [x for x in [os.environ.get('PYTHONPATH')] if x])
+    env = {**os.environ, 'PYTHONPATH': python_path,
+           'ALTITUDES_DATABASE': str(directory / 'altitudes.sqlite'),
+           'WAYPOINTS_DATABASE': str(directory / 'waypoints.sqlite'),
+           'LOCATIONS_EXTREMES_FILE': str(directory / 'locations_extremes.pkl'),
+           'MAP_CACHE_DIR': '', 'UPLOAD_ARCHIVE_DIR': '', **(environment or {})}
+    with open(directory / 'server.log', 'w') as log_file:
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'flask', '--app', 'mountain_fear_finder', 'run', '--host',
+             '127.0.0.1', '--port', str(port), '--no-reload', '--no-debugger'],
+            cwd=directory, env=env, stdout=subprocess.DEVNULL, stderr=log_file)
+    deadline = time.monotonic() + startup_timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Application exited on start up, see {directory / 'server.log'}")
+        try:
+            with build_opener().open(f'http://127.0.0.1:{port}/ready', timeout=5):
+                return server
+        except (HTTPError, URLError, ConnectionError):
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError(f'Application was not ready within {startup_timeout} seconds')
+
+
+class Client:
+    """
+    A user of the application, with its own session cookie and CSRF token
+    """
+    def __init__(self, base_url):
+        """
+        :param base_url: string, e.g. http://127.0.0.1:5000
+        """
+        self.base_url = base_url
+        self.opener = build_opener(HTTPCookieProcessor(CookieJar()))
+        self.csrf_token = None
+
+    def open(self, path, data=None, headers=None):
+        """
+        Sends a request, reading the whole response
+        :param path: string
+        :param data: bytes, body of a POST request
+        :param headers: dict
+        :return: tuple, (status code, final url, body as bytes)
+        """
+        request = Request(self.base_url + path, data=data, headers=headers or {})
+        try:
+            with self.opener.open(request, timeout=REQUEST_TIMEOUT) as response:
+                return response.status, response.url, response.read()
+        except HTTPError as error:
+            return error.code, error.url, error.read()
+
+    def get_csrf_token(self):
+        """
+        Loads the home page, as a browser would, for the session's CSRF token
+        :return: string
+        """
+        if self.csrf_token is None:
+            status, _, body = self.open('/')
+            match = CSRF_TOKEN_PATTERN.search(body.decode())
+            if status != 200 or match is None:
+                raise RuntimeError(f'No CSRF token in the home page, status {status}')
+            self.csrf_token = match.group(1)
+        return self.csrf_token
+
+    def post_form(self, route_choice, fear_level, gpx=None):
+        """
+        Posts the home page form, choosing a stored route or uploading a gpx file
+        :param route_choice: string, name of a stored route
+        :param fear_level: int
+        :param gpx: tuple, (file name, bytes), the file to upload
+        :return: tuple, see open
+        """
+        fields = {'csrf_token': self.get_csrf_token(), 'route_choice': route_choice,
+                  'fear_level': str(fear_level)}
+        if gpx is None:
+            return self.open('/', urlencode(fields).encode(),
+                             {'Content-Type': 'application/x-www-form-urlencoded'})
+        boundary = uuid.uuid4().hex
+        parts = [f'--{boundary}\r\nContent-Disposition: form-data; name="{x}"\r\n\r\n{y}\r\n'
+                 .encode() for x, y in fields.items()]
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="route_file"; '
+                     f'filename="{gpx[0]}"\r\nContent-Type: application/gpx+xml\r\n\r\n'
+                     .encode() + gpx[1] + f'\r\n--{boundary}--\r\n'.encode())
+        return self.open('/', b''.join(parts),
+                         {'Content-Type': f'multipart/form-data; boundary={boundary}'})
+
+    def upload(self, route_choice, fear_level, gpx, timeout=REQUEST_TIMEOUT):
+        """
+        Uploads a gpx file, then polls its scoring job until it is done
+        :param route_choice: string, name of a stored route, needed for the form to validate
+        :param fear_level: int
+        :param gpx: tuple, (file name, bytes)
+        :param timeout: float, seconds to wait for the job
+        :return: string, name the route is stored under
+        """
+        status, url, _ = self.post_form(route_choice, fear_level, gpx)
+        if status != 200 or '/jobs/' not in url:
+            raise RuntimeError(f'Upload was not accepted, status {status}')
+        job_id = url.rsplit('/', 1)[-1]
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            status, _, body = self.open(f'/api/jobs/{job_id}')
+            job = json.loads(body) if status == 200 else {'status': 'failed', 'error': status}
+            if job['status'] == 'done':
+                return job['route']
+            if job['status'] == 'failed':
+                raise RuntimeError(f"Scoring job failed: {job['error']}")
+            time.sleep(JOB_POLL_SECONDS)
+        raise RuntimeError(f'Scoring job not done within {timeout} seconds')
+
+
+def store_routes(base_url, route_files):
+    """
+    Uploads and scores the routes to view during the test
+    :param base_url: string
+    :param route_files: list of pathlib Paths
+    :return: list of strings, names the routes are stored under
+    """
+    client = Client(base_url)
+    # Every form posted has to choose a stored route, and before any are stored the only
+    # choice is 'None'
+    route_names = ['None']
+    for route_file in route_files:
+        route_names.append(client.upload(route_names[-1], VIEW_FEAR_LEVEL,
+                                         (route_file.name, route_file.read_bytes())))
+    return route_names[1:]
+
+
+def send_request(request_type, clients, route_names, altitudes, route_points, rng, rng_lock):
+    """
+    Sends one request of a type as the client for the current thread
+    :param request_type: string, one of REQUEST_TYPES
+    :param clients: threading.local, holding each thread's Client
+    :param route_names: list of strings, stored routes
+    :param altitudes: numpy array, terrain the stored routes cross
+    :param route_points: int, points in each uploaded route
+    :param rng: numpy random Generator, shared by the threads
+    :param rng_lock: threading.Lock, guarding rng
+    """
+    with rng_lock:
+        route_choice = route_names[rng.integers(len(route_names))]
+        fear_level = int(rng.choice(FEAR_LEVELS))
+        start, end = sorted(rng.uniform(0.15, 0.85, 2))
+    if request_type == 'upload':
+        gpx = benchmark_pipeline.make_route_gpx(altitudes, route_points, start, end)
+        clients.client.upload(route_choice, fear_level, (f'upload{uuid.uuid4().hex[:8]}.gpx',
+                                                         gpx))
+        return
+    status, _, body = clients.client.post_form(
+        route_choice, VIEW_FEAR_LEVEL if request_type == 'view' else fear_level)
+    if status != 200 or b'route-map' not in body:
+        raise RuntimeError(f'No route map in the response, status {status}')
+
+
+def get_latency_summary(latencies, errors, duration):
+    """
+    Summarises the requests of one type
+    :param latencies: list of floats, seconds, of the successful requests
+    :param errors: list of strings, one per failed request
+    :param duration: float, seconds the test ran for
+    :return: dict
+    """
+    requests = len(latencies) + len(errors)
+    summary = {'requests': requests, 'errors': len(errors),
+               'error_rate': round(len(errors) / requests, 4) if requests else 0.0,
+               'requests_per_second': round(requests / duration, 3) if duration else 0.0}
+    if latencies:
+        summary.update({f'p{x}_seconds': round(float(np.percentile(latencies, x)), 4)
+                        for x in PERCENTILES})
+        summary['max_seconds'] = round(max(latencies), 4)
+    if errors:
+        summary['error_examples'] = sorted(set(errors))[:5]
+    return summary
+
+
+def run_load(base_url, route_names, altitudes, mix, rate, duration, concurrency,
+             route_points=100, seed=0):
+    """
+    Sends requests of the mix of types at the target rate, from concurrency clients at most at
+    once, for duration seconds
+    :param base_url: string
+    :param route_names: list of strings, stored routes
+    :param altitudes: numpy array, terrain the stored routes cross
+    :param mix: dict, from parse_mix
+    :param rate: float, requests per second
+    :param duration: float, seconds
+    :param concurrency: int, clients sending requests at once
+    :param route_points: int, points in each uploaded route
+    :param seed: int, random seed for the request types and their routes
+    :return: dict, per request type summary (see get_latency_summary), and overall
+    """
+    rng = np.random.default_rng(seed)
+    rng_lock = threading.Lock()
+    clients = threading.local()
+    results = {x: {'latencies': [], 'errors': []} for x in mix}
+    results_lock = threading.Lock()
+
+    def make_client():
+        clients.client = Client(base_url)
+
+    def timed_request(request_type, due):
+        try:
+            send_request(request_type, clients, route_names, altitudes, route_points, rng,
+                         rng_lock)
+        except Exception as error:  # pylint: disable=broad-except
+            with results_lock:
+                results[request_type]['errors'].append(f'{type(error).__name__}: {error}')
+        else:
+            with results_lock:
+                results[request_type]['latencies'].append(time.perf_counter() - due)
+
+    request_count = int(rate * duration)
+    request_types = rng.choice(list(mix), size=request_count, p=list(mix.values()))
+    with ThreadPoolExecutor(max_workers=concurrency, initializer=make_client) as executor:
+        start = time.perf_counter()
+        for index, request_type in enumerate(request_types):
+            due = start + index / rate
+            time.sleep(max(0.0, due - time.perf_counter()))
+            executor.submit(timed_request, request_type, due)
+    elapsed = time.perf_counter() - start
+    report = {x: get_latency_summary(y['latencies'], y['errors'], elapsed)
+              for x, y in results.items()}
+    report['all'] = get_latency_summary(
+        [x for y in results.values() for x in y['latencies']],
+        [x for y in results.values() for x in y['errors']], elapsed)
+    return report
+
+
+def main(argv=None):
+    """
+    Generates the dataset, starts the application on it, runs the load test and prints the
+    report as json
+    :param argv: list of strings, defaults to the command line arguments
+    """
+    parser = argparse.ArgumentParser(
+        description='Load test the application on a generated dataset on this machine')
+    parser.add_argument('--rate', type=float, default=5, help='requests per second')
+    parser.add_argument('--duration', type=float, default=30, help='seconds')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='clients sending requests at once')
+    parser.add_argument('--mix', default=DEFAULT_MIX,
+                        help='weights of each request type, e.g. ' + DEFAULT_MIX)
+    parser.add_argument('--tile-cells', type=int, default=60,
+                        help='cells along each side of the generated asc tile')
+    parser.add_argument('--stored-routes', type=int, default=5)
+    parser.add_argument('--route-points', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--env', action='append', default=[],
+                        help='NAME=value setting for the application, e.g. SCORING_WORKERS=4')
+    parser.add_argument('--output', help='json file to write the report to, default stdout')
+    args = parser.parse_args(argv)
+    mix = parse_mix(args.mix)
+    with tempfile.TemporaryDirectory() as directory:
+        directory = Path(directory)
+        altitudes, route_files = make_dataset(directory, args.tile_cells, args.stored_routes,
+                                              args.route_points, args.seed)
+        port = get_free_port()
+        server = start_server(directory, port, dict(x.split('=', 1) for x in args.env))
+        try:
+            base_url = f'http://127.0.0.1:{port}'
+            route_names = store_routes(base_url, route_files)
+            results = run_load(base_url, route_names, altitudes, mix, args.rate, args.duration,
+                               args.concurrency, args.route_points, args.seed)
+        finally:
+            server.terminate()
+            server.wait()
+    report = {'parameters': {**vars(args), 'mix': mix}, 'results': results}
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
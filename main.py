@@ -31,7 +31,7 @@ def home():
 def get_route_with_scariness(route_file_path):
     route = read_gpx.read_gpx(route_file_path)
     route = read_gpx.pad_gpx_dataframe(route)
-    route_bounds = read_gpx.get_route_bounds(route)
+    route_bounds = csp.get_route_bounds(route)
     altitudes_df = csp.get_complete_route_altitude_df(route_bounds)
     route = csp.calculate_route_scariness(route, altitudes_df)
     return route
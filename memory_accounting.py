@@ -0,0 +1,120 @@
+"""
+Memory accounting for the scoring and ingest pipelines. The peak memory of each stage is tracked
+with tracemalloc when MEMORY_TRACKING is on, and the memory a job will need is estimated before it
+starts and checked against MEMORY_BUDGET, so big jobs are done in chunks, or rejected with a clear
+error, rather than being killed for running out of memory
+"""
+
+import contextvars
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from config import Config
+
+MEMORY_SETTINGS = {'budget': Config.MEMORY_BUDGET, 'tracking': Config.MEMORY_TRACKING}
+# Peak bytes per row, measured with tracemalloc: an altitude row while a query result is built
+# into a dataframe (more than scoring a point against the row takes later), a cell of a tile
+# while it is padded, and a row waiting to be inserted into a Locations table
+FETCH_ROW_BYTES = 400
+PADDED_CELL_BYTES = 24
+INSERT_ROW_BYTES = 280
+# Rows inserted at a time when ingesting, however big the budget
+INSERT_BATCH_ROWS = 50000
+
+_STAGE_PEAKS = {}
+_STAGE_PEAKS_LOCK = threading.Lock()
+_TRACKED_STAGES = contextvars.ContextVar('tracked_stages', default=())
+
+
+class MemoryBudgetExceededError(Exception):
+    """
+    Raised when a job can't be done within the memory budget, even in chunks
+    """
+
+
+def get_affordable_rows(row_bytes, limit=None):
+    """
+    Gets the number of rows that fit in the memory budget
+    :param row_bytes: int, bytes needed per row
+    :param limit: int, most rows to return, e.g. when there is no budget
+    :return: int, or limit (None if not given) if there is no budget
+    """
+    budget = MEMORY_SETTINGS['budget']
+    if not budget:
+        return limit
+    rows = max(0, budget // row_bytes)
+    return rows if limit is None else min(rows, limit)
+
+
+def check_memory_budget(estimated_bytes, description):
+    """
+    Rejects a job that would need more memory than the budget
+    :param estimated_bytes: int
+    :param description: string, the job, e.g. 'Scoring route abc'
+    """
+    budget = MEMORY_SETTINGS['budget']
+    if budget and estimated_bytes > budget:
+        raise MemoryBudgetExceededError(
+            f'{description} needs an estimated {estimated_bytes / 2 ** 20:.0f} MiB, more than the '
+            f'memory budget of {budget / 2 ** 20:.0f} MiB')
+
+
+@contextmanager
+def track_memory(stage):
+    """
+    Records the peak memory allocated while a stage runs, over what was allocated when it
+    started. Stages can be nested. tracemalloc traces the whole process, so stages running at
+    the same time in other threads are counted too
+    :param stage: string, name of the stage
+    """
+    if not MEMORY_SETTINGS['tracking']:
+        yield
+        return
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    start, peak = tracemalloc.get_traced_memory()
+    outer_stages = _TRACKED_STAGES.get()
+    if outer_stages:
+        # Keep the peak the enclosing stage has reached so far, as it is reset for this one
+        outer_stages[-1]['peak'] = max(outer_stages[-1]['peak'], peak)
+    tracked = {'peak': 0}
+    token = _TRACKED_STAGES.set(outer_stages + (tracked,))
+    tracemalloc.reset_peak()
+    try:
+        yield
+    finally:
+        peak = max(tracemalloc.get_traced_memory()[1], tracked['peak'])
+        _TRACKED_STAGES.reset(token)
+        if outer_stages:
+            outer_stages[-1]['peak'] = max(outer_stages[-1]['peak'], peak)
+        with _STAGE_PEAKS_LOCK:
+            _STAGE_PEAKS[stage] = max(_STAGE_PEAKS.get(stage, 0), peak - start)
+
+
+def get_stage_peaks():
+    """
+    Gets the highest peak memory recorded for each stage
+    :return: dict, stage name: bytes
+    """
+    with _STAGE_PEAKS_LOCK:
+        return dict(_STAGE_PEAKS)
+
+
+def reset_stage_peaks():
+    """
+    Forgets the peak memory recorded for each stage
+    """
+    with _STAGE_PEAKS_LOCK:
+        _STAGE_PEAKS.clear()
+
+
+def get_prometheus_metrics():
+    """
+    Gets the peak memory of each stage in the Prometheus text exposition format
+    :return: string
+    """
+    lines = ['# HELP mountain_fear_finder_stage_peak_bytes Peak memory allocated by each stage',
+             '# TYPE mountain_fear_finder_stage_peak_bytes gauge']
+    for stage, peak in sorted(get_stage_peaks().items()):
+        lines.append(f'mountain_fear_finder_stage_peak_bytes{{stage="{stage}"}} {peak}')
+    return '\n'.join(lines) + '\n'
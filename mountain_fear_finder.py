@@ -1 +1,10 @@
-from app import app
\ No newline at end of file
+from app import app
+from app.warm_up import start_warm_up
+
+if __name__ == '__main__':
+    from batch_score_routes import main
+    main()
+else:
+    # Imported by flask run or a WSGI server to serve the application, rather than only importing
+    # app, so scripts and tests importing the application don't load everything at start up
+    start_warm_up(app.config)
@@ -0,0 +1,32 @@
+"""
+Optional plotting of altitude data and routes for sanity checks while debugging, kept apart from
+the scoring and ingest modules so matplotlib is only imported when something is plotted
+"""
+
+import matplotlib.pyplot as plt
+
+
+def plot_route_on_altitudes_df(route_df, altitudes_df, region_name):
+    """
+    Plots the route on the background of the altitudes, for sanity checks
+    :param route_df: pandas dataframe from gpx file
+    :param altitudes_df: pandas dataframe containing background Locations
+    :param region_name: string
+    """
+    plt.scatter(altitudes_df['longitude'], altitudes_df['latitude'],
+                c=altitudes_df['altitude'])
+    plt.scatter(route_df['long'], route_df['lat'], marker=11)
+    plt.title(region_name)
+    plt.show()
+
+
+def plot_asc_data(asc_df, region_name):
+    """
+    Plots the altitude data, if you want to
+    :param asc_df: DataFrame matrix with x as the column names,
+                   y as the index and altitude as the values
+    :param region_name: string
+    """
+    plt.imshow(asc_df)
+    plt.title(region_name)
+    plt.show()
@@ -7,13 +7,17 @@ convert points from OS grid to Lat/long and insert points into database
 
 import datetime as dt
 import os
+from itertools import chain, islice
 from pathlib import Path
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 import sqlalchemy as db
 from sqlalchemy.exc import IntegrityError
 from OSGridConverter import grid2latlong
+import altitude_schema
+import memory_accounting
+from instrumentation import span, trace
+from memory_accounting import track_memory
 
 
 def read_contour_file(filename):
@@ -58,14 +62,13 @@ def get_asc_file_header_information(filename):
 
 def plot_asc_data(asc_df, region_name):
     """
-    Plots the altitude data, if you want to
+    Plots the altitude data, if you want to (see plot_altitude_data, which imports matplotlib)
     :param asc_df: DataFrame matrix with x as the column names,
                    y as the index and altitude as the values
     :param region_name: string
     """
-    plt.imshow(asc_df)
-    plt.title(region_name)
-    plt.show()
+    import plot_altitude_data  # pylint: disable=import-outside-toplevel
+    plot_altitude_data.plot_asc_data(asc_df, region_name)
 
 
 def pad_altitude_df_columns(altitude_df):
@@ -172,6 +175,62 @@ def double_pad_altitude_df(altitude_df):
     return altitude_df
 
 
+def pad_altitude_df_window(window, left_column=None, right_column=None):
+    """
+    Pads a window of the altitude dataframe, a strip of its columns, once, giving the same values
+    as padding the whole dataframe (see double_pad_altitude_df). Cells are filled in column order,
+    each from the cells already filled to its left, so the window needs the last padded column
+    before it and the first unpadded column after it
+    :param window: DataFrame matrix with x as the column names,
+                   y as the index and altitude as the values
+    :param left_column: pandas Series, the last padded column before the window, if any
+    :param right_column: pandas Series, the first unpadded column after the window, if any
+    :return: DataFrame matrix of the padded window, up to (not including) right_column
+    """
+    if right_column is not None:
+        window = pd.concat([window, right_column], axis=1)
+    window = pad_altitude_df_columns(pad_altitude_df_rows(window))
+    if left_column is not None:
+        window.insert(0, left_column.name, left_column)
+    window = interpolate_na_values_in_altitude_df(window)
+    return window.iloc[:, int(left_column is not None):
+                       window.shape[1] - int(right_column is not None)]
+
+
+def pad_altitude_df_windows(windows):
+    """
+    Pads windows of the altitude dataframe, strips of consecutive columns in order, once
+    :param windows: iterable of DataFrame matrices with x as the column names,
+                    y as the index and altitude as the values
+    :return: generator of padded DataFrame matrices
+    """
+    left_column, window = None, None
+    for next_window in windows:
+        if window is not None:
+            padded = pad_altitude_df_window(window, left_column, next_window.iloc[:, 0])
+            left_column = padded.iloc[:, -1]
+            yield padded
+        window = next_window
+    if window is not None:
+        yield pad_altitude_df_window(window, left_column)
+
+
+def double_pad_altitude_df_in_windows(altitude_df, window_columns):
+    """
+    Pads the altitude dataframe twice a window at a time, giving the same values as
+    double_pad_altitude_df while only a window is held padded in memory
+    :param altitude_df: DataFrame matrix with x as the column names,
+                        y as the index and altitude as the values
+    :param window_columns: int, columns of the unpadded dataframe in each window
+    :return: generator of padded DataFrame matrices, strips of columns in order
+    """
+    windows = (altitude_df.iloc[:, x:x + window_columns]
+               for x in range(0, altitude_df.shape[1], window_columns))
+    for _ in range(2):
+        windows = pad_altitude_df_windows(windows)
+    return windows
+
+
 def create_db_table_df_from_altitude_df(altitude_df, grid_ref_initials):
     """
     For each point in the altitude dataframe, takes the x and y coordinates, works out the
@@ -194,42 +253,77 @@ def create_db_table_df_from_altitude_df(altitude_df, grid_ref_initials):
 def create_db_table(connection):
     """
     Creates a database table for the location data, with columns for latitude, longitude,
-    altitude, if the table doesn't already exist
+    altitude in the configured schema (see altitude_schema), if the table doesn't already exist
     :param connection: sqlite database connection
     :return: sqlalchemy database table object
     """
-    metadata = db.MetaData(connection)
-    locations = db.Table('locations', metadata,
-                         db.Column('latitude', db.Float(), nullable=False, primary_key=True),
-                         db.Column('longitude', db.Float(), nullable=False, primary_key=True),
-                         db.Column('altitude', db.Float(), nullable=False))
-    metadata.create_all()
-    return locations
+    return altitude_schema.create_locations_table(connection)
 
 
-def insert_coords_into_db_table(altitude_df, grid_ref_initials, connection, table):
+def get_coords_rows(altitude_df, grid_ref_initials):
     """
-    Puts the data in the dataframe (converted into latitude, longitude and altitude), into the
-    database table
+    For each point in the altitude dataframe, works out the latitude and longitude from the x and
+    y coordinates, one point at a time, or when the Locations are stored in OS grid coordinates
+    (see altitude_schema) takes the x and y coordinates as they are
     :param altitude_df: DataFrame matrix with x as the column names,
                         y as the index and altitude as the values
     :param grid_ref_initials: string (two letters denoting the grid reference area)
-    :param connection: sqlite database connection
-    :param table: sqlalchemy table object
-    """
-    _ = db.MetaData(connection)  # get sqlalchemy metadata
-    values_list = []
-    query = db.insert(table)
+    :return: generator of dicts, with keys latitude, longitude (or northing, easting) and altitude
+    """
+    if altitude_schema.is_grid():
+        for x_coord in list(altitude_df):
+            for y_coord, altitude in altitude_df[x_coord].items():
+                yield {'northing': float(y_coord), 'easting': float(x_coord),
+                       'altitude': altitude}
+        return
     for x_coord in list(altitude_df):
         for y_coord in altitude_df.index.tolist():
             x_coordy = str(x_coord).split('.', maxsplit=1)[0]
             y_coordy = str(y_coord).split('.', maxsplit=1)[0]
             loc_ll = grid2latlong(f'{grid_ref_initials} {x_coordy[1:]} {y_coordy[1:]}',
                                   tag='OSGB36')
-            values_list.append({'latitude': loc_ll.latitude, 'longitude': loc_ll.longitude,
-                                'altitude': altitude_df[x_coord][y_coord]})
+            yield {'latitude': loc_ll.latitude, 'longitude': loc_ll.longitude,
+                   'altitude': altitude_df[x_coord][y_coord]}
+
+
+def insert_coords_into_db_table(altitude_df, grid_ref_initials, connection, table,
+                                batch_rows=None):
+    """
+    Puts the data in the dataframe (converted into latitude, longitude and altitude, unless stored
+    in OS grid coordinates), into the database table, a batch of rows at a time so only one batch
+    is held in memory, in a single transaction so either all of the tile goes in or none of it does
+    :param altitude_df: DataFrame matrix with x as the column names,
+                        y as the index and altitude as the values
+    :param grid_ref_initials: string (two letters denoting the grid reference area)
+    :param connection: sqlite database connection
+    :param table: sqlalchemy table object
+    :param batch_rows: int, rows inserted at a time, by default as many as fit in the memory
+                       budget, up to memory_accounting.INSERT_BATCH_ROWS
+    """
+    insert_rows_into_db_table(get_coords_rows(altitude_df, grid_ref_initials), connection, table,
+                              batch_rows)
+
+
+def insert_rows_into_db_table(rows, connection, table, batch_rows=None):
+    """
+    Puts rows of location data into the database table, a batch at a time, in a single
+    transaction (see insert_coords_into_db_table)
+    :param rows: iterable of dicts, see get_coords_rows
+    :param connection: sqlite database connection
+    :param table: sqlalchemy table object
+    :param batch_rows: int, rows inserted at a time, by default as many as fit in the memory
+                       budget, up to memory_accounting.INSERT_BATCH_ROWS
+    """
+    _ = db.MetaData(connection)  # get sqlalchemy metadata
+    batch_rows = batch_rows or max(1, memory_accounting.get_affordable_rows(
+        memory_accounting.INSERT_ROW_BYTES, memory_accounting.INSERT_BATCH_ROWS))
+    query = db.insert(table)
+    rows = iter(rows)
     try:
-        _ = connection.execute(query, values_list)  # execute query with no return needed
+        with connection.begin():
+            for batch in iter(lambda: list(islice(rows, batch_rows)), []):
+                # execute query with no return needed
+                _ = connection.execute(query, altitude_schema.encode_location_rows(batch, table))
     except IntegrityError:
         print("Entry already in table")
 
@@ -258,6 +352,79 @@ def get_file_list(base_path):
     return files
 
 
+def estimate_ingest_bytes(metadata, window_columns):
+    """
+    Estimates the memory needed to ingest an asc file a window at a time: its data as read, a
+    window of it padded twice (see double_pad_altitude_df_in_windows) and a batch of rows being
+    inserted
+    :param metadata: dict, from get_asc_file_header_information
+    :param window_columns: int, columns of the unpadded data in each window
+    :return: int
+    """
+    padded_rows = 4 * metadata['nrows'] - 3
+    return (metadata['nrows'] * metadata['ncols'] * memory_accounting.PADDED_CELL_BYTES
+            + 4 * window_columns * padded_rows * memory_accounting.PADDED_CELL_BYTES
+            + get_ingest_batch_rows(metadata) * memory_accounting.INSERT_ROW_BYTES)
+
+
+def get_ingest_batch_rows(metadata):
+    """
+    Gets the rows inserted at a time when ingesting an asc file, a padded column's worth
+    :param metadata: dict, from get_asc_file_header_information
+    :return: int
+    """
+    return min(4 * (4 * metadata['nrows'] - 3), memory_accounting.INSERT_BATCH_ROWS)
+
+
+def get_ingest_window_columns(metadata):
+    """
+    Gets the most columns of an asc file that can be padded and inserted at a time within the
+    memory budget
+    :param metadata: dict, from get_asc_file_header_information
+    :return: int, all the columns if there is no budget, 0 if not even one fits
+    """
+    budget = memory_accounting.MEMORY_SETTINGS['budget']
+    if not budget:
+        return metadata['ncols']
+    column_bytes = estimate_ingest_bytes(metadata, 1) - estimate_ingest_bytes(metadata, 0)
+    return min(metadata['ncols'],
+               max(0, (budget - estimate_ingest_bytes(metadata, 0)) // column_bytes))
+
+
+def ingest_tile(file, connection, locations):
+    """
+    Reads an asc file into a dataframe, pads the dataframe to increase data resolution, then
+    converts coordinates to latitude and longitude and inserts them into the database table, timing
+    each step as a span of the tile's trace. The tile is padded and inserted a window of columns at
+    a time, as many as fit in the memory budget, in a single transaction. Tiles too big for even
+    one column to fit are rejected before they are read
+    :param file: string, name of the asc file in data/asc_files
+    :param connection: sqlite database connection
+    :param locations: sqlalchemy table object
+    """
+    file_path = Path(f'data/asc_files/{file}')
+    metadata = get_asc_file_header_information(file_path)
+    window_columns = get_ingest_window_columns(metadata)
+    memory_accounting.check_memory_budget(estimate_ingest_bytes(metadata, max(window_columns, 1)),
+                                          f'Padding {file}')
+    with trace('ingest_tile', file=file):
+        print(f'Reading in {file} at {dt.datetime.now()}')
+        file_reference = file[0:2]
+        with span('read'), track_memory('read'):
+            altitude_df = read_contour_file(file_path)
+        print(f'Padding and inserting data into db at {dt.datetime.now()}')
+        points = (4 * metadata['nrows'] - 3) * (4 * metadata['ncols'] - 3)
+        with span('pad_and_insert', points=points, window_columns=window_columns), \
+                track_memory('pad_and_insert'):
+            windows = double_pad_altitude_df_in_windows(altitude_df, window_columns)
+            rows = chain.from_iterable(get_coords_rows(x, file_reference) for x in windows)
+            insert_rows_into_db_table(rows, connection, locations,
+                                      get_ingest_batch_rows(metadata))
+    with open('in_db.csv', 'a+') as inserted_files_doc:
+        inserted_files_doc.write(f'{file}\n')
+    print(f'Finished with {file} at {dt.datetime.now()}\n**************\n')
+
+
 def ingest_asc_file(file):
     """
     Given an asc file, reads it into a dataframe, pads the dataframe to increase data resolution,
@@ -267,15 +434,7 @@ def ingest_asc_file(file):
     engine = db.create_engine('sqlite:///altitudes.sqlite')
     with engine.connect() as connection:
         locations = create_db_table(connection)
-        print(f'Reading in {file} at {dt.datetime.now()}')
-        file_reference = file[0:2]
-        altitude_df = read_contour_file(Path(f'data/asc_files/{file}'))
-        altitude_df = double_pad_altitude_df(altitude_df)
-        print(f'Inserting padded data into db at {dt.datetime.now()}')
-        insert_coords_into_db_table(altitude_df, file_reference, connection, locations)
-    with open('in_db.csv', 'a+') as inserted_files_doc:
-        inserted_files_doc.write(f'{file}\n')
-    print(f'Finished with {file} at {dt.datetime.now()}\n**************\n')
+        ingest_tile(file, connection, locations)
 
 
 def main():
@@ -289,15 +448,11 @@ def main():
     connection = engine.connect()
     locations = create_db_table(connection)
     for file in file_list:
-        print(f'Reading in {file} at {dt.datetime.now()}')
-        file_reference = file[0:2]
-        altitude_df = read_contour_file(Path(f'data/asc_files/{file}'))
-        altitude_df = double_pad_altitude_df(altitude_df)
-        print(f'Inserting padded data into db at {dt.datetime.now()}')
-        insert_coords_into_db_table(altitude_df, file_reference, connection, locations)
-        with open('in_db.csv', 'a+') as inserted_files_doc:
-            inserted_files_doc.write(f'{file}\n')
-        print(f'Finished with {file} at {dt.datetime.now()}\n**************\n')
+        ingest_tile(file, connection, locations)
+    if altitude_schema.is_grid():
+        altitude_schema.split_grid_locations(connection)
+    else:
+        altitude_schema.split_longitude_locations(connection)
 
 
 if __name__ == '__main__':
@@ -11,15 +11,25 @@ import pandas as pd
 def read_gpx(file_name):
     """
     Reads a gpx route file (xml) to DataFrame
-    :param file_name: string or Path object
+    :param file_name: string or Path object, or the contents of a gpx file as bytes or a file
+                      object open for reading, e.g. an uploaded file that was never saved
     :return: pandas DataFrame containing route data with columns name, lat, long, elevation
     """
     columns = ['name', 'lat', 'long', 'elevation']
     rows = []
 
-    with open(file_name) as gpx_file:
-        xmlstring = gpx_file.read()
-    xmlstring = re.sub(' xmlns="[^"]+"', '', xmlstring, count=1)
+    # Bytes are parsed as they are, so the parser decodes them in the encoding the file declares
+    if isinstance(file_name, (bytes, bytearray)):
+        xmlstring = bytes(file_name)
+    elif hasattr(file_name, 'read'):
+        xmlstring = file_name.read()
+    else:
+        with open(file_name, 'rb') as gpx_file:
+            xmlstring = gpx_file.read()
+    if isinstance(xmlstring, bytes):
+        xmlstring = re.sub(b' xmlns="[^"]+"', b'', xmlstring, count=1)
+    else:
+        xmlstring = re.sub(' xmlns="[^"]+"', '', xmlstring, count=1)
     gpx_tree = et.ElementTree(et.fromstring(xmlstring))
     gpx_root = gpx_tree.getroot()
 
@@ -71,3 +81,13 @@ def get_route_bounds(route_df):
     """
     return [route_df['lat'].max(), route_df['long'].max(),
             route_df['lat'].min(), route_df['long'].min()]
+
+
+def combine_route_bounds(route_bounds_list):
+    """
+    Gets the bounds covering all of a list of route bounds
+    :param route_bounds_list: list of lists, each [max_lat, max_long, min_lat, min_long]
+    :return: list
+    """
+    return [max(x[0] for x in route_bounds_list), max(x[1] for x in route_bounds_list),
+            min(x[2] for x in route_bounds_list), min(x[3] for x in route_bounds_list)]
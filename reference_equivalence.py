@@ -0,0 +1,326 @@
+"""
+Equivalence harness for alternative engines of the scoring and ingest functions. Each engine is
+run on the same inputs as the reference implementation it replaces (calculate_scariness,
+normalise_points, double_pad_altitude_df or insert_coords_into_db_table): randomised synthetic
+terrain, points and routes, and any asc and gpx fixture files given. The harness reports the exact
+match rate of integer scores, and the max and mean absolute error of altitudes and coordinates,
+against tolerances set per engine, so an optimisation can ship with evidence it gives the same
+answers. The reference implementations are frozen copies (see frozen_reference), and the live
+functions are checked against them as the 'live' engines, so the live code can't drift without the
+harness noticing. Engines are registered with register_engine, or named on the command line
+"""
+
+import argparse
+import importlib
+import json
+import sys
+import tempfile
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import sqlalchemy as db
+import altitude_schema
+import benchmark_pipeline
+import calculate_scary_points as csp
+import frozen_reference
+import read_contour_data as contour
+import read_gpx
+
+DEFAULT_TOLERANCES = {'score_match_rate': 1.0, 'coordinate_error': 0.0, 'altitude_error': 0.0}
+ROUTE_STEP = 0.0002
+
+
+def read_locations_table(connection):
+    """
+    Reads back the rows inserted into the Locations table
+    :param connection: sqlite database connection
+    :return: pandas Dataframe with columns latitude, longitude, altitude
+    """
+    return altitude_schema.read_locations(connection, 'locations')
+
+
+ENGINES = {'calculate_scariness': {
+               'reference': {'func': frozen_reference.calculate_scariness}},
+           'normalise_points': {'reference': {'func': frozen_reference.normalise_points}},
+           'double_pad_altitude_df': {
+               'reference': {'func': frozen_reference.double_pad_altitude_df}},
+           'insert_coords_into_db_table': {'reference': {
+               'func': frozen_reference.insert_coords_into_db_table,
+               'read_back': read_locations_table}}}
+
+
+def register_engine(function, name, func, tolerances=None, read_back=None):
+    """
+    Registers an alternative engine for one of the reference functions
+    :param function: string, name of the reference function the engine replaces
+    :param name: string, name of the engine in reports
+    :param func: function, taking the same arguments as the reference function
+    :param tolerances: dict, overriding DEFAULT_TOLERANCES for this engine
+    :param read_back: function, for insert engines writing their own tables, taking the
+                      connection and returning the inserted rows as a Dataframe with columns
+                      latitude, longitude, altitude
+    """
+    if function not in ENGINES:
+        raise ValueError(f'No reference function {function}, expected one of {list(ENGINES)}')
+    ENGINES[function][name] = {'func': func, 'tolerances': tolerances or {},
+                               'read_back': read_back or read_locations_table}
+
+
+def get_live_function(module, function):
+    """
+    Gets a live function as an engine, looked up each time the engine runs, so a patched or
+    reloaded function is the one checked
+    :param module: module the function is in
+    :param function: string, name of the function
+    :return: function
+    """
+    return lambda *args: getattr(module, function)(*args)
+
+
+for live_module, live_function in [(csp, 'calculate_scariness'), (csp, 'normalise_points'),
+                                   (contour, 'double_pad_altitude_df'),
+                                   (contour, 'insert_coords_into_db_table')]:
+    register_engine(live_function, 'live', get_live_function(live_module, live_function))
+
+
+def load_engine(spec):
+    """
+    Registers an engine named on the command line
+    :param spec: string, function=module:attribute[,tolerance=value...], e.g.
+                 double_pad_altitude_df=fast_padding:double_pad,altitude_error=0.01
+    :return: tuple, (function, engine name)
+    """
+    function, rest = spec.split('=', 1)
+    target, *settings = rest.split(',')
+    module, attribute = target.split(':')
+    tolerances = {x: float(y) for x, y in (setting.split('=') for setting in settings)}
+    register_engine(function, target, getattr(importlib.import_module(module), attribute),
+                    tolerances)
+    return function, target
+
+
+def get_errors(reference, result):
+    """
+    Gets the absolute errors of an engine's values compared with the reference's
+    :param reference: array like of floats
+    :param result: array like of floats
+    :return: dict, max and mean absolute error, infinite if the shapes don't match
+    """
+    reference, result = np.asarray(reference, dtype=float), np.asarray(result, dtype=float)
+    if reference.shape != result.shape:
+        return {'max_abs_error': float('inf'), 'mean_abs_error': float('inf')}
+    if reference.size == 0:
+        return {'max_abs_error': 0.0, 'mean_abs_error': 0.0}
+    errors = np.abs(reference - result)
+    errors[np.isnan(reference) & np.isnan(result)] = 0
+    errors[np.isnan(errors)] = np.inf
+    return {'max_abs_error': float(errors.max()), 'mean_abs_error': float(errors.mean())}
+
+
+def get_score_matches(reference, result):
+    """
+    Gets the rate at which an engine's integer scores match the reference's
+    :param reference: array like of ints
+    :param result: array like of ints
+    :return: dict
+    """
+    reference, result = np.asarray(reference), np.asarray(result)
+    if reference.shape != result.shape:
+        return {'exact_match_rate': 0.0}
+    return {'exact_match_rate': float(np.mean(reference == result)) if reference.size else 1.0}
+
+
+def make_inputs(seeds=3, tile_cells=16, points=40, asc_files=(), gpx_files=()):
+    """
+    Makes the inputs every engine is run on: for each seed a tile of synthetic terrain (see
+    benchmark_pipeline.make_terrain) with random points and a random walk route across it, plus
+    each asc fixture file, and each gpx fixture file with its altitude data from the database
+    :param seeds: int, number of synthetic tiles
+    :param tile_cells: int, cells along each side of each synthetic tile
+    :param points: int, random points and route points per synthetic tile
+    :param asc_files: list of strings, asc files in the OS grid square named by their first two
+                      letters
+    :param gpx_files: list of strings
+    :return: list of dicts, with keys name, grid_square, asc_df (may be None), altitude_df,
+             points and route
+    """
+    tiles = []
+    with tempfile.TemporaryDirectory() as directory:
+        for seed in range(seeds):
+            asc_file = Path(directory) / f'{benchmark_pipeline.GRID_SQUARE}{seed}.asc'
+            benchmark_pipeline.write_asc_tile(asc_file,
+                                              benchmark_pipeline.make_terrain(tile_cells, seed))
+            tiles.append((f'synthetic-{seed}', asc_file, seed))
+        tiles += [(Path(x).name, Path(x), seed) for seed, x in enumerate(asc_files, seeds)]
+        inputs = [make_tile_input(*x, points) for x in tiles]
+    for gpx_file in gpx_files:
+        route = read_gpx.read_gpx(gpx_file)
+        altitude_df = csp.get_complete_route_altitude_df(read_gpx.get_route_bounds(route))
+        inputs.append({'name': Path(gpx_file).name, 'grid_square': None, 'asc_df': None,
+                       'altitude_df': altitude_df, 'points': route[['lat', 'long']],
+                       'route': route})
+    return inputs
+
+
+def make_tile_input(name, asc_file, seed, points):
+    """
+    Makes the inputs for one asc tile, see make_inputs
+    :param name: string
+    :param asc_file: pathlib Path
+    :param seed: int, random seed for the points and route
+    :param points: int
+    :return: dict
+    """
+    rng = np.random.default_rng(seed)
+    asc_df = contour.read_contour_file(asc_file)
+    padded_df = frozen_reference.double_pad_altitude_df(asc_df.copy())
+    grid_square = asc_file.name[0:2]
+    altitude_df = pd.DataFrame(list(contour.get_coords_rows(padded_df, grid_square)))
+    inner = {x: altitude_df[x].quantile([0.3, 0.7]).to_numpy() for x in ['latitude', 'longitude']}
+    random_points = pd.DataFrame({'lat': rng.uniform(*inner['latitude'], points),
+                                  'long': rng.uniform(*inner['longitude'], points)})
+    steps = rng.normal(0, ROUTE_STEP, (points, 2)).cumsum(axis=0)
+    route = pd.DataFrame({
+        'name': '', 'lat': np.clip(inner['latitude'].mean() + steps[:, 0], *inner['latitude']),
+        'long': np.clip(inner['longitude'].mean() + steps[:, 1], *inner['longitude'])})
+    nearest = [np.argmin((altitude_df['latitude'] - x) ** 2 + (altitude_df['longitude'] - y) ** 2)
+               for x, y in zip(route['lat'], route['long'])]
+    route['elevation'] = (altitude_df['altitude'].to_numpy()[nearest]
+                          + rng.normal(0, 3, points))
+    return {'name': name, 'grid_square': grid_square, 'asc_df': asc_df,
+            'altitude_df': altitude_df, 'points': random_points, 'route': route}
+
+
+def run_calculate_scariness(engine, case):
+    """
+    Scores each random point of a case with an engine
+    :param engine: dict, see register_engine
+    :param case: dict, see make_inputs
+    :return: dict, with scores
+    """
+    return {'scores': [int(engine['func'](x, case['altitude_df']))
+                       for _, x in case['points'].iterrows()]}
+
+
+def run_normalise_points(engine, case):
+    """
+    Normalises the route of a case with an engine
+    :param engine: dict, see register_engine
+    :param case: dict, see make_inputs
+    :return: dict, with coordinates
+    """
+    route = engine['func'](case['route'].copy(), case['altitude_df'])
+    return {'coordinates': route[['lat', 'long']].to_numpy()}
+
+
+def run_double_pad_altitude_df(engine, case):
+    """
+    Pads the asc data of a case with an engine
+    :param engine: dict, see register_engine
+    :param case: dict, see make_inputs
+    :return: dict, with coordinates (the grid of the padded data) and altitudes
+    """
+    padded_df = engine['func'](case['asc_df'].copy())
+    return {'coordinates': np.concatenate([padded_df.index.to_numpy(dtype=float),
+                                           padded_df.columns.to_numpy(dtype=float)]),
+            'altitudes': padded_df.to_numpy(dtype=float)}
+
+
+def run_insert_coords_into_db_table(engine, case):
+    """
+    Inserts the padded asc data of a case into a new database with an engine, and reads it back
+    :param engine: dict, see register_engine
+    :param case: dict, see make_inputs
+    :return: dict, with coordinates and altitudes, sorted by latitude then longitude
+    """
+    padded_df = frozen_reference.double_pad_altitude_df(case['asc_df'].copy())
+    database = db.create_engine('sqlite://')
+    with database.connect() as connection:
+        locations = contour.create_db_table(connection)
+        engine['func'](padded_df, case['grid_square'], connection, locations)
+        rows = engine['read_back'](connection).sort_values(['latitude', 'longitude'])
+    database.dispose()
+    return {'coordinates': rows[['latitude', 'longitude']].to_numpy(dtype=float),
+            'altitudes': rows['altitude'].to_numpy(dtype=float)}
+
+
+RUNNERS = {'calculate_scariness': run_calculate_scariness,
+           'normalise_points': run_normalise_points,
+           'double_pad_altitude_df': run_double_pad_altitude_df,
+           'insert_coords_into_db_table': run_insert_coords_into_db_table}
+
+
+def check_engine(function, name, inputs):
+    """
+    Runs an engine and the reference it replaces on every input, comparing their answers
+    :param function: string, name of the reference function
+    :param name: string, name of the engine
+    :param inputs: list of dicts, see make_inputs
+    :return: dict, report of the match rates and errors, and whether they are within tolerance
+    """
+    engine = ENGINES[function][name]
+    tolerances = {**DEFAULT_TOLERANCES, **engine.get('tolerances', {})}
+    runner = RUNNERS[function]
+    cases = [x for x in inputs if x['asc_df'] is not None
+             or function in ['calculate_scariness', 'normalise_points']]
+    reference, result = {}, {}
+    for case in cases:
+        for answers, answer in [(reference, runner(ENGINES[function]['reference'], case)),
+                                (result, runner(engine, case))]:
+            for key, value in answer.items():
+                answers.setdefault(key, []).append(np.ravel(value))
+    report = {'function': function, 'engine': name, 'cases': len(cases)}
+    passed = True
+    for key in reference:
+        if key == 'scores':
+            report[key] = get_score_matches(np.concatenate(reference[key]),
+                                            np.concatenate(result[key]))
+            passed &= report[key]['exact_match_rate'] >= tolerances['score_match_rate']
+        else:
+            # Compare case by case, so a case missing values can't be offset by another's extras
+            errors = [get_errors(x, y) for x, y in zip(reference[key], result[key])]
+            sizes = [len(x) for x in reference[key]]
+            report[key] = {'max_abs_error': max(x['max_abs_error'] for x in errors),
+                           'mean_abs_error': float(np.average(
+                               [x['mean_abs_error'] for x in errors], weights=sizes))
+                           if sum(sizes) else 0.0}
+            # e.g. coordinates are checked against coordinate_error
+            passed &= report[key]['max_abs_error'] <= tolerances[f'{key[:-1]}_error']
+    report['tolerances'] = tolerances
+    report['passed'] = bool(passed)
+    return report
+
+
+def main(argv=None):
+    """
+    Checks every registered engine, and any named on the command line, printing a report as one
+    line of json per engine, and exits with status 1 if any engine is outside its tolerances
+    :param argv: list of strings, defaults to the command line arguments
+    """
+    parser = argparse.ArgumentParser(
+        description='Check alternative engines give the same answers as the reference code')
+    parser.add_argument('--engine', action='append', default=[],
+                        help='function=module:attribute[,tolerance=value...]')
+    parser.add_argument('--seeds', type=int, default=3, help='number of synthetic tiles')
+    parser.add_argument('--tile-cells', type=int, default=16)
+    parser.add_argument('--points', type=int, default=40,
+                        help='random points and route points per synthetic tile')
+    parser.add_argument('--asc', action='append', default=[], help='asc fixture file')
+    parser.add_argument('--gpx', action='append', default=[],
+                        help='gpx fixture file, scored against the altitude database')
+    args = parser.parse_args(argv)
+    for spec in args.engine:
+        load_engine(spec)
+    inputs = make_inputs(args.seeds, args.tile_cells, args.points, args.asc, args.gpx)
+    failed = False
+    for function, engines in ENGINES.items():
+        for name in engines:
+            report = check_engine(function, name, inputs)
+            failed |= not report['passed']
+            print(json.dumps(report), flush=True)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+On demand profiling of the route map pipeline for a single request, for investigating slow routes
+in production. A request is profiled if it carries the admin profiling token in the
+X-Profile-Token header, or is picked by sampling a percentage of requests. The pipeline then runs
+under cProfile, and the pstats output (readable by pstats, snakeviz or flameprof) is written to a
+bounded directory, with a json file beside it holding the route and the timing of each stage
+"""
+
+import cProfile
+import hmac
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from pathlib import Path
+from werkzeug.utils import secure_filename
+from config import Config
+from instrumentation import Span
+
+PROFILE_HEADER = 'X-Profile-Token'
+PROFILE_SETTINGS = {'token': Config.PROFILE_TOKEN,
+                    'sample_percent': Config.PROFILE_SAMPLE_PERCENT,
+                    'directory': Config.PROFILE_DIR,
+                    'max_profiles': Config.PROFILE_MAX_FILES}
+
+# Only one request is profiled at a time, as profiling slows the process down
+_PROFILE_LOCK = threading.Lock()
+
+
+def should_profile(headers):
+    """
+    Decides whether to profile a request: always if it has the profiling token, otherwise for
+    the sampled percentage of requests
+    :param headers: request headers, dict like
+    :return: boolean
+    """
+    token = PROFILE_SETTINGS['token']
+    if token and hmac.compare_digest(headers.get(PROFILE_HEADER, ''), token):
+        return True
+    return random.random() * 100 < PROFILE_SETTINGS['sample_percent']
+
+
+def run_profiled(profile, route, func, *args, **kwargs):
+    """
+    Runs a step of the route map pipeline, under the profiler if the request is being profiled
+    and no other request is. The profile is written out whether or not the step worked
+    :param profile: boolean, see should_profile
+    :param route: string, name or file name of the route, to attach to the profile
+    :param func: function
+    :param args: arguments for func
+    :param kwargs: keyword arguments for func
+    :return: whatever func returns
+    """
+    if not profile or not _PROFILE_LOCK.acquire(blocking=False):
+        return func(*args, **kwargs)
+    try:
+        profiler = cProfile.Profile()
+        profiled_span = Span(func.__name__, {'route': route})
+        try:
+            with profiled_span:
+                return profiler.runcall(func, *args, **kwargs)
+        finally:
+            write_profile(profiler, profiled_span, route)
+    finally:
+        _PROFILE_LOCK.release()
+
+
+def write_profile(profiler, profiled_span, route):
+    """
+    Writes the pstats output of a profile, and a json file with the route and the timing of each
+    stage, to the profile directory, then removes the oldest profiles beyond the limit
+    :param profiler: cProfile.Profile
+    :param profiled_span: instrumentation.Span, timing of the profiled step and its stages
+    :param route: string
+    :return: pathlib Path of the pstats file
+    """
+    directory = Path(PROFILE_SETTINGS['directory'])
+    directory.mkdir(parents=True, exist_ok=True)
+    name = (f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}-"
+            f"{secure_filename(str(route)) or 'route'}")
+    profile_file = directory / f'{name}.prof'
+    profiler.dump_stats(profile_file)
+    with open(directory / f'{name}.json', 'w') as details_file:
+        json.dump({'route': route, 'pid': os.getpid(), 'created': time.time(),
+                   'profile': profile_file.name, 'stages': profiled_span.to_dict()},
+                  details_file, default=str)
+    prune_profiles(directory, PROFILE_SETTINGS['max_profiles'])
+    return profile_file
+
+
+def prune_profiles(directory, max_profiles):
+    """
+    Removes the oldest profiles, and their json files, beyond the newest max_profiles
+    :param directory: pathlib Path
+    :param max_profiles: int
+    """
+    profiles = sorted(directory.glob('*.prof'), key=lambda x: x.stat().st_mtime, reverse=True)
+    for profile_file in profiles[max(0, max_profiles):]:
+        profile_file.unlink(missing_ok=True)
+        profile_file.with_suffix('.json').unlink(missing_ok=True)
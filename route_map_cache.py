@@ -0,0 +1,114 @@
+"""
+Cache of rendered route map html, keyed by route id, content hash, fear threshold and scoring
+version, held in memory with least recently used eviction and, if a cache directory is configured,
+on disk. A route that is re-scored gets a new key, so maps cached by other processes go stale
+rather than being served
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from config import Config
+
+_CACHE = OrderedDict()
+_CACHE_LOCK = threading.Lock()
+CACHE_SETTINGS = {'size': Config.MAP_CACHE_SIZE, 'directory': Config.MAP_CACHE_DIR}
+# Change whenever the html of rendered maps changes, so maps cached on disk in the old format
+# aren't served
+MAP_FORMAT_VERSION = 2
+
+
+def get_cache_key(route_id, content_hash, scariness_threshold, scoring_version,
+                  render_mode='markers'):
+    """
+    Gets the key a rendered route map is cached under
+    :param route_id: int, route_id of the route in the routes catalog
+    :param content_hash: string, content_hash of the route in the routes catalog
+    :param scariness_threshold: int
+    :param scoring_version: string
+    :param render_mode: string, see get_folium_route_map
+    :return: tuple
+    """
+    return (int(route_id), str(content_hash), int(scariness_threshold), str(scoring_version),
+            str(render_mode))
+
+
+def get_cache_file(key):
+    """
+    Gets the path of the file a rendered route map is cached in on disk
+    :param key: tuple, from get_cache_key
+    :return: Path object, or None if there is no disk cache
+    """
+    if not CACHE_SETTINGS['directory']:
+        return None
+    return Path(CACHE_SETTINGS['directory']) / '{}-{}-{}-{}-{}-v{}.html'.format(
+        *key, MAP_FORMAT_VERSION)
+
+
+def get_cached_map(key):
+    """
+    Gets a rendered route map from the cache
+    :param key: tuple, from get_cache_key
+    :return: string, or None if the map isn't cached
+    """
+    with _CACHE_LOCK:
+        if key in _CACHE:
+            _CACHE.move_to_end(key)
+            return _CACHE[key]
+    cache_file = get_cache_file(key)
+    if cache_file is None or not cache_file.exists():
+        return None
+    route_map = cache_file.read_text()
+    add_to_memory_cache(key, route_map)
+    return route_map
+
+
+def add_to_memory_cache(key, route_map):
+    """
+    Adds a rendered route map to the in-memory cache, evicting the least recently used maps
+    :param key: tuple, from get_cache_key
+    :param route_map: string
+    """
+    with _CACHE_LOCK:
+        _CACHE[key] = route_map
+        _CACHE.move_to_end(key)
+        while len(_CACHE) > CACHE_SETTINGS['size']:
+            _CACHE.popitem(last=False)
+
+
+def cache_map(key, route_map):
+    """
+    Adds a rendered route map to the cache
+    :param key: tuple, from get_cache_key
+    :param route_map: string
+    """
+    add_to_memory_cache(key, route_map)
+    cache_file = get_cache_file(key)
+    if cache_file is not None:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        temp_file = cache_file.with_suffix(f'.{os.getpid()}.{threading.get_ident()}.tmp')
+        temp_file.write_text(route_map)
+        os.replace(temp_file, cache_file)
+
+
+def invalidate_route(route_id):
+    """
+    Removes all the cached maps for a route, in memory and on disk, e.g. when it is re-scored.
+    Other processes' in-memory caches aren't cleared, but the re-scored route has a new key
+    :param route_id: int, route_id of the route in the routes catalog
+    """
+    with _CACHE_LOCK:
+        for key in [x for x in _CACHE if x[0] == route_id]:
+            del _CACHE[key]
+    if CACHE_SETTINGS['directory'] and Path(CACHE_SETTINGS['directory']).exists():
+        for cache_file in Path(CACHE_SETTINGS['directory']).glob(f'{route_id}-*.html'):
+            cache_file.unlink(missing_ok=True)
+
+
+def clear_cache():
+    """
+    Empties the in-memory cache
+    """
+    with _CACHE_LOCK:
+        _CACHE.clear()
@@ -0,0 +1,115 @@
+"""
+Folium map element drawing a whole route as a single layer: the waypoints are sent to the
+browser once as compact arrays, drawn on a canvas, with popups built in the browser and the
+scarier points clustered
+"""
+
+import json
+from branca.element import CssLink, Figure, JavascriptLink, MacroElement
+from jinja2 import Template
+from administer_route_database import get_route_array_lists
+
+MARKER_CLUSTER_JS = ('https://cdnjs.cloudflare.com/ajax/libs/leaflet.markercluster/1.1.0/'
+                     'leaflet.markercluster.js')
+MARKER_CLUSTER_CSS = ['https://cdnjs.cloudflare.com/ajax/libs/leaflet.markercluster/1.1.0/'
+                      'MarkerCluster.css',
+                      'https://cdnjs.cloudflare.com/ajax/libs/leaflet.markercluster/1.1.0/'
+                      'MarkerCluster.Default.css']
+
+
+def get_route_layer_data(route):
+    """
+    Gets the waypoints of a route as compact columnar arrays for the browser, with whether each
+    score was refined if the route was scored in two passes
+    :param route: pandas Dataframe with columns lat, long, elevation, scariness, and optionally
+                  refined
+    :return: dict of lists
+    """
+    route_data = get_route_array_lists(route)
+    if 'refined' in route:
+        route_data['refined'] = route['refined'].astype(int).tolist()
+    return route_data
+
+
+class RouteLayer(MacroElement):
+    """
+    Draws a route as one polyline with a canvas circle marker per waypoint, and a clustered red
+    marker for each waypoint scarier than the threshold. Popups are built in the browser when
+    a waypoint is clicked, and the markers are recoloured in the browser when the page holding
+    the map posts it a new fear level
+    """
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        var {{ this.get_name() }} = (function() {
+            var route = {{ this.route_data }};
+            var map = {{ this._parent.get_name() }};
+            var renderer = L.canvas();
+            var latlngs = route.lat.map(function(lat, i) { return [lat, route.long[i]]; });
+            L.polyline(latlngs, {color: 'blue', weight: 2, renderer: renderer}).addTo(map);
+            var points = L.layerGroup().addTo(map);
+            var flagged = L.markerClusterGroup({disableClusteringAtZoom: 16}).addTo(map);
+            var scaryIcon = L.AwesomeMarkers.icon(
+                {markerColor: 'red', icon: 'info-sign', prefix: 'glyphicon'});
+            function popup(i) {
+                var waypoint = 'WP' + ('000' + (i + 1)).slice(-Math.max(4, String(i + 1).length));
+                return '<i>' + waypoint + ', Latitude: ' + route.lat[i] + ',<br> Longitude: '
+                    + route.long[i] + ',<br> Altitude: ' + route.elevation[i]
+                    + ',<br> Scariness: ' + route.scariness[i] + '/16'
+                    + (route.refined && !route.refined[i] ? ' (provisional)' : '') + '</i>';
+            }
+            function draw(threshold) {
+                points.clearLayers();
+                flagged.clearLayers();
+                var scary = [];
+                latlngs.forEach(function(latlng, i) {
+                    var marker;
+                    if (route.scariness[i] > threshold) {
+                        marker = L.marker(latlng, {icon: scaryIcon});
+                        scary.push(marker);
+                    } else {
+                        marker = L.circleMarker(latlng, {radius: 3, renderer: renderer});
+                        points.addLayer(marker);
+                    }
+                    marker.bindPopup(function() { return popup(i); });
+                    marker.bindTooltip('Click me');
+                });
+                flagged.addLayers(scary);
+            }
+            draw({{ this.scariness_threshold }});
+            var fearLevelThresholds = {{ this.fear_level_thresholds }};
+            window.addEventListener('message', function(event) {
+                if (event.source === window.parent && event.data
+                        && event.data.fearLevel in fearLevelThresholds) {
+                    draw(fearLevelThresholds[event.data.fearLevel]);
+                }
+            });
+            return {draw: draw, route: route};
+        })();
+        {% endmacro %}
+        """)
+
+    def __init__(self, route, scariness_threshold, fear_level_thresholds=None):
+        """
+        :param route: pandas Dataframe with columns lat, long, elevation, scariness
+        :param scariness_threshold: int, waypoints scarier than this are flagged
+        :param fear_level_thresholds: dict, fear level: scariness threshold, for the fear levels
+                                      the page can post to the map
+        """
+        super().__init__()
+        self._name = 'RouteLayer'
+        self.route_data = json.dumps(get_route_layer_data(route), separators=(',', ':'))
+        self.scariness_threshold = int(scariness_threshold)
+        self.fear_level_thresholds = json.dumps(
+            {str(x): int(y) for x, y in (fear_level_thresholds or {}).items()},
+            separators=(',', ':'))
+
+    def render(self, **kwargs):
+        """
+        Adds the marker cluster javascript and css to the page header, then renders the layer
+        """
+        figure = self.get_root()
+        if isinstance(figure, Figure):
+            figure.header.add_child(JavascriptLink(MARKER_CLUSTER_JS), name='markerclusterjs')
+            for index, css in enumerate(MARKER_CLUSTER_CSS):
+                figure.header.add_child(CssLink(css), name=f'markerclustercss{index}')
+        super().render(**kwargs)
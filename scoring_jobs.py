@@ -0,0 +1,403 @@
+"""
+Background jobs scoring uploaded routes on a local pool of worker threads, so the request that
+uploads a route returns straight away. The progress of each job through the scoring stages, and
+the scores of each segment of the route as it is scored, are kept in the Routes database, so the
+job status and job events endpoints work from any process of the application, not just the one
+running the job. Jobs are run by the process that created them, so those left unfinished by a
+process that has died are marked as failed when the next process starts using the jobs tables
+"""
+
+import contextlib
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import sqlalchemy as db
+from werkzeug.exceptions import HTTPException
+import administer_route_database
+import database_engines
+from config import Config
+from instrumentation import trace
+
+SCORING_STAGES = ['read', 'fetch', 'score', 'store']
+JOB_SETTINGS = {'workers': Config.SCORING_WORKERS, 'history': Config.SCORING_JOB_HISTORY,
+                'timeout': Config.SCORING_JOB_TIMEOUT}
+JOB_FIELDS = ['job_id', 'status', 'stage', 'stages', 'fear_level', 'route', 'error', 'created',
+              'finished']
+# Jobs run by other processes are only seen by polling the Routes database, while those run by
+# this process wake up their event streams straight away
+JOB_POLL_SECONDS = 0.5
+
+_JOBS_LOCK = threading.Lock()
+_JOBS_CHANGED = threading.Condition(_JOBS_LOCK)
+_TABLES_LOCK = threading.Lock()
+_TABLES_CREATED = set()
+_EXECUTOR = {}
+
+
+def get_executor():
+    """
+    Gets the pool of worker threads jobs are run on, creating it on first use in this process
+    :return: ThreadPoolExecutor
+    """
+    with _JOBS_LOCK:
+        executor, pid = _EXECUTOR.get('executor', (None, None))
+        if executor is None or pid != os.getpid():
+            executor = ThreadPoolExecutor(max_workers=JOB_SETTINGS['workers'],
+                                          thread_name_prefix='scoring-job')
+            _EXECUTOR['executor'] = (executor, os.getpid())
+    return executor
+
+
+def create_jobs_tables(connection):
+    """
+    Creates the scoring jobs table, with one row per job holding its state, and the job segments
+    table, with one row per segment of a job's route scored so far, if they don't already exist
+    :param connection: sqlite database connection
+    :return: tuple of sqlalchemy database table objects, (jobs, segments)
+    """
+    metadata = db.MetaData(connection)
+    jobs = db.Table('scoring_jobs', metadata,
+                    db.Column('job_id', db.String(), primary_key=True),
+                    db.Column('status', db.String(), nullable=False),
+                    db.Column('stage', db.String()),
+                    db.Column('stages', db.String(), nullable=False),
+                    db.Column('fear_level', db.Integer(), nullable=False),
+                    db.Column('route', db.String()),
+                    db.Column('error', db.String()),
+                    db.Column('created', db.Float(), nullable=False),
+                    db.Column('finished', db.Float()),
+                    db.Column('points', db.String()),
+                    db.Column('keep_result', db.Boolean(), nullable=False),
+                    db.Column('result', db.LargeBinary()),
+                    db.Column('refined', db.String()),
+                    db.Column('pid', db.Integer()))
+    segments = db.Table('scoring_job_segments', metadata,
+                        db.Column('job_id', db.String(), primary_key=True),
+                        db.Column('segment_index', db.Integer(), primary_key=True),
+                        db.Column('data', db.String(), nullable=False))
+    metadata.create_all()
+    # Add the columns of newer versions to jobs tables created by older ones
+    existing = {x['name'] for x in db.inspect(connection).get_columns('scoring_jobs')}
+    for column in [x for x in jobs.columns if x.name not in existing]:
+        connection.execute(f'alter table scoring_jobs add column {column.name} '
+                           f'{column.type.compile(connection.dialect)}')
+    return jobs, segments
+
+
+def is_process_alive(pid):
+    """
+    Checks whether a process is still running on this machine
+    :param pid: int
+    :return: boolean
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def reclaim_stale_jobs(connection):
+    """
+    Marks as failed the jobs left queued or running by processes that have died, and those
+    unfinished for longer than the configured timeout, so their pages and event streams don't
+    wait for them forever
+    :param connection: sqlite database connection
+    :return: int, number of jobs marked as failed
+    """
+    now = time.time()
+    jobs = connection.execute(db.text("select job_id, pid, created from scoring_jobs "
+                                      "where status in ('queued', 'running')")).fetchall()
+    stale = [x['job_id'] for x in jobs if x['pid'] is None or not is_process_alive(x['pid'])
+             or now - x['created'] > JOB_SETTINGS['timeout']]
+    for job_id in stale:
+        connection.execute(db.text("update scoring_jobs set status = 'failed', error = :error, "
+                                   "finished = :finished where job_id = :job_id and "
+                                   "status in ('queued', 'running')"),
+                           job_id=job_id, error='abandoned', finished=now)
+    return len(stale)
+
+
+@contextlib.contextmanager
+def get_jobs_connection():
+    """
+    Opens a connection to the Routes database for reading or updating jobs, creating the jobs
+    tables and reclaiming stale jobs (see reclaim_stale_jobs) the first time the database is used
+    by this process, and returns it to the pool afterwards. Jobs are
+    updated from worker threads, so they don't use the connection scoped to the request
+    :return: context manager giving a SQLalchemy Connection object
+    """
+    connection = database_engines.get_engine('waypoints').connect()
+    try:
+        with _TABLES_LOCK:
+            path = database_engines.DATABASE_PATHS['waypoints']
+            if (path, os.getpid()) not in _TABLES_CREATED:
+                create_jobs_tables(connection)
+                reclaim_stale_jobs(connection)
+                _TABLES_CREATED.add((path, os.getpid()))
+        yield connection
+    finally:
+        connection.close()
+
+
+def notify_job_changed():
+    """
+    Wakes up the event streams of this process to look for new job events
+    """
+    with _JOBS_CHANGED:
+        _JOBS_CHANGED.notify_all()
+
+
+def create_job(fear_level, keep_result=False):
+    """
+    Adds a new queued job to the jobs table, forgetting the oldest finished jobs once more than
+    the configured history of them are remembered
+    :param fear_level: int, fear level to show the scored route at
+    :param keep_result: boolean, keep the scored route with the job (see get_job_result), for
+                        routes that aren't stored in the routes catalog
+    :return: string, job id
+    """
+    job_id = uuid.uuid4().hex
+    old_jobs = "select job_id from scoring_jobs where status in ('done', 'failed') " \
+               "order by rowid desc limit -1 offset :history"
+    with get_jobs_connection() as connection, connection.begin():
+        connection.execute(
+            db.text('insert into scoring_jobs (job_id, status, stages, fear_level, created, '
+                    'keep_result, pid) values (:job_id, :status, :stages, :fear_level, '
+                    ':created, :keep_result, :pid)'),
+            job_id=job_id, status='queued', fear_level=fear_level, created=time.time(),
+            stages=json.dumps({x: 'pending' for x in SCORING_STAGES}), keep_result=keep_result,
+            pid=os.getpid())
+        connection.execute(db.text(f'delete from scoring_job_segments where job_id in '
+                                   f'({old_jobs})'), history=JOB_SETTINGS['history'])
+        connection.execute(db.text(f'delete from scoring_jobs where job_id in ({old_jobs})'),
+                           history=JOB_SETTINGS['history'])
+    return job_id
+
+
+def get_job(job_id):
+    """
+    Gets the state of a job, without the route points, segment scores and result
+    :param job_id: string
+    :return: dict, or None if there is no such job
+    """
+    with get_jobs_connection() as connection:
+        row = connection.execute(db.text(f'select {", ".join(JOB_FIELDS)} from scoring_jobs '
+                                         f'where job_id = :job_id'), job_id=job_id).fetchone()
+    if row is None:
+        return None
+    return {**dict(row), 'stages': json.loads(row['stages'])}
+
+
+def get_job_result(job_id):
+    """
+    Gets the scored route of a finished job created with keep_result
+    :param job_id: string
+    :return: pandas Dataframe, with a refined column if the route was scored in two passes, or
+             None if the job isn't done or its result wasn't kept
+    """
+    with get_jobs_connection() as connection:
+        row = connection.execute(db.text('select route, result, refined from scoring_jobs '
+                                         'where job_id = :job_id'), job_id=job_id).fetchone()
+    if row is None or row['result'] is None:
+        return None
+    route = administer_route_database.decode_route_arrays(row['result'])
+    route.insert(0, 'route', row['route'])
+    if row['refined'] is not None:
+        route['refined'] = route.index.isin(json.loads(row['refined']))
+    return route
+
+
+def update_job(job_id, **kwargs):
+    """
+    Updates the state of a job
+    :param job_id: string
+    :param kwargs: job fields to update, or result, the scored route encoded by
+                   administer_route_database.encode_route_arrays, and refined, the json list of
+                   the indices of its refined points if it was scored in two passes
+    """
+    if 'stages' in kwargs:
+        kwargs['stages'] = json.dumps(kwargs['stages'])
+    with get_jobs_connection() as connection:
+        connection.execute(db.text(f'update scoring_jobs set '
+                                   f'{", ".join(f"{x} = :{x}" for x in kwargs)} '
+                                   f'where job_id = :job_id'), job_id=job_id, **kwargs)
+    notify_job_changed()
+
+
+def get_progress_reporter(job_id):
+    """
+    Gets a function for the scoring pipeline to call as it starts each stage, which marks the
+    stage as running and the stages before it as done
+    :param job_id: string
+    :return: function taking a stage name
+    """
+    def report_progress(stage):
+        job = get_job(job_id)
+        if job is None:
+            return
+        for previous_stage in SCORING_STAGES[:SCORING_STAGES.index(stage)]:
+            job['stages'][previous_stage] = 'done'
+        job['stages'][stage] = 'running'
+        update_job(job_id, stage=stage, stages=job['stages'])
+    return report_progress
+
+
+def get_segment_reporter(job_id):
+    """
+    Gets a function for the scoring pipeline to call with the scores of each segment of the route
+    as it is scored, which records the points of the route with the first segment. Two pass
+    scoring (see two_pass_scoring) reports the whole route as provisional, then again with the
+    indices of the points it refined
+    :param job_id: string
+    :return: function taking the route, the index of the first point in the segment, the
+             segment's scores and, optionally, provisional and refined
+    """
+    reported = {'points': False, 'segments': 0}
+
+    def report_segment(route, start, scores, provisional=False, refined=None):
+        segment = {'start': int(start), 'scores': [int(x) for x in scores]}
+        if provisional:
+            segment['provisional'] = True
+        if refined is not None:
+            segment['refined'] = [int(x) for x in refined]
+        with get_jobs_connection() as connection, connection.begin():
+            if not reported['points']:
+                points = {'lat': route['lat'].round(6).tolist(),
+                          'long': route['long'].round(6).tolist()}
+                connection.execute(db.text('update scoring_jobs set points = :points '
+                                           'where job_id = :job_id'),
+                                   job_id=job_id, points=json.dumps(points))
+            connection.execute(db.text('insert into scoring_job_segments (job_id, '
+                                       'segment_index, data) values (:job_id, :segment_index, '
+                                       ':data)'),
+                               job_id=job_id, segment_index=reported['segments'],
+                               data=json.dumps(segment))
+        reported['points'] = True
+        reported['segments'] += 1
+        notify_job_changed()
+    return report_segment
+
+
+def get_new_job_events(job_id, sent):
+    """
+    Gets the events of a job that haven't been sent yet (see get_job_events)
+    :param job_id: string
+    :param sent: dict, the stages, whether the points and how many segments have been sent,
+                 updated with the new events
+    :return: list of tuples, (event name, event data), or None if there is no such job
+    """
+    events = []
+    with get_jobs_connection() as connection:
+        job = connection.execute(db.text('select status, stage, stages, route, error, '
+                                         'points is not null as has_points from scoring_jobs '
+                                         'where job_id = :job_id'), job_id=job_id).fetchone()
+        if job is None:
+            return None
+        stages = json.loads(job['stages'])
+        if stages != sent['stages']:
+            sent['stages'] = stages
+            events.append(('progress', {'stage': job['stage'], 'stages': stages}))
+        segments = connection.execute(
+            db.text('select data from scoring_job_segments where job_id = :job_id and '
+                    'segment_index >= :sent order by segment_index'),
+            job_id=job_id, sent=sent['segments']).fetchall()
+        # The points are stored with the first segment, which may have been scored since the job
+        # was read, and are always sent before it
+        if not sent['points'] and (job['has_points'] or segments):
+            sent['points'] = True
+            points = connection.execute(db.text('select points from scoring_jobs '
+                                                'where job_id = :job_id'), job_id=job_id).scalar()
+            events.append(('points', json.loads(points)))
+    sent['segments'] += len(segments)
+    events.extend(('segment', json.loads(x['data'])) for x in segments)
+    if job['status'] in ['done', 'failed']:
+        events.append((job['status'], {'route': job['route'], 'error': job['error']}))
+    return events
+
+
+def get_job_events(job_id, timeout=15):
+    """
+    Gets the events of a job as they happen, from the start of the job: 'progress' whenever the
+    stage changes, 'points' with the points of the route once the first segment is scored,
+    'segment' for each segment scored, and 'done' or 'failed' when the job finishes. 'keepalive'
+    is given whenever nothing has happened for the timeout
+    :param job_id: string
+    :param timeout: float, seconds
+    :return: generator of tuples, (event name, event data)
+    """
+    sent = {'stages': None, 'points': False, 'segments': 0}
+    last_event = time.monotonic()
+    while True:
+        events = get_new_job_events(job_id, sent)
+        if events is None:
+            return
+        if not events:
+            remaining = last_event + timeout - time.monotonic()
+            if remaining > 0:
+                with _JOBS_CHANGED:
+                    _JOBS_CHANGED.wait(min(remaining, JOB_POLL_SECONDS))
+                continue
+            events.append(('keepalive', None))
+        last_event = time.monotonic()
+        yield from events
+        if events[-1][0] in ['done', 'failed']:
+            return
+
+
+def run_job(job_id, func, *args, **kwargs):
+    """
+    Runs a scoring job, recording whether it finished and the name the scored route is stored
+    under. Routes outside the available altitude data fail with the error 'out_of_bounds'
+    :param job_id: string
+    :param func: function returning a scored route, called with progress and on_segment keyword
+                 arguments
+    :param args: arguments for func
+    :param kwargs: keyword arguments for func
+    """
+    update_job(job_id, status='running', pid=os.getpid())
+    try:
+        with trace('scoring_job', job_id=job_id):
+            route = func(*args, progress=get_progress_reporter(job_id),
+                         on_segment=get_segment_reporter(job_id), **kwargs)
+    except HTTPException as error:
+        update_job(job_id, status='failed', finished=time.time(),
+                   error='out_of_bounds' if error.code == 400 else error.name)
+    except Exception as error:  # pylint: disable=broad-except
+        update_job(job_id, status='failed', finished=time.time(),
+                   error=f'{type(error).__name__}: {error}')
+    else:
+        with get_jobs_connection() as connection:
+            keep_result = connection.execute(db.text('select keep_result from scoring_jobs '
+                                                     'where job_id = :job_id'),
+                                             job_id=job_id).scalar()
+        result = administer_route_database.encode_route_arrays(route) if keep_result else None
+        refined = json.dumps(np.flatnonzero(route['refined']).tolist()) \
+            if keep_result and 'refined' in route else None
+        update_job(job_id, status='done', stage=None, stages={x: 'done' for x in SCORING_STAGES},
+                   route=route['route'].iloc[0], finished=time.time(), result=result,
+                   refined=refined)
+    finally:
+        database_engines.close_scoped_connections()
+
+
+def submit_job(fear_level, func, *args, keep_result=False, **kwargs):
+    """
+    Queues a scoring job on the worker pool
+    :param fear_level: int, fear level to show the scored route at
+    :param func: function returning a scored route, called with progress and on_segment keyword
+                 arguments
+    :param args: arguments for func
+    :param keep_result: boolean, keep the scored route with the job (see get_job_result)
+    :param kwargs: keyword arguments for func
+    :return: string, job id
+    """
+    job_id = create_job(fear_level, keep_result)
+    get_executor().submit(run_job, job_id, func, *args, **kwargs)
+    return job_id
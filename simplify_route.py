@@ -0,0 +1,129 @@
+"""
+Functions to simplify a padded route before it is scored, so that the full scariness calculation
+is only run on the points that need it, and to interpolate the scores back onto the full route
+"""
+
+import numpy as np
+import altitude_schema
+
+EARTH_RADIUS = 6371000
+SIMPLIFY_TOLERANCE = 15
+RELIEF_THRESHOLD = 10
+PRE_CHECK_NEIGHBOURS = 64
+
+
+def project_route_to_metres(route):
+    """
+    Projects the latitude and longitude of each point in a route onto a flat plane in metres,
+    using an equirectangular projection about the mean latitude of the route, or takes its OS
+    grid coordinates if the altitude data is in those
+    :param route: pandas Dataframe with columns lat, long (or northing, easting)
+    :return: numpy array, shape (number of points, 2), x and y in metres
+    """
+    if altitude_schema.is_grid():
+        return route[['easting', 'northing']].to_numpy(dtype=float)
+    lats = np.radians(route['lat'].to_numpy(dtype=float))
+    longs = np.radians(route['long'].to_numpy(dtype=float))
+    x_metres = EARTH_RADIUS * longs * np.cos(lats.mean())
+    y_metres = EARTH_RADIUS * lats
+    return np.column_stack((x_metres, y_metres))
+
+
+def douglas_peucker(points, tolerance):
+    """
+    Simplifies a line using the Douglas-Peucker algorithm, keeping only the points that deviate
+    from the simplified line by more than the tolerance
+    :param points: numpy array, shape (number of points, 2), in metres
+    :param tolerance: float, metres
+    :return: numpy array of booleans, True for each point kept
+    """
+    keep = np.zeros(len(points), dtype=bool)
+    if len(points) == 0:
+        return keep
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        start = points[first]
+        line = points[last] - start
+        offsets = points[first + 1:last] - start
+        line_length = np.linalg.norm(line)
+        if line_length == 0:
+            distances = np.linalg.norm(offsets, axis=1)
+        else:
+            distances = np.abs(line[0] * offsets[:, 1] - line[1] * offsets[:, 0]) / line_length
+        furthest = int(np.argmax(distances))
+        if distances[furthest] > tolerance:
+            index = first + 1 + furthest
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return keep
+
+
+def get_steep_point_mask(route, altitude_df, no_points=PRE_CHECK_NEIGHBOURS,
+                         relief_threshold=RELIEF_THRESHOLD):
+    """
+    Cheap pre-check of the ground around each point in a route. A point is steep if any of its
+    neighbouring altitudes differs from the altitude at the point by more than the relief
+    threshold. With the default threshold a point that is not steep always scores zero in
+    calculate_scariness, as no sector mean can differ from the midpoint by more than 10m
+    :param route: pandas Dataframe with columns lat, long (normalised to the altitude data)
+    :param altitude_df: pandas Dataframe with columns latitude, longitude, altitude
+    :param no_points: int (number of neighbours to check)
+    :param relief_threshold: float, metres
+    :return: numpy array of booleans, True for each steep point
+    """
+    from scipy.spatial import cKDTree  # pylint: disable=import-outside-toplevel
+    no_points = min(no_points, len(altitude_df))
+    tree = cKDTree(altitude_df[altitude_schema.get_coordinates()].to_numpy())
+    _, indices = tree.query(route[altitude_schema.get_route_columns()].to_numpy(), k=no_points)
+    altitudes = altitude_df['altitude'].to_numpy()[np.reshape(indices, (len(route), -1))]
+    midpoints = altitudes[:, :4].mean(axis=1)
+    relief = np.abs(altitudes - midpoints[:, np.newaxis]).max(axis=1)
+    return relief > relief_threshold
+
+
+def get_points_to_score(route, altitude_df, tolerance=SIMPLIFY_TOLERANCE,
+                        relief_threshold=RELIEF_THRESHOLD):
+    """
+    Picks out the points of a route that need the full scariness calculation: the points of the
+    simplified route, plus every point on steep ground and the points either side of it, so that
+    scores interpolated for the remaining points are taken from flat ground
+    :param route: pandas Dataframe with columns lat, long (normalised to the altitude data)
+    :param altitude_df: pandas Dataframe with columns latitude, longitude, altitude
+    :param tolerance: float, Douglas-Peucker tolerance in metres
+    :param relief_threshold: float, metres
+    :return: numpy array of booleans, True for each point to score
+    """
+    to_score = douglas_peucker(project_route_to_metres(route), tolerance)
+    steep = get_steep_point_mask(route, altitude_df, relief_threshold=relief_threshold)
+    to_score[1:] |= steep[:-1]
+    to_score[:-1] |= steep[1:]
+    return to_score | steep
+
+
+def get_route_distances(route):
+    """
+    Gets the cumulative distance along a route to each point, in metres
+    :param route: pandas Dataframe with columns lat, long
+    :return: numpy array
+    """
+    steps = np.linalg.norm(np.diff(project_route_to_metres(route), axis=0), axis=1)
+    return np.concatenate(([0.0], np.cumsum(steps)))
+
+
+def interpolate_scores(distances, scored_mask, scores):
+    """
+    Interpolates scores along the route for the points that were not scored, rounding to the
+    nearest whole score
+    :param distances: numpy array, cumulative distance to each point
+    :param scored_mask: numpy array of booleans, True for each point scored
+    :param scores: array-like, scores of the scored points, in route order
+    :return: numpy array of ints, one score per point
+    """
+    interpolated = np.interp(distances, distances[scored_mask], np.asarray(scores, dtype=float))
+    interpolated[scored_mask] = scores
+    return np.rint(interpolated).astype(int)
@@ -0,0 +1,11 @@
+"""
+Settings applied before any test imports the application: no start up phase, and a throwaway
+Routes database for the tests that don't configure one of their own
+"""
+
+import os
+import tempfile
+
+TEST_DIRECTORY = tempfile.TemporaryDirectory()
+os.environ['WARM_UP'] = 'off'
+os.environ['WAYPOINTS_DATABASE'] = os.path.join(TEST_DIRECTORY.name, 'waypoints.sqlite')
@@ -0,0 +1,69 @@
+"""
+Synthetic test data shared by the test modules: altitude data rising steeply to the east of
+longitude -4.99, a route across the slope, and builders for an altitude database and gpx files
+holding them
+"""
+
+import os
+import tempfile
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+import sqlalchemy as db
+import calculate_scary_points as csp
+import database_engines
+from config import Config
+
+
+def make_altitude_df():
+    lats, longs = np.meshgrid(np.arange(57.0, 57.01, 0.0002), np.arange(-5.0, -4.98, 0.0002))
+    altitudes = np.where(longs > -4.99, 300 + (longs + 4.99) * 60000, 300)
+    return pd.DataFrame({'latitude': lats.ravel(), 'longitude': longs.ravel(),
+                         'altitude': altitudes.ravel()})
+
+
+def make_locations_extremes():
+    altitude_df = make_altitude_df()
+    return pd.DataFrame({'maxlat': [altitude_df['latitude'].max()],
+                         'minlat': [altitude_df['latitude'].min()],
+                         'maxlong': [altitude_df['longitude'].max()],
+                         'minlong': [altitude_df['longitude'].min()]})
+
+
+def make_route():
+    longs = np.linspace(-4.998, -4.982, 81)
+    return pd.DataFrame({'name': '', 'lat': 57.005, 'long': longs,
+                         'elevation': np.where(longs > -4.99, 300 + (longs + 4.99) * 60000, 300)})
+
+
+def make_gpx_data(route):
+    points = ''.join(f'<rtept lat="{x.lat}" lon="{x.long}"><ele>{x.elevation}</ele>'
+                     f'<name>P{i}</name></rtept>' for i, x in enumerate(route.itertuples()))
+    return f'<?xml version="1.0"?><gpx><rte>{points}</rte></gpx>'.encode()
+
+
+@contextmanager
+def altitude_database():
+    """
+    Points the altitude database at a temporary one holding make_altitude_df in the Locations
+    table it falls in, and an empty one to the west, with its extremes saved alongside
+    """
+    old_paths = dict(database_engines.DATABASE_PATHS)
+    old_extremes_file = Config.LOCATIONS_EXTREMES_FILE
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'altitudes.sqlite')
+        engine = db.create_engine(f'sqlite:///{path}')
+        make_altitude_df().to_sql('locations43', engine, index=False)
+        make_altitude_df().iloc[:0].to_sql('locations42', engine, index=False)
+        engine.dispose()
+        database_engines.configure_database('altitudes', path)
+        Config.LOCATIONS_EXTREMES_FILE = os.path.join(directory, 'extremes.pkl')
+        make_locations_extremes().to_pickle(Config.LOCATIONS_EXTREMES_FILE)
+        csp.get_locations_extremes.cache_clear()
+        try:
+            yield
+        finally:
+            Config.LOCATIONS_EXTREMES_FILE = old_extremes_file
+            csp.get_locations_extremes.cache_clear()
+            for database, old_path in old_paths.items():
+                database_engines.configure_database(database, old_path)
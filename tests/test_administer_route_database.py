@@ -4,6 +4,9 @@ import sqlalchemy as db
 from collections import Counter
 import get_folium_route_map
 import pandas as pd
+import datetime as dt
+import os
+import tempfile
 
 
 class MyTestCase(unittest.TestCase):
@@ -67,6 +70,70 @@ class MyTestCase(unittest.TestCase):
         self.assertIsInstance(result, list)
         self.assertEqual(Counter(set(result)), Counter(result))
 
+    def test_encode_decode_route_arrays(self):
+        route_df = pd.DataFrame({'lat': [56.1, 56.2], 'long': [-5.1, -5.2],
+                                 'elevation': [300.5, 310.0], 'scariness': [0, 7]})
+        result = ard.decode_route_arrays(ard.encode_route_arrays(route_df))
+        self.assertEqual(list(result), ['waypoint', 'lat', 'long', 'elevation', 'scariness'])
+        self.assertEqual(list(result['waypoint']), ['WP0001', 'WP0002'])
+        for col in list(route_df):
+            self.assertTrue(route_df[col].equals(result[col]), msg=f'{col} does not match')
+
+    def test_get_route_content_hash(self):
+        route_df = pd.DataFrame({'lat': [56.1, 56.2], 'long': [-5.1, -5.2],
+                                 'elevation': [300.5, 310.0]})
+        moved = route_df.assign(lat=route_df['lat'] + 0.001)
+        self.assertEqual(ard.get_route_content_hash(route_df),
+                         ard.get_route_content_hash(route_df + 1e-9))
+        self.assertNotEqual(ard.get_route_content_hash(route_df),
+                            ard.get_route_content_hash(moved))
+
+    def test_store_route_in_routes_table(self):
+        route_df = pd.DataFrame({'waypoint': ['WP0001', 'WP0002'], 'lat': [56.1, 56.2],
+                                 'long': [-5.1, -5.2], 'elevation': [300.5, 310.0],
+                                 'scariness': [0, 7], 'route': 'testroute',
+                                 'created_dt': dt.datetime(2021, 9, 1)})
+        with tempfile.TemporaryDirectory() as directory:
+            engine = db.create_engine(f'sqlite:///{os.path.join(directory, "w.sqlite")}')
+            with engine.connect() as connection:
+                self.assertEqual(ard.get_loaded_routes(connection), ['None'])
+                ard.store_route(route_df, connection, 'abc', '1', store_waypoints=False)
+                ard.store_route(route_df, connection, 'abc', '1', store_waypoints=False)
+                self.assertEqual(ard.get_loaded_routes(connection), ['testroute'])
+                # The replaced route's id isn't reused, even though it was the highest
+                self.assertEqual(ard.get_route_catalog_entry(connection, 'testroute')['route_id'],
+                                 2)
+                self.assertFalse(db.inspect(connection).has_table('waypoints'))
+                table_df = ard.get_route_from_db(connection, 'testroute')
+                self.assertEqual(Counter(list(table_df)),
+                                 Counter(['route', 'waypoint', 'lat', 'long', 'elevation',
+                                          'scariness', 'created_dt']))
+                for col in list(route_df):
+                    self.assertTrue(route_df[col].equals(table_df[col]), msg=f'{col} is wrong')
+            engine.dispose()
+
+    def test_get_stored_route_name(self):
+        route_df = pd.DataFrame({'waypoint': ['WP0001'], 'lat': [56.1], 'long': [-5.1],
+                                 'elevation': [300.5], 'scariness': [0], 'route': 'testroute',
+                                 'created_dt': dt.datetime(2021, 9, 1)})
+        with tempfile.TemporaryDirectory() as directory:
+            engine = db.create_engine(f'sqlite:///{os.path.join(directory, "w.sqlite")}')
+            with engine.connect() as connection:
+                self.assertIsNone(ard.get_stored_route_name(connection, 'abc', '1'))
+                self.assertEqual(ard.get_unique_route_name(connection, 'testroute', 'abc'),
+                                 'testroute')
+                ard.store_route(route_df, connection, 'abc', '1', store_waypoints=False)
+                self.assertEqual(ard.get_stored_route_name(connection, 'abc', '1'), 'testroute')
+                self.assertIsNone(ard.get_stored_route_name(connection, 'abc', '2'))
+                self.assertIsNone(ard.get_stored_route_name(connection, 'def', '1'))
+                self.assertEqual(ard.get_stored_content_hashes(connection, '1'),
+                                 {'abc': 'testroute'})
+                self.assertEqual(ard.get_unique_route_name(connection, 'testroute', 'abc'),
+                                 'testroute')
+                self.assertEqual(ard.get_unique_route_name(connection, 'testroute', 'def'),
+                                 'testroute-2')
+            engine.dispose()
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,153 @@
+import unittest
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+import sqlalchemy as db
+import altitude_schema
+import calculate_scary_points as csp
+import database_engines
+from get_db_table import get_tables
+import read_contour_data as contour
+import read_gpx
+import reference_equivalence as equivalence
+from synthetic_data import make_altitude_df, make_route
+
+
+class MyTestCase(unittest.TestCase):
+    def test_round_trip(self):
+        locations_df = pd.DataFrame({'latitude': [56.79686712, 56.1], 'longitude': [-5.00336, -4.2],
+                                     'altitude': [1344.56, 12.0]})
+        encoded = altitude_schema.encode_locations(locations_df, 'compact')
+        self.assertEqual(list(encoded.columns), ['lat_e7', 'long_e7', 'altitude_dm'])
+        decoded = altitude_schema.decode_locations(encoded, 'compact')
+        self.assertLessEqual(np.abs(decoded[['latitude', 'longitude']].to_numpy()
+                                    - locations_df[['latitude', 'longitude']].to_numpy()).max(),
+                             0.5 / altitude_schema.COORDINATE_SCALE)
+        self.assertLessEqual(np.abs(decoded['altitude'] - locations_df['altitude']).max(),
+                             0.5 / altitude_schema.ALTITUDE_SCALE)
+
+    def test_get_column_condition(self):
+        self.assertEqual(altitude_schema.get_column_condition('latitude', '>=', 56.5, 'float'),
+                         'latitude >= 56.5')
+        self.assertEqual(altitude_schema.get_column_condition('longitude', '<', -5, 'compact'),
+                         'long_e7 < -50000000.0')
+        with self.assertRaises(ValueError):
+            altitude_schema.get_schema('double')
+        with self.assertRaises(ValueError):
+            altitude_schema.get_coordinates('utm')
+
+    def test_create_compact_table(self):
+        engine = db.create_engine('sqlite://')
+        with engine.connect() as connection:
+            table = altitude_schema.create_locations_table(connection, 'locations', 'compact')
+            sql = connection.execute("select sql from sqlite_master where name = 'locations'"
+                                     ).scalar()
+        engine.dispose()
+        self.assertEqual(altitude_schema.get_table_schema(table), 'compact')
+        self.assertIn('WITHOUT ROWID', sql)
+
+    def test_split_grid_locations(self):
+        rows = pd.DataFrame({'northing': 770000.0, 'easting': np.arange(214000, 221000, 12.5),
+                             'altitude': 300.0})
+        engine = db.create_engine('sqlite://')
+        with engine.connect() as connection:
+            locations = altitude_schema.create_locations_table(connection, 'locations',
+                                                               'compact', 'grid')
+            connection.execute(db.insert(locations), altitude_schema.encode_location_rows(
+                rows.to_dict('records'), locations))
+            old_settings = dict(altitude_schema.SCHEMA_SETTINGS)
+            altitude_schema.SCHEMA_SETTINGS.update(schema='compact', coordinates='grid')
+            try:
+                tables = altitude_schema.split_grid_locations(connection)
+                band = altitude_schema.read_locations(connection, 'locations_grid43')
+            finally:
+                altitude_schema.SCHEMA_SETTINGS.update(old_settings)
+        engine.dispose()
+        self.assertEqual(list(locations.c.keys()), ['northing_dm', 'easting_dm', 'altitude_dm'])
+        self.assertEqual(tables, ['locations_grid42', 'locations_grid43', 'locations_grid44'])
+        self.assertEqual(list(band.columns), ['northing', 'easting', 'altitude'])
+        self.assertEqual((band['easting'].min(), band['easting'].max()), (215000, 219987.5))
+
+    def test_split_longitude_locations(self):
+        longitudes = np.round(np.arange(-5.06, -4.94, 0.005), 3)
+        rows = pd.DataFrame({'latitude': 57.0, 'longitude': longitudes, 'altitude': 300.0})
+        engine = db.create_engine('sqlite://')
+        with engine.connect() as connection:
+            locations = altitude_schema.create_locations_table(connection, 'locations', 'compact')
+            connection.execute(db.insert(locations), altitude_schema.encode_location_rows(
+                rows.to_dict('records'), locations))
+            tables = altitude_schema.split_longitude_locations(connection, 'compact')
+            sql = connection.execute("select sql from sqlite_master where name = 'locations42'"
+                                     ).scalar()
+            split = {x: altitude_schema.read_locations(connection, x, schema='compact')
+                     for x in tables}
+        engine.dispose()
+        self.assertEqual(tables, ['locations41', 'locations42', 'locations43', 'locations44'])
+        self.assertIn('WITHOUT ROWID', sql)
+        self.assertIn('PRIMARY KEY (lat_e7, long_e7)', sql)
+        self.assertEqual(sum(len(x) for x in split.values()), len(rows))
+        for table, table_df in split.items():
+            for longitude in table_df['longitude']:
+                self.assertEqual(get_tables(longitude, longitude), {table})
+
+    def test_compact_insert_matches_reference(self):
+        def insert_compact(altitude_df, grid_ref_initials, connection, table):
+            compact = altitude_schema.create_locations_table(connection, 'compact', 'compact')
+            contour.insert_coords_into_db_table(altitude_df, grid_ref_initials, connection,
+                                                compact)
+        equivalence.register_engine(
+            'insert_coords_into_db_table', 'compact', insert_compact,
+            {'coordinate_error': 1 / altitude_schema.COORDINATE_SCALE,
+             'altitude_error': 1 / altitude_schema.ALTITUDE_SCALE},
+            lambda x: altitude_schema.read_locations(x, 'compact', schema='compact'))
+        try:
+            result = equivalence.check_engine('insert_coords_into_db_table', 'compact',
+                                              equivalence.make_inputs(seeds=1, tile_cells=8))
+        finally:
+            del equivalence.ENGINES['insert_coords_into_db_table']['compact']
+        self.assertTrue(result['passed'], result)
+
+    def test_migrate_and_fetch(self):
+        old_paths = dict(database_engines.DATABASE_PATHS)
+        old_schema = altitude_schema.SCHEMA_SETTINGS['schema']
+        route = make_route()
+        route_bounds = read_gpx.get_route_bounds(route)
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, 'altitudes.sqlite')
+            target = os.path.join(directory, 'compact.sqlite')
+            engine = db.create_engine(f'sqlite:///{source}')
+            with engine.connect() as connection:
+                for table in ['locations', 'locations42', 'locations43']:
+                    locations = altitude_schema.create_locations_table(connection, table,
+                                                                       'float')
+                    rows = make_altitude_df().to_dict('records') if table != 'locations42' else []
+                    if rows:
+                        connection.execute(db.insert(locations), rows)
+            engine.dispose()
+            summaries = altitude_schema.migrate_database(source, target)
+            try:
+                database_engines.configure_database('altitudes', source)
+                expected = csp.get_complete_route_altitude_df(route_bounds)
+                altitude_schema.SCHEMA_SETTINGS['schema'] = 'compact'
+                database_engines.configure_database('altitudes', target)
+                result = csp.get_complete_route_altitude_df(route_bounds)
+                extremes = csp.get_altitudes_max_and_min_lat_and_long()
+                version = csp.get_scoring_version()
+            finally:
+                altitude_schema.SCHEMA_SETTINGS['schema'] = old_schema
+                for database, path in old_paths.items():
+                    database_engines.configure_database(database, path)
+            with self.assertRaises(FileExistsError):
+                altitude_schema.migrate_database(source, target)
+            self.assertLess(os.path.getsize(target), os.path.getsize(source))
+        self.assertEqual([x['rows_written'] for x in summaries],
+                         [len(make_altitude_df()), 0, len(make_altitude_df())])
+        self.assertEqual(len(result), len(expected))
+        np.testing.assert_allclose(result.to_numpy(), expected.to_numpy(), atol=0.05)
+        self.assertAlmostEqual(extremes['maxlat'].iloc[0], make_altitude_df()['latitude'].max())
+        self.assertEqual(version, f'{csp.SCORING_VERSION}-compact')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+import unittest
+import datetime as dt
+import gzip
+import json
+import os
+import struct
+import tempfile
+import numpy as np
+import pandas as pd
+import administer_route_database as ard
+import database_engines
+import scoring_jobs
+from app import app
+
+
+class MyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.old_paths = dict(database_engines.DATABASE_PATHS)
+        database_engines.configure_database(
+            'waypoints', os.path.join(self.directory.name, 'waypoints.sqlite'))
+        self.route_df = pd.DataFrame({'waypoint': ['WP0001', 'WP0002'], 'lat': [56.1, 56.2],
+                                      'long': [-5.1, -5.2], 'elevation': [300.5, 310.0],
+                                      'scariness': [0, 7], 'route': 'testroute',
+                                      'created_dt': dt.datetime(2021, 9, 1)})
+        with app.app_context():
+            ard.store_route(self.route_df, ard.get_route_db_connection(), 'abc', '1',
+                            store_waypoints=False)
+        self.client = app.test_client()
+
+    def tearDown(self):
+        for database, path in self.old_paths.items():
+            database_engines.configure_database(database, path)
+        self.directory.cleanup()
+
+    def test_api_routes(self):
+        response = self.client.get('/api/routes')
+        self.assertEqual(response.status_code, 200)
+        result = response.get_json()
+        self.assertEqual([x['name'] for x in result], ['testroute'])
+        self.assertEqual(result[0]['max_scariness'], 7)
+
+    def test_api_route_json(self):
+        response = self.client.get('/api/routes/testroute')
+        self.assertEqual(response.status_code, 200)
+        result = response.get_json()
+        self.assertEqual(result['lat'], [56.1, 56.2])
+        self.assertEqual(result['scariness'], [0, 7])
+        self.assertEqual(result['scoring_version'], '1')
+        self.assertIsNotNone(response.get_etag()[0])
+
+    def test_api_route_binary(self):
+        response = self.client.get('/api/routes/testroute?format=binary')
+        self.assertEqual(response.status_code, 200)
+        magic, point_count = struct.unpack_from('<4sI', response.data)
+        self.assertEqual((magic, point_count), (b'MFF1', 2))
+        lat = np.frombuffer(response.data, dtype='<f8', count=2, offset=8)
+        scariness = np.frombuffer(response.data, dtype='u1', count=2, offset=8 + 2 * 3 * 8)
+        self.assertEqual(list(lat), [56.1, 56.2])
+        self.assertEqual(list(scariness), [0, 7])
+
+    def test_api_route_conditional_get(self):
+        etag = self.client.get('/api/routes/testroute').get_etag()[0]
+        response = self.client.get('/api/routes/testroute', headers={'If-None-Match': f'"{etag}"'})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+        with app.app_context():
+            ard.store_route(self.route_df.assign(scariness=[1, 8]), ard.get_route_db_connection(),
+                            'abd', '1', store_waypoints=False)
+        response = self.client.get('/api/routes/testroute', headers={'If-None-Match': f'"{etag}"'})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.get_etag()[0], etag)
+
+    def test_api_route_gzip(self):
+        route_df = pd.DataFrame({'lat': np.linspace(56, 57, 200), 'long': np.linspace(-5, -4, 200),
+                                 'elevation': np.linspace(300, 900, 200), 'scariness': 3,
+                                 'route': 'longroute', 'created_dt': dt.datetime(2021, 9, 1)})
+        with app.app_context():
+            ard.store_route(route_df, ard.get_route_db_connection(), 'xyz', '1',
+                            store_waypoints=False)
+        response = self.client.get('/api/routes/longroute', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        result = json.loads(gzip.decompress(response.data))
+        self.assertEqual(len(result['lat']), 200)
+        plain = self.client.get('/api/routes/longroute')
+        self.assertNotIn('Content-Encoding', plain.headers)
+        self.assertNotEqual(plain.get_etag()[0], response.get_etag()[0])
+
+    def test_api_route_not_found(self):
+        self.assertEqual(self.client.get('/api/routes/missing').status_code, 404)
+        response = self.client.get('/api/routes/testroute?format=xml')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('error', response.get_json())
+
+    def test_api_job(self):
+        job_id = scoring_jobs.create_job(2)
+        scoring_jobs.get_progress_reporter(job_id)('fetch')
+        response = self.client.get(f'/api/jobs/{job_id}')
+        self.assertEqual(response.status_code, 200)
+        result = response.get_json()
+        self.assertEqual(result['stage'], 'fetch')
+        self.assertEqual(result['stages']['read'], 'done')
+        self.assertEqual(self.client.get('/api/jobs/missing').status_code, 404)
+
+    def test_job_page(self):
+        job_id = scoring_jobs.create_job(2)
+        response = self.client.get(f'/jobs/{job_id}')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'stage-fetch', response.data)
+
+    def test_api_job_events(self):
+        job_id = scoring_jobs.create_job(2)
+        scoring_jobs.get_segment_reporter(job_id)(self.route_df, 0, [0, 7])
+        scoring_jobs.update_job(job_id, status='done', route='testroute')
+        response = self.client.get(f'/api/jobs/{job_id}/events')
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        body = response.get_data(as_text=True)
+        self.assertIn('event: segment\ndata: {"start":0,"scores":[0,7]}\n\n', body)
+        self.assertTrue(body.endswith('event: done\ndata: {"route":"testroute","error":null}\n\n'))
+        self.assertEqual(self.client.get('/api/jobs/missing/events').status_code, 404)
+
+    def test_metrics(self):
+        self.client.get('/api/routes')
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/plain')
+        self.assertIn('mountain_fear_finder_stage_seconds_count{stage="request:api_routes"}',
+                      response.get_data(as_text=True))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import unittest
+import contextlib
+import io
+import json
+import os
+import tempfile
+from unittest import mock
+import pandas as pd
+import batch_score_routes as bsr
+import calculate_scary_points as csp
+import database_engines
+import read_gpx
+from memory_accounting import MemoryBudgetExceededError
+from synthetic_data import make_altitude_df, make_route, make_gpx_data, altitude_database
+
+
+class MyTestCase(unittest.TestCase):
+    def test_get_route_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for name in ['b.gpx', 'a.gpx', 'c.txt']:
+                open(os.path.join(directory, name), 'w').close()
+            result = bsr.get_route_files([directory, os.path.join(directory, '*.gpx')])
+            self.assertEqual([os.path.basename(x) for x in result], ['a.gpx', 'b.gpx'])
+
+    def test_group_overlapping_routes(self):
+        route_bounds = {'a': [56.80, -5.00, 56.78, -5.02],
+                        'b': [56.81, -4.99, 56.79, -5.01],
+                        'c': [57.50, -4.00, 57.48, -4.02]}
+        result = bsr.group_overlapping_routes(route_bounds)
+        self.assertEqual(sorted(sorted(x) for x in result), [['a', 'b'], ['c']])
+        self.assertEqual(len(bsr.group_overlapping_routes(route_bounds, max_window=0.01)), 3)
+
+    def test_get_route_window(self):
+        altitudes_df = pd.DataFrame({'latitude': [56.0, 56.5, 57.0],
+                                     'longitude': [-5.0, -5.0, -5.0],
+                                     'altitude': [1, 2, 3]})
+        result = csp.get_route_window(altitudes_df, [56.51, -4.99, 56.49, -5.01])
+        self.assertEqual(list(result['altitude']), [2])
+
+    def test_get_route_summary(self):
+        route = pd.DataFrame({'scariness': [0, 2, 7]})
+        result = bsr.get_route_summary('data/bennevis.gpx', route, 1.23456)
+        self.assertEqual(result, {'route': 'bennevis', 'file': 'data/bennevis.gpx',
+                                  'status': 'scored', 'points': 3, 'max_scariness': 7,
+                                  'mean_scariness': 3.0, 'seconds': 1.235})
+        self.assertEqual(bsr.get_route_summary('x.gpx', None, 0)['status'], 'out_of_bounds')
+
+    def test_score_route_group_in_segments(self):
+        old_settings = dict(csp.SEGMENT_SETTINGS)
+        routes = {'a.gpx': make_route(), 'b.gpx': make_route().iloc[::-1]}
+        expected = csp.calculate_route_scariness(read_gpx.pad_gpx_dataframe(make_route()),
+                                                 make_altitude_df())
+        with altitude_database():
+            csp.SEGMENT_SETTINGS['rows'] = 4000
+            try:
+                with mock.patch.object(csp, 'calculate_windowed_route_scariness',
+                                       wraps=csp.calculate_windowed_route_scariness) as windowed:
+                    results = bsr.score_route_group({x: y.copy() for x, y in routes.items()})
+            finally:
+                csp.SEGMENT_SETTINGS.update(old_settings)
+        self.assertEqual(windowed.call_count, 2)
+        self.assertEqual([x[0] for x in results], ['a.gpx', 'b.gpx'])
+        self.assertEqual(list(results[0][1]['scariness']), list(expected['scariness']))
+
+    def test_score_route_group_memory_budget(self):
+        old_settings = dict(csp.SEGMENT_SETTINGS)
+        expected = csp.calculate_route_scariness(read_gpx.pad_gpx_dataframe(make_route()),
+                                                 make_altitude_df())
+        with altitude_database():
+            csp.SEGMENT_SETTINGS['rows'] = 0
+            try:
+                fitted = bsr.score_route_group({'a.gpx': make_route()}, max_rows=4000)
+                rejected = bsr.score_route_group({'a.gpx': make_route()}, max_rows=10)
+            finally:
+                csp.SEGMENT_SETTINGS.update(old_settings)
+        self.assertEqual(list(fitted[0][1]['scariness']), list(expected['scariness']))
+        self.assertIsInstance(rejected[0][1], MemoryBudgetExceededError)
+
+    def test_main_reports_corrupt_file(self):
+        old_path = database_engines.DATABASE_PATHS['waypoints']
+        output = io.StringIO()
+        with tempfile.TemporaryDirectory() as directory, altitude_database():
+            database_engines.configure_database('waypoints',
+                                                os.path.join(directory, 'waypoints.sqlite'))
+            route = make_route()
+            with open(os.path.join(directory, 'a.gpx'), 'wb') as gpx_file:
+                gpx_file.write(make_gpx_data(route))
+            with open(os.path.join(directory, 'b.gpx'), 'wb') as gpx_file:
+                gpx_file.write(b'<gpx><rte><rtept lat="57.0"')
+            with open(os.path.join(directory, 'c.gpx'), 'wb') as gpx_file:
+                gpx_file.write(make_gpx_data(route.iloc[::-1]))
+            try:
+                with contextlib.redirect_stdout(output):
+                    bsr.main([directory, '--workers', '2', '--no-simplify'])
+            finally:
+                database_engines.configure_database('waypoints', old_path)
+        summaries = {x['route']: x for x in map(json.loads, output.getvalue().splitlines())}
+        self.assertEqual(sorted(summaries), ['a', 'b', 'c'])
+        self.assertEqual(summaries['a']['status'], 'scored')
+        self.assertEqual(summaries['c']['status'], 'scored')
+        self.assertEqual(summaries['b']['status'], 'error')
+        self.assertTrue(summaries['b']['file'].endswith('b.gpx'))
+        self.assertIn('ParseError', summaries['b']['error'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+import unittest
+import numpy as np
+import benchmark_pipeline as bp
+
+
+class MyTestCase(unittest.TestCase):
+    def test_make_terrain(self):
+        result = bp.make_terrain(10, seed=1)
+        self.assertEqual(result.shape, (10, 10))
+        self.assertTrue(np.array_equal(result, bp.make_terrain(10, seed=1)))
+        self.assertFalse(np.array_equal(result, bp.make_terrain(10, seed=2)))
+
+    def test_run_benchmark(self):
+        result = bp.run_benchmark(10, 8, repeat=1)
+        self.assertEqual(list(result['stages']), bp.STAGES)
+        self.assertEqual(result['sizes']['padded_cells'], 37 * 37)
+        self.assertEqual(result['sizes']['window_rows'], 37 * 37)
+        self.assertEqual(result['sizes']['route_points'], 8)
+        self.assertTrue(all(x['min_seconds'] > 0 for x in result['stages'].values()))
+
+    def test_compare_with_baseline(self):
+        baseline = {'parameters': {'tile_cells': 10}, 'stages': {
+            'fetch': {'min_seconds': 1.0}, 'score': {'min_seconds': 1.0}}}
+        results = {'parameters': {'tile_cells': 10}, 'stages': {
+            'fetch': {'min_seconds': 1.1}, 'score': {'min_seconds': 2.0}}}
+        self.assertEqual(bp.compare_with_baseline(results, baseline, 0.25),
+                         [{'stage': 'score', 'baseline_seconds': 1.0, 'seconds': 2.0,
+                           'slowdown': 2.0}])
+        with self.assertRaises(ValueError):
+            bp.compare_with_baseline(dict(results, parameters={'tile_cells': 20}), baseline)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,62 @@
 import unittest
+import os
+from contextlib import contextmanager
+import tempfile
+import numpy as np
 import pandas as pd
+import sqlalchemy as db
+from OSGridConverter import grid2latlong
+import altitude_schema
 import calculate_scary_points as csp
+import database_engines
 import read_gpx
 import datetime as dt
+from memory_accounting import MemoryBudgetExceededError
+from synthetic_data import make_altitude_df, make_route, altitude_database
+
+
+@contextmanager
+def grid_altitude_database():
+    """
+    Stores altitude data in OS grid coordinates, flat to the west of easting 220000 and rising
+    steeply to the east of it, and points the altitude database at it
+    """
+    old_paths = dict(database_engines.DATABASE_PATHS)
+    old_coordinates = altitude_schema.SCHEMA_SETTINGS['coordinates']
+    northings, eastings = np.meshgrid(np.arange(770000, 771000, 12.5),
+                                      np.arange(219000, 221000, 12.5))
+    rows = pd.DataFrame({'northing': northings.ravel(), 'easting': eastings.ravel(),
+                         'altitude': 300 + np.maximum(eastings.ravel() - 220000, 0)})
+    altitude_schema.SCHEMA_SETTINGS['coordinates'] = 'grid'
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'altitudes.sqlite')
+        engine = db.create_engine(f'sqlite:///{path}')
+        with engine.connect() as connection:
+            locations = altitude_schema.create_locations_table(connection)
+            connection.execute(db.insert(locations), rows.to_dict('records'))
+            altitude_schema.split_grid_locations(connection)
+        engine.dispose()
+        database_engines.configure_database('altitudes', path)
+        try:
+            yield
+        finally:
+            altitude_schema.SCHEMA_SETTINGS['coordinates'] = old_coordinates
+            for database, old_path in old_paths.items():
+                database_engines.configure_database(database, old_path)
+
+
+def make_grid_route():
+    """
+    Makes a route heading east north east from the flat ground onto the slope, at an angle to
+    the rows and columns of the altitude data so no two of its neighbours tie
+    """
+    eastings = np.arange(219203, 220720, 37)
+    northings = 770103 + 11 * np.arange(len(eastings))
+    locations = [grid2latlong(f'NN {x - 200000} {y - 700000}', tag='OSGB36')
+                 for x, y in zip(eastings, northings)]
+    return pd.DataFrame({'name': '', 'lat': [x.latitude for x in locations],
+                         'long': [x.longitude for x in locations],
+                         'elevation': 300.0 + np.maximum(eastings - 220000, 0)})
 
 
 class TestCalculateScaryPoints(unittest.TestCase):
@@ -32,6 +86,19 @@ class TestCalculateScaryPoints(unittest.TestCase):
         self.assertEqual(len(result), 16)
         # csp.plot_route_on_altitudes_df(point, result, 'poo') # Uncomment to view plot
 
+    def test_get_neighbouring_points_ties(self):
+        grid = np.arange(5) / 4
+        altitudes_df = pd.DataFrame({'latitude': np.repeat(56 + grid, 5),
+                                     'longitude': np.tile(-5 + grid, 5), 'altitude': 100})
+        point = pd.Series({'lat': 56.5, 'long': -4.5})
+        result = csp.get_neighbouring_points(point, altitudes_df, 3)
+        shuffled = csp.get_neighbouring_points(point, altitudes_df.sample(frac=1, random_state=1),
+                                               3)
+        # The four points next to the middle one tie, so the choice of two of them has to come
+        # from their coordinates rather than the order the altitude data was fetched in
+        self.assertEqual(result.index.tolist(), shuffled.index.tolist())
+        self.assertEqual(result.index.tolist(), [12, 7, 11])
+
     def test_plot_route_on_altitudes_df(self):
         """
         Sanity check to ensure that the route and the altitudes_df are matching up
@@ -142,6 +209,171 @@ class TestCalculateScaryPoints(unittest.TestCase):
         rb5 = [1, 1, 1, 1]
         self.assertFalse(csp.check_route_bounds_fit_location_data(rb5))
 
+    def test_score_route_segments(self):
+        altitude_df = make_altitude_df()
+        for simplify in [False, True]:
+            expected = csp.calculate_route_scariness(make_route(), altitude_df, simplify=simplify)
+            segments = list(csp.score_route_segments(make_route(), altitude_df, simplify=simplify,
+                                                     segment_points=7))
+            self.assertGreater(len(segments), 1)
+            self.assertEqual([x[0] for x in segments],
+                             list(pd.Series([len(x[1]) for x in segments]).cumsum().shift(
+                                 fill_value=0)))
+            self.assertEqual([int(y) for x in segments for y in x[1]],
+                             list(expected['scariness']))
+
+    def test_calculate_route_scariness_by_segment(self):
+        reported = []
+        result = csp.calculate_route_scariness_by_segment(
+            make_route(), make_altitude_df(), lambda route, start, scores: reported.append(start))
+        expected = csp.calculate_route_scariness(make_route(), make_altitude_df())
+        self.assertEqual(list(result['scariness']), list(expected['scariness']))
+        self.assertEqual(reported, list(range(0, len(result), csp.SEGMENT_POINTS)))
+
+    def test_get_route_corridor(self):
+        altitude_df, route = make_altitude_df(), make_route()
+        corridor = csp.get_route_corridor(route, 200)
+        window = csp.get_route_window(altitude_df, read_gpx.get_route_bounds(route), corridor)
+        near = altitude_df.loc[(abs(altitude_df['latitude'] - 57.005) * 111320 <= 200)
+                               & (altitude_df['longitude'] >= -4.998)
+                               & (altitude_df['longitude'] <= -4.982)]
+        self.assertEqual(len(near.merge(window)), len(near))
+        self.assertLess(len(window), len(altitude_df) * 0.8)
+        self.assertLess(csp.get_corridor_area(None, corridor),
+                        csp.get_window_area(read_gpx.get_route_bounds(route)))
+        for index, box in enumerate(corridor):
+            for other in corridor[index + 1:]:
+                self.assertTrue(box[0] <= other[2] or other[0] <= box[2]
+                                or box[1] <= other[3] or other[1] <= box[3])
+
+    def test_corridor_fetch(self):
+        old_settings = dict(csp.FETCH_SETTINGS)
+        with altitude_database():
+            route = make_route()
+            route_bounds = read_gpx.get_route_bounds(route)
+            altitude_df = csp.get_complete_route_altitude_df(route_bounds)
+            expected = csp.calculate_route_scariness(route.copy(), altitude_df)['scariness']
+            csp.FETCH_SETTINGS.update(mode='corridor', distance=200)
+            try:
+                corridor = csp.get_fetch_corridor(route)
+                corridor_df = csp.get_complete_route_altitude_df(route_bounds, corridor)
+                rows = csp.count_route_altitude_rows(route_bounds, corridor)
+                result = csp.calculate_route_scariness(route.copy(), corridor_df)['scariness']
+                version = csp.get_scoring_version(simplify=True)
+            finally:
+                csp.FETCH_SETTINGS.update(old_settings)
+        self.assertEqual(rows, len(corridor_df))
+        self.assertEqual(len(corridor_df), len(csp.get_route_window(altitude_df, route_bounds,
+                                                                    corridor)))
+        self.assertLess(len(corridor_df), len(altitude_df))
+        self.assertEqual(list(result), list(expected))
+        self.assertEqual(version, f'{csp.SCORING_VERSION}-corridor200-simplified')
+
+    def test_long_corridor_fetch(self):
+        old_settings = dict(csp.FETCH_SETTINGS)
+        route = pd.DataFrame({'name': '', 'lat': np.linspace(57.0005, 57.0095, 40),
+                              'long': np.linspace(-4.9995, -4.9805, 40), 'elevation': 300.0})
+        route_bounds = read_gpx.get_route_bounds(route)
+        with altitude_database():
+            altitude_df = csp.get_complete_route_altitude_df(route_bounds)
+            csp.FETCH_SETTINGS.update(mode='corridor', distance=1)
+            try:
+                corridor = csp.get_fetch_corridor(route)
+                corridor_df = csp.get_complete_route_altitude_df(route_bounds, corridor)
+                rows = csp.count_route_altitude_rows(route_bounds, corridor)
+            finally:
+                csp.FETCH_SETTINGS.update(old_settings)
+        expected = csp.get_route_window(altitude_df, route_bounds, corridor)
+        self.assertGreater(len(corridor), 1000)
+        self.assertGreater(len(corridor_df), 0)
+        self.assertEqual(rows, len(corridor_df))
+        pd.testing.assert_frame_equal(
+            corridor_df.sort_values(['latitude', 'longitude'], ignore_index=True),
+            expected.sort_values(['latitude', 'longitude'], ignore_index=True))
+
+    def test_split_route_into_segments(self):
+        self.assertEqual(csp.split_route_into_segments([(0, 30), (30, 60), (60, 70)], 70, 5),
+                         [(0, 35, 0, 30), (25, 65, 30, 60), (55, 70, 60, 70)])
+
+    def test_segmented_route_scariness(self):
+        with altitude_database():
+            route = make_route()
+            altitude_df = csp.get_complete_route_altitude_df(read_gpx.get_route_bounds(route))
+            for simplify in [False, True]:
+                expected = csp.calculate_route_scariness(route.copy(), altitude_df,
+                                                         simplify=simplify)['scariness']
+                for workers in [1, 2]:
+                    starts = []
+                    result = csp.calculate_windowed_route_scariness(
+                        route.copy(), 4000, lambda _, start, scores: starts.append(start),
+                        simplify=simplify, workers=workers)
+                    self.assertGreater(len(starts), 2)
+                    self.assertEqual(starts, sorted(starts))
+                    self.assertEqual(list(result['scariness']), list(expected))
+
+    def test_windowed_corridor_point_budget(self):
+        old_settings = dict(csp.FETCH_SETTINGS)
+        with altitude_database():
+            route = make_route()
+            route_bounds = read_gpx.get_route_bounds(route)
+            csp.FETCH_SETTINGS.update(mode='corridor', distance=200)
+            try:
+                corridor = csp.get_fetch_corridor(route)
+                corridor_df = csp.get_complete_route_altitude_df(route_bounds, corridor)
+                expected = csp.calculate_route_scariness(route.copy(), corridor_df)['scariness']
+                rows_per_square_degree = csp.count_route_altitude_rows(
+                    route_bounds, corridor) / csp.get_corridor_area(route_bounds, corridor)
+                point_rows = csp.get_point_area(route) * rows_per_square_degree
+                result = csp.calculate_windowed_route_scariness(route.copy(), 3000)['scariness']
+                with self.assertRaises(MemoryBudgetExceededError):
+                    csp.calculate_windowed_route_scariness(route.copy(), int(point_rows) - 1)
+            finally:
+                csp.FETCH_SETTINGS.update(old_settings)
+        self.assertLess(point_rows, 3000)
+        self.assertGreater(csp.get_window_area([0, 0, 0, 0]) * rows_per_square_degree, 3000)
+        self.assertEqual(list(result), list(expected))
+
+    def test_get_grid_coordinates(self):
+        location = grid2latlong('NN 20512 70537', tag='OSGB36')
+        northing, easting = csp.get_grid_coordinates(location.latitude, location.longitude)
+        self.assertLessEqual(abs(northing - 770537), 1)
+        self.assertLessEqual(abs(easting - 220512), 1)
+        route = csp.add_grid_coordinates(make_grid_route())
+        route.loc[3, ['northing', 'easting']] = np.nan
+        expected = route.loc[4, 'easting']
+        route.loc[4, 'easting'] = 0
+        csp.add_grid_coordinates(route)
+        self.assertFalse(route[['northing', 'easting']].isna().any().any())
+        self.assertEqual(route.loc[4, 'easting'], 0)
+        self.assertLessEqual(abs(route.loc[3, 'easting'] - (expected - 37)), 1)
+
+    def test_grid_coordinates_scoring(self):
+        old_settings = dict(csp.FETCH_SETTINGS)
+        with grid_altitude_database():
+            route = make_grid_route()
+            route_bounds = csp.get_route_bounds(route)
+            tables = csp.get_fetch_tables(route_bounds)
+            altitude_df = csp.get_complete_route_altitude_df(route_bounds)
+            rows = csp.count_route_altitude_rows(route_bounds)
+            scores = csp.calculate_route_scariness(route.copy(), altitude_df)['scariness']
+            csp.FETCH_SETTINGS.update(mode='corridor', distance=200)
+            try:
+                corridor = csp.get_fetch_corridor(route)
+                corridor_df = csp.get_complete_route_altitude_df(route_bounds, corridor)
+                corridor_scores = csp.calculate_route_scariness(route.copy(),
+                                                                corridor_df)['scariness']
+                version = csp.get_scoring_version()
+            finally:
+                csp.FETCH_SETTINGS.update(old_settings)
+        self.assertEqual(tables, {'locations_grid43', 'locations_grid44'})
+        self.assertEqual(list(altitude_df.columns), ['northing', 'easting', 'altitude'])
+        self.assertEqual(rows, len(altitude_df))
+        self.assertLess(len(corridor_df), len(altitude_df))
+        self.assertEqual(list(scores[:10]), [0] * 10)
+        self.assertTrue((scores[-10:] > 0).all())
+        self.assertEqual(list(corridor_scores), list(scores))
+        self.assertEqual(version, f'{csp.SCORING_VERSION}-grid-corridor200')
+
 
 if __name__ == '__main__':
     unittest.main()
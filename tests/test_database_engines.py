@@ -0,0 +1,48 @@
+import unittest
+import os
+import sqlite3
+import tempfile
+from sqlalchemy.exc import OperationalError
+import database_engines
+
+
+class MyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.old_paths = dict(database_engines.DATABASE_PATHS)
+        altitudes_path = os.path.join(self.directory.name, 'altitudes.sqlite')
+        with sqlite3.connect(altitudes_path) as con:
+            con.execute('create table locations (latitude real, longitude real, altitude real)')
+        database_engines.configure_database('altitudes', altitudes_path)
+        database_engines.configure_database(
+            'waypoints', os.path.join(self.directory.name, 'waypoints.sqlite'))
+
+    def tearDown(self):
+        for database, path in self.old_paths.items():
+            database_engines.configure_database(database, path)
+        self.directory.cleanup()
+
+    def test_get_connection_reused_until_closed(self):
+        connection = database_engines.get_connection('waypoints')
+        self.assertIs(connection, database_engines.get_connection('waypoints'))
+        database_engines.close_scoped_connections()
+        self.assertTrue(connection.closed)
+        self.assertIsNot(connection, database_engines.get_connection('waypoints'))
+
+    def test_get_engine_pooled(self):
+        self.assertIs(database_engines.get_engine('waypoints'),
+                      database_engines.get_engine('waypoints'))
+
+    def test_waypoints_wal_mode(self):
+        connection = database_engines.get_connection('waypoints')
+        self.assertEqual(connection.execute('pragma journal_mode').scalar(), 'wal')
+
+    def test_altitudes_read_only(self):
+        connection = database_engines.get_connection('altitudes')
+        self.assertEqual(connection.execute('select count(*) from locations').scalar(), 0)
+        with self.assertRaises(OperationalError):
+            connection.execute('insert into locations values (1, 1, 1)')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,5 @@
 import unittest
-from get_db_table import get_tables
+from get_db_table import get_grid_table, get_grid_tables, get_tables
 from collections import Counter
 
 
@@ -11,6 +11,11 @@ class MyTestCase(unittest.TestCase):
         result = get_tables(max_long, min_long)
         self.assertEqual(Counter(expected), Counter(result))
 
+    def test_get_grid_tables(self):
+        self.assertEqual(get_grid_tables(220000, 214999.5),
+                         {'locations_grid42', 'locations_grid43', 'locations_grid44'})
+        self.assertEqual(get_grid_table(219999.9), 'locations_grid43')
+
 
 if __name__ == '__main__':
     unittest.main()
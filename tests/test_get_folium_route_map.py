@@ -1,8 +1,14 @@
 import unittest
+import os
+import tempfile
 import pandas as pd
+import administer_route_database as ard
+import calculate_scary_points as csp
+import database_engines
 import get_folium_route_map as gfrm
 from collections import Counter
 import re
+from synthetic_data import make_route, make_gpx_data, altitude_database
 
 
 class MyTestCase(unittest.TestCase):
@@ -48,11 +54,38 @@ class MyTestCase(unittest.TestCase):
                          Counter(['waypoint', 'lat', 'long', 'elevation', 'scariness', 'route',
                           'created_dt']))
 
-    def test_check_route_not_loaded(self):
-        result1 = gfrm.check_route_not_loaded('../data/carnmordeargarete.gpx')
-        self.assertTrue(result1)
-        result2 = gfrm.check_route_not_loaded('data/fakemountain.gpx')
-        self.assertFalse(result2)
+    def test_two_pass_upload_keeps_exact_scores(self):
+        gpx_data = make_gpx_data(make_route())
+        old_path = database_engines.DATABASE_PATHS['waypoints']
+        with tempfile.TemporaryDirectory() as directory, altitude_database():
+            database_engines.configure_database('waypoints',
+                                                os.path.join(directory, 'waypoints.sqlite'))
+            try:
+                two_pass = gfrm.get_route_with_scariness_from_file(
+                    gpx_data, two_pass_threshold=3, filename='route.gpx')
+                connection = ard.get_route_db_connection()
+                self.assertEqual(ard.get_route_catalog(connection), [])
+                exact = gfrm.get_route_with_scariness_from_file(gpx_data, filename='route.gpx')
+                again = gfrm.get_route_with_scariness_from_file(
+                    gpx_data, two_pass_threshold=3, filename='route.gpx')
+                entry = ard.get_route_catalog_entry(connection, 'route')
+                stored = gfrm.get_route_with_scariness_from_db('route')
+            finally:
+                database_engines.configure_database('waypoints', old_path)
+        self.assertEqual(two_pass['route'].iloc[0], 'route')
+        self.assertEqual(two_pass['refined'].dtype, bool)
+        self.assertNotIn('refined', again)
+        self.assertEqual(entry['scoring_version'], csp.get_scoring_version())
+        self.assertEqual(list(stored['scariness']), list(exact['scariness']))
+        self.assertEqual(list(again['scariness']), list(exact['scariness']))
+
+    def test_render_route_map_provisional_scores(self):
+        route = make_route().iloc[:4].reset_index(drop=True)
+        route = route.assign(waypoint=[f'WP{x + 1:04}' for x in range(4)], scariness=[2, 7, 3, 8],
+                             refined=[True, True, False, False])
+        result = gfrm.render_route_map(route, 5)
+        self.assertEqual(result.count('(provisional)'), 2)
+        self.assertNotIn('(provisional)', gfrm.render_route_map(route.drop(columns='refined'), 5))
 
     def test_translate_fear_level(self):
         self.assertEqual(gfrm.translate_fear_level(1), 6)
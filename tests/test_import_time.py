@@ -0,0 +1,49 @@
+import unittest
+import json
+import os
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Seconds the entry points may take to import, best of three, on a warm disk cache
+IMPORT_TIME_BUDGET = float(os.environ.get('IMPORT_TIME_BUDGET') or 1.5)
+DEFERRED_MODULES = ['matplotlib', 'swifter', 'dask', 'scipy', 'folium', 'branca']
+IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+print(json.dumps({{'seconds': time.perf_counter() - start,
+                  'modules': sorted(x for x in {deferred} if x in sys.modules)}}))
+"""
+
+
+def import_in_subprocess(module):
+    # With the default config, not the WARM_UP=off the tests run with (see conftest)
+    env = {x: y for x, y in os.environ.items() if x != 'WARM_UP'}
+    env['PYTHONPATH'] = REPO_DIR
+    result = subprocess.run(
+        [sys.executable, '-c', IMPORT_SCRIPT.format(module=module, deferred=DEFERRED_MODULES)],
+        env=env, cwd=REPO_DIR, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+class MyTestCase(unittest.TestCase):
+    def test_app_import_defers_heavy_modules(self):
+        self.assertEqual(import_in_subprocess('app')['modules'], [])
+
+    def test_batch_score_routes_import_defers_heavy_modules(self):
+        self.assertEqual(import_in_subprocess('batch_score_routes')['modules'], [])
+
+    def test_app_import_time_budget(self):
+        seconds = min(import_in_subprocess('app')['seconds'] for _ in range(3))
+        self.assertLess(seconds, IMPORT_TIME_BUDGET)
+
+    def test_server_entry_point_import_time_budget(self):
+        # The server entry point starts the warm-up, which by default loads the heavy modules in
+        # the background rather than holding up the server starting
+        seconds = min(import_in_subprocess('mountain_fear_finder')['seconds'] for _ in range(3))
+        self.assertLess(seconds, IMPORT_TIME_BUDGET)
+
+
+if __name__ == '__main__':
+    unittest.main()
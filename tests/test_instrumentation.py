@@ -0,0 +1,81 @@
+import unittest
+import json
+import os
+import tempfile
+import instrumentation
+
+
+class MyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.old_settings = dict(instrumentation.SETTINGS)
+        instrumentation.SETTINGS.update(enabled=True, log_file=None)
+        instrumentation.reset_metrics()
+
+    def tearDown(self):
+        instrumentation.SETTINGS.update(self.old_settings)
+        instrumentation.reset_metrics()
+
+    def test_nested_spans_are_merged(self):
+        with instrumentation.trace('request', path='/') as request_span:
+            for _ in range(3):
+                with instrumentation.span('score'):
+                    with instrumentation.span('neighbour_search'):
+                        pass
+            with instrumentation.span('render') as render_span:
+                render_span.set(points=2)
+        result = request_span.to_dict()
+        self.assertEqual(result['path'], '/')
+        self.assertEqual([x['name'] for x in result['children']], ['score', 'render'])
+        self.assertEqual(result['children'][0]['count'], 3)
+        self.assertEqual(result['children'][0]['children'][0]['count'], 3)
+        self.assertEqual(result['children'][1]['points'], 2)
+        self.assertGreaterEqual(result['seconds'], result['children'][0]['seconds'])
+
+    def test_get_prometheus_metrics(self):
+        instrumentation.observe('fetch', 0.002)
+        instrumentation.observe('fetch', 100)
+        result = instrumentation.get_prometheus_metrics()
+        self.assertIn('# TYPE mountain_fear_finder_stage_seconds histogram', result)
+        self.assertIn('mountain_fear_finder_stage_seconds_bucket{stage="fetch",le="0.001"} 0',
+                      result)
+        self.assertIn('mountain_fear_finder_stage_seconds_bucket{stage="fetch",le="0.005"} 1',
+                      result)
+        self.assertIn('mountain_fear_finder_stage_seconds_bucket{stage="fetch",le="+Inf"} 2',
+                      result)
+        self.assertIn('mountain_fear_finder_stage_seconds_count{stage="fetch"} 2', result)
+
+    def test_timing_log(self):
+        with tempfile.TemporaryDirectory() as directory:
+            log_file = os.path.join(directory, 'timing.jsonl')
+            instrumentation.SETTINGS['log_file'] = log_file
+            with instrumentation.span('untraced'):
+                pass
+            with instrumentation.trace('ingest_tile', file='NN17.asc'):
+                with instrumentation.span('read'):
+                    pass
+            with open(log_file) as lines:
+                result = [json.loads(x) for x in lines]
+        self.assertEqual(len(result), 1)
+        self.assertEqual(result[0]['file'], 'NN17.asc')
+        self.assertEqual(result[0]['children'][0]['name'], 'read')
+
+    def test_timer(self):
+        @instrumentation.timer
+        def add(first, second):
+            return first + second
+        with instrumentation.trace('job') as job_span:
+            self.assertEqual(add(1, 2), 3)
+        self.assertEqual(list(job_span.children), ['add'])
+
+    def test_disabled(self):
+        instrumentation.SETTINGS['enabled'] = False
+        started = instrumentation.start_trace('request')
+        with instrumentation.span('fetch') as fetch_span:
+            fetch_span.set(rows=1)
+        instrumentation.end_span(started)
+        self.assertIs(fetch_span, instrumentation.NO_SPAN)
+        self.assertNotIn('stage=', instrumentation.get_prometheus_metrics())
+
+
+if __name__ == '__main__':
+    unittest.main()
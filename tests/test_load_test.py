@@ -0,0 +1,39 @@
+import tempfile
+import unittest
+from pathlib import Path
+import pandas as pd
+import load_test
+
+
+class MyTestCase(unittest.TestCase):
+    def test_parse_mix(self):
+        self.assertEqual(load_test.parse_mix('view=3,fear_level=1,upload=0'),
+                         {'view': 0.75, 'fear_level': 0.25})
+        with self.assertRaises(ValueError):
+            load_test.parse_mix('view=1,delete=1')
+        with self.assertRaises(ValueError):
+            load_test.parse_mix('view=0')
+
+    def test_get_latency_summary(self):
+        result = load_test.get_latency_summary([0.1] * 9 + [1.0], ['HTTPError: 500'] * 2, 4)
+        self.assertEqual(result['requests'], 12)
+        self.assertEqual(result['error_rate'], round(2 / 12, 4))
+        self.assertEqual(result['requests_per_second'], 3)
+        self.assertEqual(result['p50_seconds'], 0.1)
+        self.assertEqual(result['max_seconds'], 1.0)
+        self.assertEqual(result['error_examples'], ['HTTPError: 500'])
+        self.assertNotIn('p50_seconds', load_test.get_latency_summary([], ['x'], 1))
+
+    def test_make_dataset(self):
+        with tempfile.TemporaryDirectory() as directory:
+            directory = Path(directory)
+            altitudes, route_files = load_test.make_dataset(directory, 8, 2, 10)
+            self.assertEqual(altitudes.shape, (8, 8))
+            self.assertEqual(len({x.read_bytes() for x in route_files}), 2)
+            self.assertTrue((directory / 'altitudes.sqlite').exists())
+            extremes = pd.read_pickle(directory / 'locations_extremes.pkl').iloc[0]
+            self.assertLess(extremes['minlat'], extremes['maxlat'])
+
+
+if __name__ == '__main__':
+    unittest.main()
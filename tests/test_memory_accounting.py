@@ -0,0 +1,139 @@
+import unittest
+import os
+import tempfile
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import sqlalchemy as db
+import benchmark_pipeline
+import calculate_scary_points as csp
+import database_engines
+import memory_accounting
+import read_contour_data as contour
+import read_gpx
+from synthetic_data import make_altitude_df, make_route
+
+
+class MyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.old_settings = dict(memory_accounting.MEMORY_SETTINGS)
+        memory_accounting.reset_stage_peaks()
+
+    def tearDown(self):
+        memory_accounting.MEMORY_SETTINGS.update(self.old_settings)
+        memory_accounting.reset_stage_peaks()
+
+    def test_get_affordable_rows(self):
+        memory_accounting.MEMORY_SETTINGS['budget'] = 0
+        self.assertIsNone(memory_accounting.get_affordable_rows(100))
+        self.assertEqual(memory_accounting.get_affordable_rows(100, limit=5), 5)
+        memory_accounting.MEMORY_SETTINGS['budget'] = 1000
+        self.assertEqual(memory_accounting.get_affordable_rows(100), 10)
+        self.assertEqual(memory_accounting.get_affordable_rows(100, limit=5), 5)
+
+    def test_check_memory_budget(self):
+        memory_accounting.MEMORY_SETTINGS['budget'] = 2 ** 20
+        memory_accounting.check_memory_budget(2 ** 20, 'Scoring')
+        with self.assertRaisesRegex(memory_accounting.MemoryBudgetExceededError,
+                                    'Scoring needs an estimated 2 MiB, more than the memory '
+                                    'budget of 1 MiB'):
+            memory_accounting.check_memory_budget(2 * 2 ** 20, 'Scoring')
+
+    def test_track_memory(self):
+        memory_accounting.MEMORY_SETTINGS['tracking'] = True
+        with memory_accounting.track_memory('outer'):
+            big = np.ones(2 ** 20)
+            del big
+            with memory_accounting.track_memory('inner'):
+                small = np.ones(2 ** 10)
+                del small
+        peaks = memory_accounting.get_stage_peaks()
+        self.assertGreaterEqual(peaks['outer'], 8 * 2 ** 20)
+        self.assertLess(peaks['inner'], 2 ** 20)
+        self.assertIn('mountain_fear_finder_stage_peak_bytes{stage="outer"}',
+                      memory_accounting.get_prometheus_metrics())
+
+    def test_split_route_into_windows(self):
+        route = pd.DataFrame({'lat': [57.0, 57.0, 57.0, 57.1, 57.1],
+                              'long': [-5.0, -5.0, -5.0, -5.0, -5.0]})
+        density = 1 / csp.get_window_area([0, 0, 0, 0])
+        self.assertEqual(csp.split_route_into_windows(route, 1, density), [(0, 3), (3, 5)])
+        self.assertEqual(csp.split_route_into_windows(route, 10, density), [(0, 5)])
+        with self.assertRaises(memory_accounting.MemoryBudgetExceededError):
+            csp.split_route_into_windows(route, 0.5, density)
+
+    def test_calculate_windowed_route_scariness(self):
+        old_paths = dict(database_engines.DATABASE_PATHS)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'altitudes.sqlite')
+            engine = db.create_engine(f'sqlite:///{path}')
+            make_altitude_df().to_sql('locations43', engine, index=False)
+            engine.dispose()
+            database_engines.configure_database('altitudes', path)
+            try:
+                route = make_route()
+                altitude_df = csp.get_complete_route_altitude_df(read_gpx.get_route_bounds(route))
+                expected = csp.calculate_route_scariness(route.copy(), altitude_df)['scariness']
+                windows = []
+                result = csp.calculate_windowed_route_scariness(
+                    route.copy(), 4000, lambda _, start, scores: windows.append(start))
+            finally:
+                for database, path in old_paths.items():
+                    database_engines.configure_database(database, path)
+        self.assertGreater(len(windows), 1)
+        self.assertEqual(list(result['scariness']), list(expected))
+
+    def test_insert_coords_into_db_table(self):
+        altitude_df = pd.DataFrame({220000.0: [100.0, 110.0], 220050.0: [120.0, 130.0]},
+                                   index=[775000.0, 775050.0])
+        engine = db.create_engine('sqlite://')
+        with engine.connect() as connection:
+            locations = contour.create_db_table(connection)
+            contour.insert_coords_into_db_table(altitude_df, 'NN', connection, locations,
+                                                batch_rows=3)
+            self.assertEqual(connection.execute('select count(*) from locations').scalar(), 4)
+            contour.clear_out_table(connection, locations)
+            contour.insert_coords_into_db_table(altitude_df.iloc[:1], 'NN', connection,
+                                                locations, batch_rows=1)
+            # A tile overlapping one already in the table is not inserted at all
+            contour.insert_coords_into_db_table(altitude_df, 'NN', connection, locations,
+                                                batch_rows=1)
+            self.assertEqual(connection.execute('select count(*) from locations').scalar(), 2)
+
+    def test_ingest_tile_in_windows(self):
+        old_directory = os.getcwd()
+        file = f'{benchmark_pipeline.GRID_SQUARE}0.asc'
+        with tempfile.TemporaryDirectory() as directory:
+            os.chdir(directory)
+            try:
+                Path('data/asc_files').mkdir(parents=True)
+                benchmark_pipeline.write_asc_tile(Path('data/asc_files') / file,
+                                                  benchmark_pipeline.make_terrain(6, 1))
+                metadata = contour.get_asc_file_header_information(Path('data/asc_files') / file)
+                altitude_df = contour.read_contour_file(Path('data/asc_files') / file)
+                expected = pd.DataFrame(list(contour.get_coords_rows(
+                    contour.double_pad_altitude_df(altitude_df), file[0:2])))
+                memory_accounting.MEMORY_SETTINGS['budget'] = \
+                    contour.estimate_ingest_bytes(metadata, 2)
+                self.assertEqual(contour.get_ingest_window_columns(metadata), 2)
+                engine = db.create_engine('sqlite://')
+                with engine.connect() as connection:
+                    locations = contour.create_db_table(connection)
+                    contour.ingest_tile(file, connection, locations)
+                    result = pd.read_sql('select * from locations', connection)
+                    memory_accounting.MEMORY_SETTINGS['budget'] = \
+                        contour.estimate_ingest_bytes(metadata, 1) - 1
+                    with self.assertRaises(memory_accounting.MemoryBudgetExceededError):
+                        contour.ingest_tile(file, connection, locations)
+                engine.dispose()
+            finally:
+                os.chdir(old_directory)
+        columns = ['latitude', 'longitude', 'altitude']
+        self.assertEqual(len(result), (4 * metadata['nrows'] - 3) * (4 * metadata['ncols'] - 3))
+        pd.testing.assert_frame_equal(
+            result[columns].sort_values(columns[:2]).reset_index(drop=True),
+            expected[columns].sort_values(columns[:2]).reset_index(drop=True))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,6 +5,7 @@ from pathlib import Path
 import numpy as np
 import datetime as dt
 import sqlalchemy as db
+import altitude_schema
 
 PADDED_ALT_DF = pd.read_pickle('padded_alt_test_df.pkl')
 
@@ -121,6 +122,19 @@ class MyTestCase(unittest.TestCase):
         self.assertIsInstance(table_df, pd.DataFrame)
         self.assertEqual(['latitude', 'longitude', 'altitude', ], list(table_df))
 
+    def test_get_coords_rows_grid(self):
+        altitude_df = pd.DataFrame({220000: [400.0, 410.0], 220012.5: [405.0, 415.0]},
+                                   index=[770012.5, 770000])
+        old_coordinates = altitude_schema.SCHEMA_SETTINGS['coordinates']
+        altitude_schema.SCHEMA_SETTINGS['coordinates'] = 'grid'
+        try:
+            result = list(contour.get_coords_rows(altitude_df, 'NN'))
+        finally:
+            altitude_schema.SCHEMA_SETTINGS['coordinates'] = old_coordinates
+        self.assertEqual(len(result), 4)
+        self.assertEqual(result[0], {'northing': 770012.5, 'easting': 220000.0, 'altitude': 400.0})
+        self.assertEqual(result[3], {'northing': 770000.0, 'easting': 220012.5, 'altitude': 415.0})
+
     # def test_insert_coords_into_db_table(self):
     #     """
     #     Used for initial testing but dangerous for regression testing - commented out
@@ -1,4 +1,6 @@
 import unittest
+import io
+import tempfile
 import read_gpx as gpx
 import pandas as pd
 from pathlib import Path
@@ -25,6 +27,27 @@ class MyTestCase(unittest.TestCase):
         self.assertEqual(234, len(result2))
         self.assertEqual(list(result2.iloc[146]), ['SGS147', 57.134084, -5.281181, 994])
 
+    def test_read_gpx_from_bytes_and_stream(self):
+        gpx_data = (b'<?xml version="1.0"?><gpx xmlns="http://www.topografix.com/GPX/1/1"><rte>'
+                    b'<rtept lat="56.79" lon="-5.04"><ele>300</ele><name>P0</name></rtept>'
+                    b'<rtept lat="56.791" lon="-5.0392"><ele>305.5</ele><name>P1</name></rtept>'
+                    b'</rte></gpx>')
+        result = gpx.read_gpx(gpx_data)
+        self.assertEqual(list(result.iloc[1]), ['P1', 56.791, -5.0392, 305.5])
+        self.assertTrue(result.equals(gpx.read_gpx(io.BytesIO(gpx_data))))
+        self.assertTrue(result.equals(gpx.read_gpx(io.StringIO(gpx_data.decode()))))
+
+    def test_read_gpx_declared_encoding(self):
+        gpx_data = ('<?xml version="1.0" encoding="ISO-8859-1"?><gpx><rte>'
+                    '<rtept lat="56.79" lon="-5.04"><ele>300</ele><name>Càrn Mòr Dearg</name>'
+                    '</rtept></rte></gpx>').encode('iso-8859-1')
+        self.assertEqual(gpx.read_gpx(gpx_data)['name'][0], 'Càrn Mòr Dearg')
+        self.assertEqual(gpx.read_gpx(io.BytesIO(gpx_data))['name'][0], 'Càrn Mòr Dearg')
+        with tempfile.TemporaryDirectory() as directory:
+            gpx_file = Path(directory) / 'latin1.gpx'
+            gpx_file.write_bytes(gpx_data)
+            self.assertEqual(gpx.read_gpx(gpx_file)['name'][0], 'Càrn Mòr Dearg')
+
     def test_pad_gpx_dataframe(self):
         file = Path('../data/macdui-cairngorm.gpx')
         result = gpx.read_gpx(file)
@@ -0,0 +1,82 @@
+import unittest
+from unittest import mock
+import numpy as np
+import calculate_scary_points as csp
+import frozen_reference
+import read_contour_data as contour
+import reference_equivalence as equivalence
+
+
+class MyTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.inputs = equivalence.make_inputs(seeds=1, tile_cells=8, points=10)
+
+    def tearDown(self):
+        for engines in equivalence.ENGINES.values():
+            for name in [x for x in engines if x not in ['reference', 'live']]:
+                del engines[name]
+
+    def test_reference_matches_itself(self):
+        for function in equivalence.ENGINES:
+            result = equivalence.check_engine(function, 'reference', self.inputs)
+            self.assertTrue(result['passed'], result)
+            self.assertEqual(result['cases'], 1)
+
+    def test_live_matches_reference(self):
+        for function in equivalence.ENGINES:
+            result = equivalence.check_engine(function, 'live', self.inputs)
+            self.assertTrue(result['passed'], result)
+
+    def test_live_change_is_caught(self):
+        def first_points(point, route_altitude_df, no_points):
+            return route_altitude_df.head(no_points)
+        with mock.patch.object(csp, 'get_neighbouring_points', first_points):
+            live = equivalence.check_engine('calculate_scariness', 'live', self.inputs)
+            reference = equivalence.check_engine('calculate_scariness', 'reference', self.inputs)
+        self.assertFalse(live['passed'])
+        self.assertTrue(reference['passed'])
+
+    def test_frozen_scoring_version(self):
+        # A deliberate change to the scores bumps SCORING_VERSION and updates frozen_reference
+        self.assertEqual(frozen_reference.FROZEN_SCORING_VERSION, csp.SCORING_VERSION)
+
+    def test_different_scores(self):
+        equivalence.register_engine('calculate_scariness', 'off_by_one',
+                                    lambda point, route_altitude_df: csp.calculate_scariness(
+                                        point, route_altitude_df) + 1)
+        result = equivalence.check_engine('calculate_scariness', 'off_by_one', self.inputs)
+        self.assertEqual(result['scores'], {'exact_match_rate': 0.0})
+        self.assertFalse(result['passed'])
+
+    def test_altitude_tolerance(self):
+        def rounded_padding(altitude_df):
+            return contour.double_pad_altitude_df(altitude_df).round(-1)
+        equivalence.register_engine('double_pad_altitude_df', 'rounded', rounded_padding)
+        result = equivalence.check_engine('double_pad_altitude_df', 'rounded', self.inputs)
+        self.assertEqual(result['coordinates']['max_abs_error'], 0)
+        self.assertTrue(0 < result['altitudes']['max_abs_error'] <= 5)
+        self.assertFalse(result['passed'])
+        equivalence.register_engine('double_pad_altitude_df', 'rounded', rounded_padding,
+                                    {'altitude_error': 5})
+        self.assertTrue(equivalence.check_engine('double_pad_altitude_df', 'rounded',
+                                                 self.inputs)['passed'])
+
+    def test_missing_rows(self):
+        def insert_half(altitude_df, grid_ref_initials, connection, table):
+            contour.insert_coords_into_db_table(altitude_df.iloc[::2], grid_ref_initials,
+                                                connection, table)
+        equivalence.register_engine('insert_coords_into_db_table', 'half', insert_half)
+        result = equivalence.check_engine('insert_coords_into_db_table', 'half', self.inputs)
+        self.assertEqual(result['altitudes']['max_abs_error'], float('inf'))
+        self.assertFalse(result['passed'])
+
+    def test_get_errors(self):
+        self.assertEqual(equivalence.get_errors([1.0, np.nan, 3.0], [1.5, np.nan, 2.0]),
+                         {'max_abs_error': 1.0, 'mean_abs_error': 0.5})
+        self.assertEqual(equivalence.get_errors([1.0], [1.0, 2.0])['max_abs_error'],
+                         float('inf'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+import json
+import pstats
+import tempfile
+from pathlib import Path
+import instrumentation
+import request_profiling
+
+
+def add(first, second):
+    with instrumentation.span('render'):
+        return first + second
+
+
+class MyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.old_settings = dict(request_profiling.PROFILE_SETTINGS)
+        request_profiling.PROFILE_SETTINGS.update(token='secret', sample_percent=0,
+                                                  directory=self.directory.name, max_profiles=2)
+
+    def tearDown(self):
+        request_profiling.PROFILE_SETTINGS.update(self.old_settings)
+        self.directory.cleanup()
+
+    def test_should_profile(self):
+        self.assertTrue(request_profiling.should_profile({'X-Profile-Token': 'secret'}))
+        self.assertFalse(request_profiling.should_profile({'X-Profile-Token': 'wrong'}))
+        self.assertFalse(request_profiling.should_profile({}))
+        request_profiling.PROFILE_SETTINGS['sample_percent'] = 100
+        self.assertTrue(request_profiling.should_profile({}))
+        request_profiling.PROFILE_SETTINGS.update(token=None, sample_percent=0)
+        self.assertFalse(request_profiling.should_profile({'X-Profile-Token': ''}))
+
+    def test_run_profiled(self):
+        self.assertEqual(request_profiling.run_profiled(True, 'my route', add, 1, second=2), 3)
+        profile_file, = Path(self.directory.name).glob('*.prof')
+        self.assertIn('add', str(pstats.Stats(str(profile_file)).stats))
+        with open(profile_file.with_suffix('.json')) as details_file:
+            details = json.load(details_file)
+        self.assertEqual(details['route'], 'my route')
+        self.assertEqual(details['stages']['name'], 'add')
+        self.assertEqual(details['stages']['children'][0]['name'], 'render')
+
+    def test_run_profiled_not_profiling(self):
+        self.assertEqual(request_profiling.run_profiled(False, 'my route', add, 1, 2), 3)
+        self.assertEqual(list(Path(self.directory.name).iterdir()), [])
+
+    def test_profiles_are_bounded(self):
+        for _ in range(4):
+            request_profiling.run_profiled(True, 'my route', add, 1, 2)
+        self.assertEqual(len(list(Path(self.directory.name).glob('*.prof'))), 2)
+        self.assertEqual(len(list(Path(self.directory.name).glob('*.json'))), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
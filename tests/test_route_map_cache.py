@@ -0,0 +1,61 @@
+import unittest
+import tempfile
+from pathlib import Path
+import route_map_cache as rmc
+
+
+class MyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.old_settings = dict(rmc.CACHE_SETTINGS)
+        rmc.clear_cache()
+
+    def tearDown(self):
+        rmc.CACHE_SETTINGS.update(self.old_settings)
+        rmc.clear_cache()
+
+    def test_cache_map_lru_eviction(self):
+        rmc.CACHE_SETTINGS.update({'size': 2, 'directory': None})
+        keys = [rmc.get_cache_key(i, 'abc', 5, '1') for i in range(3)]
+        rmc.cache_map(keys[0], 'map0')
+        rmc.cache_map(keys[1], 'map1')
+        self.assertEqual(rmc.get_cached_map(keys[0]), 'map0')
+        rmc.cache_map(keys[2], 'map2')
+        self.assertIsNone(rmc.get_cached_map(keys[1]))
+        self.assertEqual(rmc.get_cached_map(keys[0]), 'map0')
+        self.assertEqual(rmc.get_cached_map(keys[2]), 'map2')
+
+    def test_cache_map_on_disk(self):
+        with tempfile.TemporaryDirectory() as directory:
+            rmc.CACHE_SETTINGS.update({'size': 2, 'directory': directory})
+            key = rmc.get_cache_key(7, 'abc', 4, '1-simplified')
+            rmc.cache_map(key, 'map7')
+            rmc.clear_cache()
+            self.assertEqual(rmc.get_cached_map(key), 'map7')
+            rmc.clear_cache()
+            rmc.invalidate_route(7)
+            self.assertIsNone(rmc.get_cached_map(key))
+
+    def test_invalidate_route(self):
+        rmc.CACHE_SETTINGS.update({'size': 10, 'directory': None})
+        rmc.cache_map(rmc.get_cache_key(1, 'abc', 4, '1'), 'map1-4')
+        rmc.cache_map(rmc.get_cache_key(1, 'abc', 5, '1'), 'map1-5')
+        rmc.cache_map(rmc.get_cache_key(2, 'abc', 4, '1'), 'map2-4')
+        rmc.invalidate_route(1)
+        self.assertIsNone(rmc.get_cached_map(rmc.get_cache_key(1, 'abc', 4, '1')))
+        self.assertIsNone(rmc.get_cached_map(rmc.get_cache_key(1, 'abc', 5, '1')))
+        self.assertEqual(rmc.get_cached_map(rmc.get_cache_key(2, 'abc', 4, '1')), 'map2-4')
+
+    def test_rescored_route_has_new_key(self):
+        with tempfile.TemporaryDirectory() as directory:
+            rmc.CACHE_SETTINGS.update({'size': 10, 'directory': directory})
+            rmc.cache_map(rmc.get_cache_key(1, 'abc', 4, '1'), 'map-abc')
+            # e.g. re-scored in another process, which can't clear this one's memory
+            self.assertIsNone(rmc.get_cached_map(rmc.get_cache_key(1, 'def', 4, '1')))
+            self.assertIsNone(rmc.get_cached_map(rmc.get_cache_key(1, 'abc', 4, '2')))
+            rmc.clear_cache()
+            rmc.invalidate_route(1)
+            self.assertEqual(list(Path(directory).iterdir()), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+import numpy as np
+import pandas as pd
+import folium
+import route_map_layers as rml
+
+
+def make_route(no_points):
+    return pd.DataFrame({'waypoint': [f'WP{x+1:04}' for x in range(no_points)],
+                         'lat': np.linspace(56.79, 56.80, no_points),
+                         'long': np.linspace(-5.01, -5.00, no_points),
+                         'elevation': np.linspace(300, 900, no_points),
+                         'scariness': np.arange(no_points) % 9})
+
+
+def render_route_layer(route):
+    mappy = folium.Map(location=(56.795, -5.005), zoom_start=13)
+    rml.RouteLayer(route, 5, {1: 6, 2: 5, 3: 4}).add_to(mappy)
+    return mappy._repr_html_()
+
+
+class MyTestCase(unittest.TestCase):
+    def test_get_route_layer_data(self):
+        result = rml.get_route_layer_data(make_route(3))
+        self.assertEqual(result['scariness'], [0, 1, 2])
+        self.assertEqual(result['lat'], [56.79, 56.795, 56.8])
+        self.assertEqual(result['elevation'], [300.0, 600.0, 900.0])
+
+    def test_get_route_layer_data_two_pass(self):
+        route = make_route(3).assign(refined=[True, False, True])
+        self.assertEqual(rml.get_route_layer_data(route)['refined'], [1, 0, 1])
+        self.assertNotIn('refined', rml.get_route_layer_data(make_route(3)))
+
+    def test_route_layer_html(self):
+        result = render_route_layer(make_route(10))
+        self.assertIn('leaflet.markercluster.js', result)
+        self.assertIn('draw(5)', result)
+        self.assertNotIn('circle_marker', result)
+        self.assertNotIn('var marker_', result)
+        self.assertIn('fearLevelThresholds = {&quot;1&quot;:6,&quot;2&quot;:5,&quot;3&quot;:4}',
+                      result)
+
+    def test_route_layer_html_scales_with_route_length(self):
+        small = len(render_route_layer(make_route(100)))
+        large = len(render_route_layer(make_route(10100)))
+        self.assertLess((large - small) / 10000, 60)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,189 @@
+import unittest
+import datetime as dt
+import html
+import io
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+from unittest import mock
+import pandas as pd
+import administer_route_database as ard
+import database_engines
+import request_profiling
+import scoring_jobs
+from app import app
+from app.routes import get_archive_executor
+
+GPX_DATA = (b'<?xml version="1.0"?><gpx xmlns="http://www.topografix.com/GPX/1/1"><rte>'
+            b'<rtept lat="56.79" lon="-5.04"><ele>300</ele><name>P0</name></rtept>'
+            b'<rtept lat="56.791" lon="-5.0392"><ele>305</ele><name>P1</name></rtept>'
+            b'</rte></gpx>')
+
+# Runs the page's scripts and the scripts of the map frame inside it with a stub of Leaflet, then
+# changes the fear level on the page and counts the red markers the map redraws for each level
+RECOLOUR_HARNESS = r"""
+const vm = require('vm');
+const input = JSON.parse(require('fs').readFileSync(0, 'utf8'));
+const markers = [];
+function stub(path) {
+    return new Proxy(function() {}, {
+        get: function(target, prop) {
+            return typeof prop === 'symbol' ? undefined : stub(path + '.' + prop);
+        },
+        apply: function(target, self, args) {
+            if (path === 'L.marker') { markers.push(args[0]); }
+            return stub(path + '()');
+        }
+    });
+}
+function makeWindow(parent) {
+    const listeners = {};
+    const win = {parent: parent, console: console, document: stub('document'), L: stub('L'),
+        addEventListener: function(type, listener) {
+            (listeners[type] = listeners[type] || []).push(listener);
+        },
+        dispatch: function(type, event) {
+            (listeners[type] || []).forEach(function(listener) { listener(event); });
+        }};
+    win.window = win;
+    return win;
+}
+const page = makeWindow(null);
+const mapFrame = makeWindow(page);
+const fearLevel = makeWindow(null);
+mapFrame.postMessage = function(data) { mapFrame.dispatch('message', {data: data, source: page}); };
+page.document = {getElementById: function(id) {
+    return {'route-map': {contentWindow: mapFrame}, 'fear_level': fearLevel}[id];
+}};
+vm.createContext(mapFrame);
+input.mapScripts.forEach(function(script) { vm.runInContext(script, mapFrame); });
+vm.createContext(page);
+input.pageScripts.forEach(function(script) { vm.runInContext(script, page); });
+const flagged = {};
+input.fearLevels.forEach(function(level) {
+    markers.length = 0;
+    fearLevel.dispatch('input', {target: {value: level}});
+    flagged[level] = markers.length;
+});
+console.log(JSON.stringify(flagged));
+"""
+
+
+class MyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.old_paths = dict(database_engines.DATABASE_PATHS)
+        self.old_config = dict(app.config)
+        database_engines.configure_database(
+            'waypoints', os.path.join(self.directory.name, 'waypoints.sqlite'))
+        route_df = pd.DataFrame({'waypoint': ['WP0001'], 'lat': [56.1], 'long': [-5.1],
+                                 'elevation': [300.5], 'scariness': [0], 'route': 'testroute',
+                                 'created_dt': dt.datetime(2021, 9, 1)})
+        with app.app_context():
+            ard.store_route(route_df, ard.get_route_db_connection(), 'abc', '1',
+                            store_waypoints=False)
+        app.config.update(WTF_CSRF_ENABLED=False, MAX_CONTENT_LENGTH=1024,
+                          UPLOAD_ARCHIVE_DIR=os.path.join(self.directory.name, 'archive'))
+        self.client = app.test_client()
+
+    def tearDown(self):
+        app.config.clear()
+        app.config.update(self.old_config)
+        for database, path in self.old_paths.items():
+            database_engines.configure_database(database, path)
+        self.directory.cleanup()
+
+    def upload(self, gpx_data):
+        return self.client.post('/', data={'route_file': (io.BytesIO(gpx_data), 'my route.gpx'),
+                                           'route_choice': 'testroute', 'fear_level': '2'},
+                                content_type='multipart/form-data')
+
+    def wait_for_job(self, job_id):
+        for _ in range(500):
+            if scoring_jobs.get_job(job_id)['status'] in ['done', 'failed']:
+                return
+            time.sleep(0.01)
+
+    def wait_for_archive(self):
+        # The archive has a single worker, so this waits for the uploads queued before it
+        get_archive_executor().submit(lambda: None).result(timeout=5)
+
+    def test_upload_read_in_memory(self):
+        response = self.upload(GPX_DATA)
+        self.assertEqual(response.status_code, 302)
+        self.wait_for_archive()
+        self.assertFalse(os.path.exists(os.path.join(app.instance_path, 'uploaded_files',
+                                                     'my_route.gpx')))
+        archived = os.listdir(os.path.join(self.directory.name, 'archive'))
+        self.assertEqual(len(archived), 1)
+        self.assertTrue(archived[0].endswith('-my_route.gpx'))
+        second_response = self.upload(GPX_DATA)
+        self.wait_for_archive()
+        self.assertEqual(len(os.listdir(os.path.join(self.directory.name, 'archive'))), 1)
+        for job_response in [response, second_response]:
+            self.wait_for_job(job_response.headers['Location'].split('/')[-1])
+
+    def test_upload_too_large(self):
+        response = self.upload(GPX_DATA + b' ' * 1024)
+        self.assertEqual(response.status_code, 413)
+        self.assertIn(b'at most 1KB', response.data)
+
+    def test_two_pass_upload_exact_rescore(self):
+        app.config.update(SCORING_MODE='two-pass', UPLOAD_ARCHIVE_DIR=None)
+        submit_job = scoring_jobs.submit_job
+        for rescore, job_count in [(False, 1), (True, 2)]:
+            app.config.update(TWO_PASS_EXACT_RESCORE=rescore)
+            job_ids = []
+            with mock.patch.object(scoring_jobs, 'submit_job',
+                                   side_effect=lambda *args, **kwargs: job_ids.append(
+                                       submit_job(*args, **kwargs)) or job_ids[-1]):
+                self.assertEqual(self.upload(GPX_DATA).status_code, 302)
+            for job_id in job_ids:
+                self.wait_for_job(job_id)
+            self.assertEqual(len(job_ids), job_count)
+
+    @unittest.skipIf(shutil.which('node') is None, 'needs node to run the page scripts')
+    def test_fear_level_recolours_route_layer(self):
+        route_df = pd.DataFrame({'waypoint': ['WP0001', 'WP0002', 'WP0003', 'WP0004'],
+                                 'lat': [56.1, 56.2, 56.3, 56.4], 'long': [-5.1, -5.2, -5.3, -5.4],
+                                 'elevation': [300.5, 400, 500, 600], 'scariness': [3, 5, 7, 9],
+                                 'route': 'layerroute', 'created_dt': dt.datetime(2021, 9, 1)})
+        with app.app_context():
+            ard.store_route(route_df, ard.get_route_db_connection(), 'def', '1',
+                            store_waypoints=False)
+        app.config.update(MAP_RENDER_MODE='layer')
+        response = self.client.post('/', data={'route_choice': 'layerroute', 'fear_level': '2'})
+        page = response.get_data(as_text=True)
+        route_map = html.unescape(re.search(r'<iframe id="route-map" srcdoc="([^"]*)"',
+                                            page).group(1))
+        # The map has to be the document of the page's frame, not a frame nested inside it
+        self.assertNotIn('<iframe', route_map)
+        harness_input = {'mapScripts': re.findall(r'<script>(.*?)</script>', route_map, re.S),
+                         'pageScripts': [x for x in re.findall(r'<script>(.*?)</script>', page,
+                                                               re.S) if 'route-map' in x],
+                         'fearLevels': ['1', '3']}
+        result = subprocess.run(['node', '-e', RECOLOUR_HARNESS], input=json.dumps(harness_input),
+                                capture_output=True, text=True, check=True)
+        self.assertEqual(json.loads(result.stdout), {'1': 2, '3': 3})
+
+    def test_profiled_request(self):
+        old_settings = dict(request_profiling.PROFILE_SETTINGS)
+        request_profiling.PROFILE_SETTINGS.update(
+            token='secret', directory=os.path.join(self.directory.name, 'profiles'))
+        try:
+            response = self.client.post('/', data={'route_choice': 'testroute', 'fear_level': '2'},
+                                        headers={'X-Profile-Token': 'secret'})
+        finally:
+            request_profiling.PROFILE_SETTINGS.update(old_settings)
+        self.assertEqual(response.status_code, 200)
+        profiles = os.listdir(os.path.join(self.directory.name, 'profiles'))
+        self.assertEqual(sorted(x.split('.')[-1] for x in profiles), ['json', 'prof'])
+        self.assertTrue(all(x.split('.')[0].endswith('-testroute') for x in profiles))
+
+
+if __name__ == '__main__':
+    unittest.main()
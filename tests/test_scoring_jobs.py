@@ -0,0 +1,186 @@
+import unittest
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from flask import abort
+import database_engines
+import scoring_jobs
+
+
+def score_route(route_name, progress=None, on_segment=None):
+    route = pd.DataFrame({'route': route_name, 'lat': [56.1, 56.2, 56.3],
+                          'long': [-5.1, -5.2, -5.3], 'elevation': [100.0, 120.0, 90.0],
+                          'scariness': [3, 7, 1]})
+    for stage in scoring_jobs.SCORING_STAGES:
+        progress(stage)
+    on_segment(route, 0, [3, 7])
+    on_segment(route, 2, [1])
+    return route
+
+
+def get_job_in_process(waypoints_path, job_id):
+    database_engines.configure_database('waypoints', waypoints_path)
+    return scoring_jobs.get_job(job_id)
+
+
+class MyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.old_path = database_engines.DATABASE_PATHS['waypoints']
+        database_engines.configure_database(
+            'waypoints', os.path.join(self.directory.name, 'waypoints.sqlite'))
+
+    def tearDown(self):
+        database_engines.configure_database('waypoints', self.old_path)
+        self.directory.cleanup()
+
+    def test_submit_job(self):
+        job_id = scoring_jobs.submit_job(2, score_route, 'testroute')
+        for _ in range(500):
+            result = scoring_jobs.get_job(job_id)
+            if result['status'] == 'done':
+                break
+            time.sleep(0.01)
+        self.assertEqual(result['status'], 'done')
+        self.assertEqual(result['route'], 'testroute')
+        self.assertEqual(result['fear_level'], 2)
+        self.assertEqual(set(result['stages'].values()), {'done'})
+
+    def test_progress_reporter(self):
+        job_id = scoring_jobs.create_job(1)
+        release = threading.Event()
+        stages = []
+
+        def slow_score_route(progress=None, on_segment=None):
+            progress('read')
+            progress('fetch')
+            stages.append(scoring_jobs.get_job(job_id))
+            release.wait(5)
+            return pd.DataFrame({'route': ['slowroute']})
+
+        worker = threading.Thread(target=scoring_jobs.run_job,
+                                  args=(job_id, slow_score_route))
+        worker.start()
+        while not stages:
+            time.sleep(0.01)
+        self.assertEqual(stages[0]['status'], 'running')
+        self.assertEqual(stages[0]['stage'], 'fetch')
+        self.assertEqual(stages[0]['stages'], {'read': 'done', 'fetch': 'running',
+                                               'score': 'pending', 'store': 'pending'})
+        release.set()
+        worker.join()
+        self.assertEqual(scoring_jobs.get_job(job_id)['status'], 'done')
+
+    def test_run_job_failed(self):
+        def out_of_bounds(progress=None, on_segment=None):
+            abort(400)
+
+        def broken(progress=None, on_segment=None):
+            raise ValueError('no points')
+
+        job_id = scoring_jobs.create_job(1)
+        scoring_jobs.run_job(job_id, out_of_bounds)
+        self.assertEqual(scoring_jobs.get_job(job_id)['status'], 'failed')
+        self.assertEqual(scoring_jobs.get_job(job_id)['error'], 'out_of_bounds')
+        job_id = scoring_jobs.create_job(1)
+        scoring_jobs.run_job(job_id, broken)
+        self.assertEqual(scoring_jobs.get_job(job_id)['error'], 'ValueError: no points')
+
+    def test_create_job_forgets_old_finished_jobs(self):
+        old_settings = dict(scoring_jobs.JOB_SETTINGS)
+        scoring_jobs.JOB_SETTINGS['history'] = 2
+        try:
+            running = scoring_jobs.create_job(1)
+            finished = []
+            for _ in range(3):
+                finished.append(scoring_jobs.create_job(1))
+                scoring_jobs.update_job(finished[-1], status='done')
+            scoring_jobs.create_job(1)
+            self.assertIsNotNone(scoring_jobs.get_job(running))
+            self.assertIsNone(scoring_jobs.get_job(finished[0]))
+            self.assertIsNotNone(scoring_jobs.get_job(finished[-1]))
+        finally:
+            scoring_jobs.JOB_SETTINGS.update(old_settings)
+
+    def test_get_job_events(self):
+        job_id = scoring_jobs.create_job(1)
+        scoring_jobs.run_job(job_id, score_route, 'testroute')
+        events = list(scoring_jobs.get_job_events(job_id))
+        self.assertEqual([x[0] for x in events], ['progress', 'points', 'segment', 'segment',
+                                                  'done'])
+        self.assertEqual(events[1][1], {'lat': [56.1, 56.2, 56.3], 'long': [-5.1, -5.2, -5.3]})
+        self.assertEqual(events[3][1], {'start': 2, 'scores': [1]})
+        self.assertEqual(events[4][1], {'route': 'testroute', 'error': None})
+        self.assertNotIn('segments', scoring_jobs.get_job(job_id))
+
+    def test_get_job_events_as_they_happen(self):
+        job_id = scoring_jobs.create_job(1)
+        events = scoring_jobs.get_job_events(job_id, timeout=0.01)
+        self.assertEqual(next(events)[0], 'progress')
+        self.assertEqual(next(events)[0], 'keepalive')
+        threading.Timer(0.05, scoring_jobs.run_job, (job_id, score_route, 'testroute')).start()
+        names = [x[0] for x in events if x[0] not in ['keepalive', 'progress']]
+        self.assertEqual(names[-3:], ['segment', 'segment', 'done'])
+
+    def test_keep_result(self):
+        kept = scoring_jobs.create_job(1, keep_result=True)
+        scoring_jobs.run_job(kept, score_route, 'testroute')
+        dropped = scoring_jobs.create_job(1)
+        scoring_jobs.run_job(dropped, score_route, 'testroute')
+        self.assertEqual(list(scoring_jobs.get_job_result(kept)['scariness']), [3, 7, 1])
+        self.assertIsNone(scoring_jobs.get_job_result(dropped))
+        self.assertNotIn('result', scoring_jobs.get_job(kept))
+        self.assertNotIn('refined', scoring_jobs.get_job_result(kept))
+
+    def test_keep_two_pass_result(self):
+        def score_route_two_pass(route_name, progress=None, on_segment=None):
+            return score_route(route_name, progress, on_segment).assign(
+                refined=[False, True, False])
+
+        job_id = scoring_jobs.create_job(1, keep_result=True)
+        scoring_jobs.run_job(job_id, score_route_two_pass, 'testroute')
+        self.assertEqual(list(scoring_jobs.get_job_result(job_id)['refined']),
+                         [False, True, False])
+
+    def test_get_job_from_another_process(self):
+        job_id = scoring_jobs.create_job(2)
+        scoring_jobs.run_job(job_id, score_route, 'testroute')
+        with ProcessPoolExecutor(max_workers=1,
+                                 mp_context=multiprocessing.get_context('spawn')) as executor:
+            result = executor.submit(get_job_in_process,
+                                     database_engines.DATABASE_PATHS['waypoints'], job_id).result()
+        self.assertEqual(result, scoring_jobs.get_job(job_id))
+        self.assertEqual(result['status'], 'done')
+
+    def test_reclaim_stale_jobs(self):
+        dead = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'],
+                              capture_output=True, text=True, check=True)
+        orphaned = scoring_jobs.create_job(1)
+        scoring_jobs.update_job(orphaned, status='running', pid=int(dead.stdout))
+        timed_out = scoring_jobs.create_job(1)
+        scoring_jobs.update_job(timed_out, created=time.time() - 2 * scoring_jobs.JOB_SETTINGS[
+            'timeout'])
+        queued = scoring_jobs.create_job(1)
+        finished = scoring_jobs.create_job(1)
+        scoring_jobs.run_job(finished, score_route, 'testroute')
+        # As when a new process starts using the jobs tables
+        scoring_jobs._TABLES_CREATED.clear()
+        for job_id in [orphaned, timed_out]:
+            self.assertEqual(scoring_jobs.get_job(job_id)['status'], 'failed')
+            self.assertEqual(scoring_jobs.get_job(job_id)['error'], 'abandoned')
+        self.assertEqual(scoring_jobs.get_job(queued)['status'], 'queued')
+        self.assertEqual(scoring_jobs.get_job(finished)['status'], 'done')
+        self.assertEqual([x[0] for x in scoring_jobs.get_job_events(orphaned)][-1], 'failed')
+
+    def test_get_job_missing(self):
+        self.assertIsNone(scoring_jobs.get_job('missing'))
+
+
+if __name__ == '__main__':
+    unittest.main()
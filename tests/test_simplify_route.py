@@ -0,0 +1,37 @@
+import unittest
+import numpy as np
+import simplify_route as sr
+import calculate_scary_points as csp
+from synthetic_data import make_altitude_df, make_route
+
+
+class MyTestCase(unittest.TestCase):
+    def test_douglas_peucker(self):
+        points = np.array([[0, 0], [1, 0.1], [2, -0.1], [3, 5], [4, 6], [5, 7]])
+        result = sr.douglas_peucker(points, 1)
+        self.assertEqual(list(result), [True, False, True, True, False, True])
+        self.assertEqual(list(sr.douglas_peucker(points[:2], 1)), [True, True])
+
+    def test_get_steep_point_mask(self):
+        result = sr.get_steep_point_mask(make_route(), make_altitude_df())
+        self.assertFalse(result[0])
+        self.assertTrue(result[-1])
+
+    def test_interpolate_scores(self):
+        distances = np.array([0, 1, 2, 3, 4])
+        scored = np.array([True, False, True, False, True])
+        result = sr.interpolate_scores(distances, scored, [0, 4, 2])
+        self.assertEqual(list(result), [0, 2, 4, 3, 2])
+
+    def test_simplified_route_scariness_matches_full(self):
+        altitude_df = make_altitude_df()
+        route = make_route()
+        to_score = sr.get_points_to_score(route, altitude_df)
+        self.assertLess(to_score.sum(), len(route))
+        full = csp.calculate_route_scariness(route.copy(), altitude_df)
+        simplified = csp.calculate_route_scariness(route.copy(), altitude_df, simplify=True)
+        self.assertEqual(list(full['scariness']), list(simplified['scariness']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+import numpy as np
+import calculate_scary_points as csp
+import two_pass_scoring as tps
+from synthetic_data import make_altitude_df, make_route
+
+
+class MyTestCase(unittest.TestCase):
+    def test_coarsen_altitude_df(self):
+        altitude_df = make_altitude_df()
+        result = tps.coarsen_altitude_df(altitude_df, 3)
+        self.assertLess(len(result), len(altitude_df) / 6)
+        self.assertEqual(list(result), ['latitude', 'longitude', 'altitude'])
+        self.assertAlmostEqual(result['altitude'].max(), altitude_df['altitude'].max(), delta=30)
+        self.assertIs(tps.coarsen_altitude_df(altitude_df, 1), altitude_df)
+
+    def test_get_decimated_mask(self):
+        self.assertEqual(list(tps.get_decimated_mask(6, 4)),
+                         [True, False, False, False, True, True])
+
+    def test_get_points_to_refine(self):
+        result = tps.get_points_to_refine(np.array([2, 3, 4, 5, 6, 7]), 5, margin=1)
+        self.assertEqual(list(result), [False, False, False, True, True, False])
+
+    def test_calculate_route_scariness_two_pass(self):
+        altitude_df = make_altitude_df()
+        reported = []
+        result = tps.calculate_route_scariness_two_pass(
+            make_route(), altitude_df, 3,
+            lambda route, start, scores, provisional=False, refined=None:
+            reported.append((provisional, refined)))
+        self.assertEqual(len(result), len(make_route()))
+        self.assertEqual([x[0] for x in reported], [True, False])
+        self.assertEqual(list(reported[1][1]), list(np.flatnonzero(result['refined'])))
+
+    def test_two_pass_matches_exact_with_wide_margin(self):
+        altitude_df = make_altitude_df()
+        exact = csp.calculate_route_scariness(make_route(), altitude_df)
+        result = tps.calculate_route_scariness_two_pass(make_route(), altitude_df, 3, margin=17)
+        self.assertTrue(result['refined'].all())
+        self.assertEqual(list(result['scariness']), list(exact['scariness']))
+
+    def test_get_accuracy_report(self):
+        result = tps.get_accuracy_report(make_route(), make_altitude_df(), 3)
+        self.assertEqual(result['points'], len(make_route()))
+        self.assertLessEqual(result['provisional_seconds'], result['two_pass_seconds'])
+        self.assertGreaterEqual(result['flagged_match_rate'], 0)
+        self.assertLessEqual(result['flagged_match_rate'], 1)
+
+    def test_get_scoring_version(self):
+        self.assertNotEqual(tps.get_scoring_version(4), csp.get_scoring_version())
+        self.assertNotEqual(tps.get_scoring_version(4), tps.get_scoring_version(5))
+
+
+if __name__ == '__main__':
+    unittest.main()
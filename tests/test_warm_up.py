@@ -0,0 +1,80 @@
+import unittest
+import os
+import sqlite3
+import tempfile
+import pandas as pd
+import calculate_scary_points as csp
+import database_engines
+from app import app, warm_up
+from config import Config
+
+
+class MyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.old_paths = dict(database_engines.DATABASE_PATHS)
+        self.old_extremes_file = Config.LOCATIONS_EXTREMES_FILE
+        self.old_state = dict(warm_up.WARM_UP_STATE)
+        altitudes_path = os.path.join(self.directory.name, 'altitudes.sqlite')
+        with sqlite3.connect(altitudes_path) as con:
+            con.execute('create table locations42 (latitude real, longitude real, altitude real, '
+                        'primary key (latitude, longitude))')
+            con.executemany('insert into locations42 values (?, ?, ?)',
+                            [(56.8 + x / 1000, -5.02, 300 + x) for x in range(100)])
+        database_engines.configure_database('altitudes', altitudes_path)
+        database_engines.configure_database(
+            'waypoints', os.path.join(self.directory.name, 'waypoints.sqlite'))
+        Config.LOCATIONS_EXTREMES_FILE = os.path.join(self.directory.name, 'extremes.pkl')
+        pd.DataFrame({'maxlat': [56.9], 'minlat': [56.8], 'maxlong': [-5.0],
+                      'minlong': [-5.05]}).to_pickle(Config.LOCATIONS_EXTREMES_FILE)
+        csp.get_locations_extremes.cache_clear()
+
+    def tearDown(self):
+        Config.LOCATIONS_EXTREMES_FILE = self.old_extremes_file
+        csp.get_locations_extremes.cache_clear()
+        warm_up.WARM_UP_STATE.clear()
+        warm_up.WARM_UP_STATE.update(self.old_state)
+        for database, path in self.old_paths.items():
+            database_engines.configure_database(database, path)
+        self.directory.cleanup()
+
+    def test_get_warm_up_regions(self):
+        self.assertEqual(warm_up.get_warm_up_regions('56.9,-5.0,56.8,-5.05; 57,-4,56,-5'),
+                         [[56.9, -5.0, 56.8, -5.05], [57, -4, 56, -5]])
+        self.assertEqual(warm_up.get_warm_up_regions(''), [])
+
+    def test_warm_up_ready(self):
+        warm_up.warm_up({'WARM_UP_REGIONS': '56.85,-5.01,56.82,-5.03'})
+        state = warm_up.WARM_UP_STATE
+        self.assertEqual(state['status'], 'ready')
+        self.assertEqual(state['steps']['indexes']['loaded'], 1)
+        self.assertEqual(state['steps']['catalog']['loaded'], 0)
+        self.assertGreater(state['steps']['regions']['loaded'], 0)
+        self.assertFalse(os.path.exists(database_engines.DATABASE_PATHS['waypoints']))
+        response = app.test_client().get('/ready')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['status'], 'ready')
+
+    def test_warm_up_failed(self):
+        Config.LOCATIONS_EXTREMES_FILE = os.path.join(self.directory.name, 'missing.pkl')
+        csp.get_locations_extremes.cache_clear()
+        warm_up.warm_up({'WARM_UP_REGIONS': ''})
+        self.assertEqual(warm_up.WARM_UP_STATE['steps']['coverage']['status'], 'failed')
+        self.assertEqual(warm_up.WARM_UP_STATE['steps']['catalog']['status'], 'done')
+        self.assertEqual(app.test_client().get('/ready').status_code, 503)
+
+    def test_warm_up_leaves_catalog_alone(self):
+        with sqlite3.connect(database_engines.DATABASE_PATHS['waypoints']) as con:
+            con.execute('create table waypoints (route text, waypoint text, lat real, long real, '
+                        'elevation real, scariness integer, created_dt timestamp)')
+        warm_up.warm_up({'WARM_UP_REGIONS': ''})
+        self.assertEqual(warm_up.WARM_UP_STATE['steps']['catalog']['status'], 'done')
+        self.assertEqual(warm_up.WARM_UP_STATE['steps']['catalog']['loaded'], 0)
+        with sqlite3.connect(database_engines.DATABASE_PATHS['waypoints']) as con:
+            tables = [x[0] for x in con.execute("select name from sqlite_master "
+                                                "where type = 'table'")]
+        self.assertEqual(tables, ['waypoints'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,231 @@
+"""
+Two pass scoring of routes for interactive use: a quick provisional pass scores a decimated route
+against a coarse altitude grid, then a refinement pass rescores at full resolution only the points
+whose provisional score is close enough to the fear threshold that it could be on the wrong side
+of it. Run as a script to compare the accuracy and speed of the two pass scores with the exact
+scores for gpx route files
+"""
+
+import argparse
+import json
+from time import perf_counter
+import numpy as np
+import altitude_schema
+import calculate_scary_points as csp
+import read_gpx
+import simplify_route
+from instrumentation import timer
+
+COARSE_FACTOR = 3
+DECIMATION = 4
+REFINE_MARGIN = 1
+
+
+def get_scoring_version(scariness_threshold):
+    """
+    Gets the version of the scoring algorithm that stored two pass results are keyed by. Only the
+    scores close to the threshold are refined, so results for one threshold aren't reused for
+    another
+    :param scariness_threshold: int, points scarier than this are flagged
+    :return: string
+    """
+    return f'{csp.SCORING_VERSION}{csp.get_fetch_version()}-two-pass-{int(scariness_threshold)}'
+
+
+def get_grid_spacing(altitude_df):
+    """
+    Estimates the spacing of the points in an altitudes dataframe, in degrees (or metres in OS
+    grid coordinates), from the number of points in the area they cover
+    :param altitude_df: pandas Dataframe with columns latitude, longitude, altitude
+    :return: float
+    """
+    latitude, longitude = altitude_schema.get_coordinates()
+    area = (np.ptp(altitude_df[latitude].to_numpy())
+            * np.ptp(altitude_df[longitude].to_numpy()))
+    return float(np.sqrt(area / len(altitude_df))) if area > 0 else 0.0
+
+
+@timer
+def coarsen_altitude_df(altitude_df, factor=COARSE_FACTOR):
+    """
+    Coarsens an altitudes dataframe by averaging the points in square cells of factor times the
+    spacing of the points, leaving about 1 / factor ** 2 of the points
+    :param altitude_df: pandas Dataframe with columns latitude, longitude, altitude
+    :param factor: int
+    :return: pandas Dataframe with columns latitude, longitude, altitude
+    """
+    cell = get_grid_spacing(altitude_df) * factor
+    if factor <= 1 or cell == 0:
+        return altitude_df
+    coordinates = altitude_schema.get_coordinates()
+    cells = [np.floor(altitude_df[x] / cell) for x in coordinates]
+    return altitude_df.groupby(cells, sort=False)[coordinates + ['altitude']].mean(
+        ).reset_index(drop=True)
+
+
+def get_decimated_mask(point_count, decimation=DECIMATION):
+    """
+    Picks out every decimation-th point of a route, and the last point
+    :param point_count: int
+    :param decimation: int
+    :return: numpy array of booleans, True for each point to score
+    """
+    mask = np.zeros(point_count, dtype=bool)
+    mask[::max(1, decimation)] = True
+    mask[-1:] = True
+    return mask
+
+
+def score_points(normalised_route, altitude_df, mask):
+    """
+    Calculates the scariness of the picked out points of a route
+    :param normalised_route: pandas Dataframe, route normalised to the altitude data
+    :param altitude_df: pandas Dataframe with columns latitude, longitude, altitude
+    :param mask: numpy array of booleans, True for each point to score
+    :return: numpy array of ints, one score per picked out point
+    """
+    if not mask.any():
+        return np.array([], dtype=int)
+    return normalised_route.loc[mask, altitude_schema.get_route_columns()].apply(
+        csp.calculate_scariness, axis=1, route_altitude_df=altitude_df).to_numpy(dtype=int)
+
+
+@timer
+def calculate_provisional_scariness(normalised_route, altitude_df, coarse_factor=COARSE_FACTOR,
+                                    decimation=DECIMATION):
+    """
+    Calculates provisional scores for every point in a route, by scoring a decimated route
+    against a coarse altitude grid and interpolating the scores for the points in between
+    :param normalised_route: pandas Dataframe, route normalised to the altitude data
+    :param altitude_df: pandas Dataframe with columns latitude, longitude, altitude
+    :param coarse_factor: int, see coarsen_altitude_df
+    :param decimation: int, see get_decimated_mask
+    :return: numpy array of ints, one score per point
+    """
+    coarse_df = coarsen_altitude_df(altitude_df, coarse_factor)
+    mask = get_decimated_mask(len(normalised_route), decimation)
+    return simplify_route.interpolate_scores(
+        simplify_route.get_route_distances(normalised_route), mask,
+        score_points(normalised_route, coarse_df, mask))
+
+
+def get_points_to_refine(provisional_scores, scariness_threshold, margin=REFINE_MARGIN):
+    """
+    Picks out the points whose provisional score is within the margin of the fear threshold, so
+    could be flagged differently by the exact score
+    :param provisional_scores: numpy array of ints
+    :param scariness_threshold: int, points scarier than this are flagged
+    :param margin: int
+    :return: numpy array of booleans, True for each point to refine
+    """
+    provisional_scores = np.asarray(provisional_scores)
+    return ((provisional_scores > scariness_threshold - margin)
+            & (provisional_scores <= scariness_threshold + margin))
+
+
+@timer
+def calculate_route_scariness_two_pass(route, altitude_df, scariness_threshold, on_segment=None,
+                                       coarse_factor=COARSE_FACTOR, decimation=DECIMATION,
+                                       margin=REFINE_MARGIN):
+    """
+    For each point in a route, calculate the scariness of that point /16 in two passes: first
+    provisional scores for the whole route (see calculate_provisional_scariness), then exact
+    scores for the points near the fear threshold
+    :param route: pandas Dataframe from .gpx file
+    :param altitude_df: pandas Dataframe containing Location data (latitude, longitude, altitude)
+                        surrounding the Route
+    :param scariness_threshold: int, points scarier than this are flagged
+    :param on_segment: function called with the route, 0 and the provisional scores with
+                       provisional=True, then with the route, 0 and the final scores with the
+                       indices of the refined points as refined
+    :param coarse_factor: int, see coarsen_altitude_df
+    :param decimation: int, see get_decimated_mask
+    :param margin: int, see get_points_to_refine
+    :return: pandas Dataframe, with columns scariness and refined (True for the points scored
+             at full resolution)
+    """
+    normalised_route = csp.normalise_points(route.copy(), altitude_df)
+    scores = calculate_provisional_scariness(normalised_route, altitude_df, coarse_factor,
+                                             decimation)
+    if on_segment is not None:
+        on_segment(route, 0, scores, provisional=True)
+    refine = get_points_to_refine(scores, scariness_threshold, margin)
+    scores[refine] = score_points(normalised_route, altitude_df, refine)
+    if on_segment is not None:
+        on_segment(route, 0, scores, refined=np.flatnonzero(refine))
+    route['scariness'] = scores
+    route['refined'] = refine
+    return route
+
+
+def get_accuracy_report(route, altitude_df, scariness_threshold, coarse_factor=COARSE_FACTOR,
+                        decimation=DECIMATION, margin=REFINE_MARGIN):
+    """
+    Compares the provisional and two pass scores of a route with its exact scores
+    :param route: pandas Dataframe from .gpx file, padded
+    :param altitude_df: pandas Dataframe containing Location data (latitude, longitude, altitude)
+                        surrounding the Route
+    :param scariness_threshold: int, points scarier than this are flagged
+    :param coarse_factor: int, see coarsen_altitude_df
+    :param decimation: int, see get_decimated_mask
+    :param margin: int, see get_points_to_refine
+    :return: dict
+    """
+    start = perf_counter()
+    exact = csp.calculate_route_scariness(route.copy(), altitude_df)['scariness'].to_numpy()
+    exact_seconds = perf_counter() - start
+    provisional_scores = {}
+
+    def record_provisional(_, __, scores, provisional=False, refined=None):
+        if provisional:
+            provisional_scores.update(seconds=perf_counter() - start, scores=np.array(scores))
+    start = perf_counter()
+    two_pass = calculate_route_scariness_two_pass(
+        route.copy(), altitude_df, scariness_threshold, record_provisional, coarse_factor,
+        decimation, margin)
+    two_pass_seconds = perf_counter() - start
+    provisional = provisional_scores['scores']
+    scores = two_pass['scariness'].to_numpy()
+    return {'points': len(route),
+            'scariness_threshold': scariness_threshold,
+            'refined_points': int(two_pass['refined'].sum()),
+            'exact_seconds': round(exact_seconds, 3),
+            'provisional_seconds': round(provisional_scores['seconds'], 3),
+            'two_pass_seconds': round(two_pass_seconds, 3),
+            'provisional_exact_match_rate': round(float(np.mean(provisional == exact)), 4),
+            'provisional_mean_absolute_error': round(float(np.mean(abs(provisional - exact))),
+                                                     4),
+            'two_pass_exact_match_rate': round(float(np.mean(scores == exact)), 4),
+            'flagged_match_rate': round(float(np.mean(
+                (scores > scariness_threshold) == (exact > scariness_threshold))), 4)}
+
+
+def main(argv=None):
+    """
+    Prints an accuracy and speed report (see get_accuracy_report) as one line of json for each
+    gpx file given on the command line
+    :param argv: list of strings, defaults to the command line arguments
+    """
+    parser = argparse.ArgumentParser(
+        description='Compare two pass scoring of gpx routes with exact scoring')
+    parser.add_argument('route_files', nargs='+', help='gpx files')
+    parser.add_argument('--threshold', type=int, default=5,
+                        help='scariness threshold, points scarier than this are flagged')
+    parser.add_argument('--coarse-factor', type=int, default=COARSE_FACTOR)
+    parser.add_argument('--decimation', type=int, default=DECIMATION)
+    parser.add_argument('--margin', type=int, default=REFINE_MARGIN)
+    args = parser.parse_args(argv)
+    for route_file in args.route_files:
+        route = read_gpx.pad_gpx_dataframe(read_gpx.read_gpx(route_file))
+        route_bounds = csp.get_route_bounds(route)
+        if not csp.check_route_bounds_fit_location_data(route_bounds):
+            print(json.dumps({'file': route_file, 'status': 'out_of_bounds'}), flush=True)
+            continue
+        altitude_df = csp.get_complete_route_altitude_df(route_bounds)
+        report = get_accuracy_report(route, altitude_df, args.threshold, args.coarse_factor,
+                                     args.decimation, args.margin)
+        print(json.dumps({'file': route_file, **report}), flush=True)
+
+
+if __name__ == '__main__':
+    main()